@@ -86,9 +86,8 @@ def main():
 
     counter = 0
     while counter < max_updates or max_updates < 1:
-        if publish.get_reset_flag():
+        if publish.reset_requested(topic):
             shelp.clear()
-            publish.clear_reset_flag()
         shelp.add(np.random.randint(10))
         shelp.publish()
 
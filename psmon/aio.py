@@ -0,0 +1,163 @@
+"""
+Asyncio based publisher and subscriber for psmon.
+
+This module requires python 3.5 or newer and is left out of installs on older
+versions of python.
+
+The AsyncPublisher only has a data socket, so the reset, resync and crop
+requests clients send to the comm port of a ZMQPublisher are never answered.
+psplot clients of an AsyncPublisher log these requests as timed out, and
+append-stream topics can't be resynced, so clients which miss a message only
+recover at the next keyframe.
+"""
+import asyncio
+import logging
+import zmq
+import zmq.asyncio
+
+from psmon import app, config
+
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncPublisher(app.PublisherBase):
+    """
+    An asyncio based publisher which uses the same wire format and last-value
+    cache semantics as ZMQPublisher, so psplot clients can subscribe to it
+    directly. Messages are sent from the calling coroutine without the inproc
+    proxy socket and thread used by ZMQPublisher.
+
+    If 'nodrop' is set, sends wait while the buffer of a subscriber is full
+    instead of dropping the message for that subscriber. This gives back
+    pressure to the publishing coroutine.
+    """
+    def __init__(self, bufsize=config.APP_BUFFER, nodrop=False, sub_callback=None,
+                 cache_bytes=config.APP_CACHE_BYTES, cache_ttl=config.APP_CACHE_TTL, context=None):
+        super(AsyncPublisher, self).__init__(sub_callback, cache_bytes, cache_ttl)
+        self.context = context or zmq.asyncio.Context.instance()
+        self.data_socket = self.context.socket(zmq.XPUB)
+        self.bufsize = bufsize
+        self.nodrop = nodrop
+        self.initialized = False
+        self._sub_task = None
+
+    @property
+    def data_endpoint(self):
+        return self.data_socket.getsockopt(zmq.LAST_ENDPOINT)
+
+    def initialize(self, port=config.APP_PORT):
+        """
+        Binds the data socket and starts listening for subscriptions. This needs
+        to be called with a running event loop. Returns the port that was bound,
+        which is the first free one starting from 'port'.
+        """
+        if self.initialized:
+            LOG.debug('Publisher is already initialized - Nothing to do')
+            return
+
+        self.data_socket.set_hwm(self.bufsize)
+        if hasattr(zmq, 'XPUB_VERBOSER'):
+            self.data_socket.setsockopt(zmq.XPUB_VERBOSER, True)
+        else:
+            self.data_socket.setsockopt(zmq.XPUB_VERBOSE, True)
+        if self.nodrop:
+            self.data_socket.setsockopt(zmq.XPUB_NODROP, True)
+
+        for offset in range(config.APP_BIND_ATTEMPT):
+            try:
+                self.data_socket.bind('tcp://*:%d' % (port + offset))
+            except zmq.ZMQError:
+                LOG.warning('Unable to bind publisher to data port: %d', port + offset)
+                continue
+            self.initialized = True
+            self._sub_task = asyncio.ensure_future(self._sub_listener())
+            LOG.info('Initialized async publisher. Data port: %d', port + offset)
+            return port + offset
+
+        LOG.warning('Unable to initialize publisher after %d attempts - disabling!', config.APP_BIND_ATTEMPT)
+
+    async def send(self, topic, data):
+        """
+        Publishes a data object to all clients suscribed to the topic.
+        """
+        if self.initialized:
+            do_send, info = self._prepare_send(topic, data)
+            if do_send:
+                if info is not None:
+                    await self._send_topic_list(self.registry.add(info))
+                frames = self.serializer.dumps(data)
+                append = app.is_append(data)
+                await self.data_socket.send_multipart([app.topic_frame(topic, append)] + frames)
+                update = self._published(topic, frames, append)
+                if update is not None:
+                    await self._send_topic_list(update)
+
+    async def retire(self, topic):
+        """
+        Removes the topic from the last-value cache and the broadcasted list of
+        known topics.
+        """
+        if self.initialized:
+            self._prepare_retire(topic)
+            update = self._retired(topic)
+            if update is not None:
+                await self._send_topic_list(update)
+
+    def close(self):
+        if self._sub_task is not None:
+            self._sub_task.cancel()
+            self._sub_task = None
+        self.data_socket.close()
+        self.initialized = False
+
+    async def _send_topic_list(self, update):
+        await self.data_socket.send_multipart([app.topic_frame(config.APP_TOPIC_LIST)] + app.serialize(update))
+
+    async def _sub_listener(self):
+        while True:
+            resend = self._subscription(await self.data_socket.recv())
+            if resend is not None:
+                for msg in resend:
+                    await self.data_socket.send_multipart(msg)
+
+
+class AsyncSubscriber(object):
+    """
+    An asyncio based subscriber for psmon publishers.
+
+    Iterating over it with 'async for' yields (topic, data) tuples for every
+    message received on the subscribed topics. Unlike the psplot clients no
+    messages are discarded, so consumers that fall behind are limited by the
+    socket buffer size instead.
+    """
+    def __init__(self, data_socket_url, topics=(), bufsize=config.APP_BUFFER, context=None):
+        self.context = context or zmq.asyncio.Context.instance()
+        self.data_socket = self.context.socket(zmq.SUB)
+        self.data_socket.set_hwm(bufsize)
+        for topic in topics:
+            self.subscribe(topic)
+        self.data_socket.connect(data_socket_url)
+
+    def subscribe(self, topic):
+        self.data_socket.setsockopt(zmq.SUBSCRIBE, app.topic_frame(topic))
+
+    def unsubscribe(self, topic):
+        self.data_socket.setsockopt(zmq.UNSUBSCRIBE, app.topic_frame(topic))
+
+    async def recv(self):
+        """
+        Waits for the next message. Returns a tuple of the topic name and the
+        data object.
+        """
+        msg = await self.data_socket.recv_multipart()
+        return app.parse_topic_frame(msg[0]), app.deserialize(msg[1:])
+
+    def close(self):
+        self.data_socket.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.recv()
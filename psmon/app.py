@@ -3,18 +3,26 @@ import re
 import sys
 import zmq
 import atexit
+import time
 import socket
 import shutil
 import logging
 import tempfile
 import threading
-from collections import namedtuple
+import itertools
+from collections import namedtuple, OrderedDict, deque
 from psmon import config
 # Queue module changed to queue in py3
 if sys.version_info < (3,):
     import Queue as queue
+    import cPickle as pickle
 else:
     import queue
+    import pickle
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 
 LOG = logging.getLogger(__name__)
@@ -27,6 +35,195 @@ class PublishError(Exception):
     pass
 
 
+def _lz4_codec():
+    import lz4.frame
+    return lz4.frame.compress, lz4.frame.decompress
+
+
+def _zstd_codec():
+    import zstandard
+    # the compressor objects are not thread-safe so make one per call
+    return (lambda buf: zstandard.ZstdCompressor().compress(buf),
+            lambda buf: zstandard.ZstdDecompressor().decompress(buf))
+
+
+CODEC_LOADERS = {
+    'lz4': _lz4_codec,
+    'zstd': _zstd_codec,
+}
+_codecs = {}
+
+
+def get_codec(name):
+    """
+    Returns a tuple of the compress and decompress functions of the named codec.
+    """
+    if name not in _codecs:
+        if name not in CODEC_LOADERS:
+            raise PublishError('Unknown compression codec: %s' % name)
+        try:
+            _codecs[name] = CODEC_LOADERS[name]()
+        except ImportError:
+            raise PublishError('Python module needed for compression codec \'%s\' is not available' % name)
+    return _codecs[name]
+
+
+def serialize(data):
+    """
+    Serializes a data object into the list of message frames sent over the wire.
+    """
+    return [pickle.dumps(data, pickle.HIGHEST_PROTOCOL)]
+
+
+def deserialize(frames):
+    """
+    Rebuilds the data object from the list of message frames produced by
+    serialize or a Serializer.
+    """
+    if len(frames) == 1:
+        return pickle.loads(frames[0])
+    codecs = pickle.loads(frames[0])
+    buffers = [buf if codec is None else get_codec(codec)[1](buf) for codec, buf in zip(codecs, frames[2:])]
+    return pickle.loads(frames[1], buffers=buffers)
+
+
+def topic_frame(topic, append=False):
+    """
+    Returns the wire frame for a topic name. The frames of append-stream
+    messages, which only hold the data added since the previous message of
+    the topic, carry a flag after the delimiter so that caches and relays can
+    tell them apart without deserializing the message.
+    """
+    if append:
+        return (topic + config.ZMQ_TOPIC_DELIM_CHAR + config.ZMQ_APPEND_FLAG_CHAR).encode('utf-8')
+    return (topic + config.ZMQ_TOPIC_DELIM_CHAR).encode('utf-8')
+
+
+def parse_topic_frame(frame):
+    """
+    Returns the topic name from its wire frame.
+    """
+    return parse_topic_flags(frame)[0]
+
+
+def parse_topic_flags(frame):
+    """
+    Returns a tuple of the topic name and the append flag from its wire frame.
+    """
+    topic, _, flags = frame.decode('utf-8').partition(config.ZMQ_TOPIC_DELIM_CHAR)
+    return topic, flags == config.ZMQ_APPEND_FLAG_CHAR
+
+
+def is_append(data):
+    """
+    Returns True if the data object is an append-stream message.
+    """
+    return bool(getattr(data, 'append', False))
+
+
+def parse_subscription(msg):
+    """
+    Parses a subscription message received on an XPUB socket.
+
+    Returns a tuple of a boolean which is True for subscriptions and False for
+    unsubscriptions, and the topic name. None is returned for messages which are
+    not for a valid topic.
+    """
+    msg = msg.decode('utf-8')
+    if len(msg) < 2 or msg[0] not in '\x00\x01' or msg[-1] != config.ZMQ_TOPIC_DELIM_CHAR:
+        return None
+    return msg[0] == '\x01', msg[1:-1]
+
+
+class Serializer(object):
+    """
+    Serializes data objects into message frames for publishing.
+
+    With the default options this is the same as serialize. Otherwise if pickle
+    protocol 5 is available (python 3.8+) large buffers, such as the data of
+    numpy arrays, are pickled out-of-band into frames of their own. Buffers of
+    at least 'min_size' bytes are compressed if a 'codec' ('lz4' or 'zstd') is
+    set. If 'workers' is greater than zero the buffers are copied and
+    compressed concurrently in a thread pool, since numpy and the compression
+    libraries release the GIL while doing so.
+    """
+    def __init__(self, workers=config.APP_SERIAL_WORKERS, codec=config.APP_SERIAL_CODEC,
+                 min_size=config.APP_SERIAL_MIN_SIZE):
+        self.workers = 0
+        self.codec = None
+        self.min_size = min_size
+        self.__pool = None
+        self.configure(workers, codec)
+
+    def configure(self, workers=None, codec=None):
+        """
+        Changes the number of worker threads and the compression codec. Use a
+        codec of False to disable compression.
+        """
+        if codec is not None:
+            if codec:
+                get_codec(codec)
+                self.codec = codec
+            else:
+                self.codec = None
+        if workers is not None and workers != self.workers:
+            if workers > 0 and ThreadPoolExecutor is None:
+                raise PublishError('Serialization worker pool needs the concurrent.futures module')
+            if self.__pool is not None:
+                self.__pool.shutdown(wait=False)
+                self.__pool = None
+            if workers > 0:
+                self.__pool = ThreadPoolExecutor(max_workers=workers)
+            self.workers = workers
+
+    @property
+    def out_of_band(self):
+        return pickle.HIGHEST_PROTOCOL >= 5 and (self.workers > 0 or self.codec is not None)
+
+    def dumps(self, data):
+        """
+        Returns the list of message frames for a data object.
+        """
+        return self.dumps_many([data])[0]
+
+    def dumps_many(self, objs):
+        """
+        Returns a list of the message frames for each of the data objects. The
+        buffers of all the objects are encoded together in one pass.
+        """
+        if not self.out_of_band:
+            return [serialize(data) for data in objs]
+        mains = []
+        buffers = []
+        for data in objs:
+            obj_buffers = []
+            mains.append(pickle.dumps(data, 5, buffer_callback=obj_buffers.append))
+            buffers.append(obj_buffers)
+        flat = [buf for obj_buffers in buffers for buf in obj_buffers]
+        if self.__pool is not None and len(flat) > 1:
+            encoded = list(self.__pool.map(self._encode, flat))
+        else:
+            encoded = [self._encode(buf) for buf in flat]
+        results = []
+        offset = 0
+        for main, obj_buffers in zip(mains, buffers):
+            obj_encoded = encoded[offset:offset + len(obj_buffers)]
+            offset += len(obj_buffers)
+            if obj_encoded:
+                codecs = [codec for codec, _ in obj_encoded]
+                results.append([serialize(codecs)[0], main] + [buf for _, buf in obj_encoded])
+            else:
+                results.append([main])
+        return results
+
+    def _encode(self, buf):
+        raw = buf.raw()
+        if self.codec is not None and raw.nbytes >= self.min_size:
+            return self.codec, get_codec(self.codec)[0](raw)
+        # copy the buffer since the caller is free to modify the data after sending
+        return None, raw.tobytes()
+
+
 class Info(object):
     """
     Basic info object that implements basic repr and str functions.
@@ -71,7 +268,8 @@ class PlotInfo(Info):
         interpol=config.APP_IMG_INTERPOLATION,
         palette=config.APP_PALETTE,
         grid=config.APP_GRID,
-        auto_zrange=config.APP_AUTO_ZRANGE
+        auto_zrange=config.APP_AUTO_ZRANGE,
+        window=config.APP_WINDOW
     ):
         super(PlotInfo, self).__init__()
         self.xrange = xrange
@@ -86,48 +284,868 @@ class PlotInfo(Info):
         self.palette = palette
         self.grid = grid
         self.auto_zrange = auto_zrange
+        self.window = window
+
+
+class TopicInfo(Info):
+    """
+    The TopicInfo class is a container for the metadata of a published topic.
+    """
+    def __init__(self, name, plot_type=None, shape=None, dtype=None, updated=None):
+        super(TopicInfo, self).__init__()
+        self.name = name
+        self.plot_type = plot_type
+        self.shape = shape
+        self.dtype = dtype
+        self.updated = updated
+
+    @staticmethod
+    def describe(data):
+        """
+        Returns a tuple of the plot type, shape and dtype of a data object.
+
+        Only metadata which stays the same from one message to the next is
+        reported, since any change is broadcast as a topic list update. The
+        length of 1D series (which changes with every append, delta or batch
+        message) is left out, and sparse images are reported as the dense
+        image type they are decoded to.
+        """
+        plot_type = type(data).__name__
+        shape = None
+        dtype = None
+        if hasattr(data, 'data_con'):
+            shape = (len(data.data_con),)
+        elif getattr(data, 'indices', None) is not None:
+            # sparse images report the type and shape of the full image
+            plot_type = type(data).__bases__[0].__name__
+            shape = tuple(data.shape)
+            dtype = str(data.values.dtype)
+        elif getattr(data, 'image', None) is not None:
+            if hasattr(data.image, 'shape'):
+                shape = data.image.shape
+                dtype = str(data.image.dtype)
+        else:
+            for attr in ('values', 'ydata'):
+                value = getattr(data, attr, None)
+                if value is not None:
+                    if hasattr(value, 'dtype'):
+                        dtype = str(value.dtype)
+                    break
+        return plot_type, shape, dtype
+
+    def summary(self):
+        desc = self.plot_type or 'unknown'
+        if self.shape is not None:
+            desc += ' %s' % (self.shape,)
+        if self.dtype is not None:
+            desc += ' %s' % self.dtype
+        if self.updated is not None:
+            desc += ', updated %s' % time.ctime(self.updated)
+        return '%s: %s' % (self.name, desc)
+
+
+class TopicUpdate(Info):
+    """
+    The TopicUpdate class is the message published on the topic list topic. It
+    is either a full snapshot of the known topics or a delta of the topics that
+    were added (or changed) and removed since the previous sequence number.
+    """
+    def __init__(self, seq, snapshot, topics, removed=None):
+        super(TopicUpdate, self).__init__()
+        self.seq = seq
+        self.snapshot = snapshot
+        self.topics = topics
+        self.removed = removed or []
+
+
+class TopicRegistry(object):
+    """
+    Versioned registry of the known topics and their metadata.
+
+    Every change increments the sequence number and returns a TopicUpdate delta
+    to publish, so subscribers can apply changes incrementally and detect when
+    they missed one.
+    """
+    def __init__(self):
+        self.seq = 0
+        self.__topics = {}
+        self.__lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.__topics
+
+    def __len__(self):
+        return len(self.__topics)
+
+    @property
+    def names(self):
+        with self.__lock:
+            return sorted(self.__topics)
+
+    def add(self, info):
+        """
+        Adds or updates the metadata of a topic. Returns the TopicUpdate delta
+        for the change.
+        """
+        return self.update({info.name: info})
+
+    def remove(self, name):
+        """
+        Removes a topic. Returns the TopicUpdate delta for the change or None if
+        the topic was not known.
+        """
+        return self.update({}, [name])
+
+    def update(self, topics, removed=()):
+        """
+        Adds or updates the metadata of several topics and removes others as a
+        single change. Returns the TopicUpdate delta for the change or None if
+        nothing changed.
+        """
+        with self.__lock:
+            removed = [name for name in removed if self.__topics.pop(name, None) is not None]
+            if not topics and not removed:
+                return None
+            self.__topics.update(topics)
+            self.seq += 1
+            return TopicUpdate(self.seq, False, dict(topics), removed)
+
+    def touch(self, name, updated):
+        """
+        Sets the last update time of a topic - this does not generate a delta.
+        """
+        info = self.__topics.get(name)
+        if info is not None:
+            info.updated = updated
+
+    def snapshot(self):
+        with self.__lock:
+            return TopicUpdate(self.seq, True, dict(self.__topics))
+
+    def topics(self):
+        with self.__lock:
+            return dict(self.__topics)
+
+    def apply(self, update):
+        """
+        Applies a TopicUpdate received from a publisher. Returns False if the
+        update does not follow the last applied one, in which case a new snapshot
+        is needed.
+        """
+        with self.__lock:
+            if update.snapshot:
+                self.__topics = dict(update.topics)
+            elif update.seq != self.seq + 1:
+                return False
+            else:
+                self.__topics.update(update.topics)
+                for name in update.removed:
+                    self.__topics.pop(name, None)
+            self.seq = update.seq
+            return True
 
 
 class MessageHandler(object):
-    def __init__(self, name, qlimit, is_pyobj):
+    """
+    Holds the messages sent by clients with the header 'name'.
+
+    By default messages are queued until they are picked up with get or drain.
+    If a callback is set the messages are instead passed to it on an executor,
+    so the analysis loop doesn't need to poll for them at all. At most 'qlimit'
+    messages (unlimited if 0) can be queued or waiting for the callback, after
+    which new messages are dropped.
+
+    Arguments:
+     - name: the header of the messages
+     - qlimit: the maximum number of pending messages
+     - is_pyobj: whether the messages are python objects or strings
+
+    Optional arguments:
+     - callback: function called with each message
+     - executor: the executor the callback runs on. By default each handler
+            gets a thread of its own, so messages are passed to the callback
+            one at a time in the order they arrived.
+    """
+    def __init__(self, name, qlimit, is_pyobj, callback=None, executor=None):
         self.name = name
         self.is_pyobj = is_pyobj
-        self.__mqueue = queue.Queue(maxsize=qlimit)
+        self.qlimit = qlimit
+        self.__messages = deque()
+        self.__lock = threading.Lock()
+        self.__callback = None
+        self.__executor = None
+        self.__owns_executor = False
+        self.__running = 0
+        if callback is not None:
+            self.set_callback(callback, executor)
 
     def get(self):
-        return self.__mqueue.get_nowait()
+        """
+        Returns the oldest queued message. Raises queue.Empty if there is none.
+        """
+        with self.__lock:
+            if not self.__messages:
+                raise queue.Empty
+            return self.__messages.popleft()
+
+    def drain(self, n=None):
+        """
+        Returns a list of up to 'n' (all if None) of the oldest queued messages.
+        """
+        with self.__lock:
+            if n is None or n >= len(self.__messages):
+                msgs = list(self.__messages)
+                self.__messages.clear()
+            else:
+                msgs = [self.__messages.popleft() for _ in range(n)]
+        return msgs
 
     def put(self, msg):
-        self.__mqueue.put_nowait(msg)
+        """
+        Adds a message to the queue or passes it to the callback. Raises
+        queue.Full if the handler already has 'qlimit' pending messages.
+        """
+        with self.__lock:
+            if 0 < self.qlimit <= len(self.__messages) + self.__running:
+                raise queue.Full
+            if self.__callback is None:
+                self.__messages.append(msg)
+            else:
+                self._submit(msg)
+
+    def set_callback(self, callback, executor=None):
+        """
+        Sets the function called with each message on 'executor' (a thread of
+        its own if None). Messages which are already queued are passed to it as
+        well. If 'callback' is None messages are queued again.
+
+        The thread the handler created for the previous callback is shut down
+        once it has passed on the messages submitted to it. Executors passed
+        in by the caller are left running.
+        """
+        owns_executor = callback is not None and executor is None
+        if owns_executor:
+            if ThreadPoolExecutor is None:
+                raise ValueError('Message handler callbacks require the concurrent.futures module')
+            executor = ThreadPoolExecutor(max_workers=1)
+        with self.__lock:
+            previous = self.__executor if self.__owns_executor else None
+            self.__callback = callback
+            self.__executor = executor
+            self.__owns_executor = owns_executor
+            if callback is not None:
+                while self.__messages:
+                    self._submit(self.__messages.popleft())
+        if previous is not None:
+            previous.shutdown(wait=False)
+
+    def _submit(self, msg):
+        # must be called holding the lock
+        self.__running += 1
+        self.__executor.submit(self._run_callback, self.__callback, msg)
+
+    def _run_callback(self, callback, msg):
+        try:
+            callback(msg)
+        except Exception:
+            LOG.exception('Callback of message handler \'%s\' failed', self.name)
+        finally:
+            with self.__lock:
+                self.__running -= 1
 
     @property
     def size(self):
-        return self.__mqueue.qsize()
+        return len(self.__messages)
 
     @property
     def empty(self):
-        return self.__mqueue.empty()
+        return not self.__messages
 
     @property
     def full(self):
-        return self.__mqueue.full()
+        return 0 < self.qlimit <= len(self.__messages) + self.__running
+
+
+class ResetFlags(object):
+    """
+    The reset requests received from clients.
+
+    A reset can be requested for all topics or for a single one. The reset
+    flag of a topic is set by either kind of request, and clearing it only
+    affects that topic. The global flag is only set by resets of all topics,
+    and clearing it leaves the flags of the topics alone, so requests which
+    were not handled yet for a topic are not lost.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__generation = 0
+        self.__global = False
+        self.__topics = set()
+        self.__cleared = {}
+
+    def set(self, topic=None):
+        with self.__lock:
+            if topic is None:
+                self.__generation += 1
+                self.__global = True
+            else:
+                self.__topics.add(topic)
+
+    def is_set(self, topic=None):
+        with self.__lock:
+            if topic is None:
+                return self.__global
+            return topic in self.__topics or self.__cleared.get(topic, 0) < self.__generation
+
+    def clear(self, topic=None):
+        with self.__lock:
+            if topic is None:
+                self.__global = False
+            else:
+                self.__topics.discard(topic)
+                self.__cleared[topic] = self.__generation
+
+    def consume(self, topic):
+        """
+        Returns whether the reset flag of the topic is set, clearing it.
+        """
+        with self.__lock:
+            if topic in self.__topics or self.__cleared.get(topic, 0) < self.__generation:
+                self.__topics.discard(topic)
+                self.__cleared[topic] = self.__generation
+                return True
+            return False
+
+    def pending(self):
+        """
+        Returns the set of topics with a reset request of their own.
+        """
+        with self.__lock:
+            return set(self.__topics)
+
+
+class LastValueCache(object):
+    """
+    Cache of the last serialized message published to each topic.
+
+    For append-stream topics the cache holds the last full message (the
+    keyframe) followed by all the append messages published since, so that
+    replaying them gives a new subscriber the complete data.
+
+    The total size of the cached messages is limited to 'max_bytes' - when it is
+    exceeded the least recently used (published or replayed) topics are
+    evicted first. Entries older
+    than 'ttl' seconds are also dropped if a ttl is set.
+    """
+    def __init__(self, max_bytes=config.APP_CACHE_BYTES, ttl=config.APP_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__last_sweep = time.time()
+
+    def __contains__(self, topic):
+        return topic in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def put(self, topic, frames, append=False):
+        nbytes = sum(len(frame) for frame in frames)
+        now = time.time()
+        with self.__lock:
+            if append:
+                entry = self.__entries.get(topic)
+                if entry is None:
+                    # without the keyframe the append message is of no use to new subscribers
+                    if LOG.isEnabledFor(logging.DEBUG):
+                        LOG.debug('No cached keyframe for append message to topic %s - not cached', topic)
+                    return
+                messages = entry[0] + [(frames, True)]
+                nbytes += entry[1]
+            else:
+                messages = [(frames, False)]
+            self._remove(topic)
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                if LOG.isEnabledFor(logging.DEBUG):
+                    LOG.debug('Message for topic %s exceeds the cache size limit - not cached', topic)
+                self.evictions += 1
+                return
+            self.__entries[topic] = (messages, nbytes, now)
+            self.nbytes += nbytes
+            if self.ttl is not None and now - self.__last_sweep >= config.APP_CACHE_SWEEP:
+                self._expire(now)
+            if self.max_bytes is not None:
+                while self.nbytes > self.max_bytes:
+                    evicted, entry = self.__entries.popitem(last=False)
+                    self.nbytes -= entry[1]
+                    self.evictions += 1
+                    if LOG.isEnabledFor(logging.DEBUG):
+                        LOG.debug('Evicted topic from the cache: %s', evicted)
+
+    def get(self, topic):
+        """
+        Returns the list of cached (frames, append) messages for the topic in the
+        order they were published, or None if nothing is cached.
+        """
+        with self.__lock:
+            entry = self.__entries.get(topic)
+            if entry is not None and self.ttl is not None and time.time() - entry[2] > self.ttl:
+                self._remove(topic)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # mark the topic as recently used (OrderedDict.move_to_end is py3 only)
+            self.__entries[topic] = self.__entries.pop(topic)
+            return entry[0]
+
+    def remove(self, topic):
+        with self.__lock:
+            return self._remove(topic)
+
+    def stats(self):
+        """
+        Returns a dictionary of the cache usage statistics.
+        """
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.__entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _remove(self, topic):
+        entry = self.__entries.pop(topic, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+        return entry is not None
+
+    def _expire(self, now):
+        self.__last_sweep = now
+        for topic, entry in list(self.__entries.items()):
+            if now - entry[2] > self.ttl:
+                self._remove(topic)
+                self.expirations += 1
+
+
+class SendQueue(object):
+    """
+    Bounded per-topic queues of serialized messages waiting to be published by
+    the proxy thread of a ZMQPublisher.
+
+    When the queue of a topic is full the policy decides what happens:
+     - drop-oldest: the oldest queued message of the topic is discarded.
+     - drop-newest: the new message is discarded.
+     - block: the caller waits up to 'timeout' seconds for the proxy to make
+            room, after which the new message is discarded.
+
+    Append-stream messages are never discarded, since clients would have to
+    resync after the gap. With drop-oldest a full message is only discarded
+    together with the append messages which follow it, once a newer full
+    message that replaces them is queued. Until then appends are queued past
+    the depth limit, which the keyframe interval of the stream bounds.
+
+    The 'wake' callable is invoked with the internal lock held when messages
+    are queued and the proxy has not been woken since its last drain, so the
+    proxy only needs one wakeup for any number of queued messages.
+    """
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+    BLOCK = 'block'
+    POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+    def __init__(self, wake, depth=config.APP_SEND_DEPTH, policy=config.APP_SEND_POLICY,
+                 timeout=config.APP_SEND_TIMEOUT):
+        self.wake = wake
+        self.depth = depth
+        self.policy = policy
+        self.timeout = timeout
+        self.__overrides = {}
+        self.__queues = {}
+        self.__order = deque()
+        self.__pending = 0
+        self.__signaled = False
+        self.__counters = {}
+        self.__cond = threading.Condition()
+        self._check_policy(policy)
+
+    def set_policy(self, topic=None, depth=None, policy=None, timeout=None):
+        """
+        Changes the queue depth, drop policy and block timeout either for all
+        topics or if specified just for one topic. Parameters that are None are
+        left unchanged.
+        """
+        if policy is not None:
+            self._check_policy(policy)
+        with self.__cond:
+            if topic is None:
+                if depth is not None:
+                    self.depth = depth
+                if policy is not None:
+                    self.policy = policy
+                if timeout is not None:
+                    self.timeout = timeout
+            else:
+                cur_depth, cur_policy, cur_timeout = self._get_policy(topic)
+                self.__overrides[topic] = (
+                    cur_depth if depth is None else depth,
+                    cur_policy if policy is None else policy,
+                    cur_timeout if timeout is None else timeout,
+                )
+
+    def put(self, topic, frames, force=False, append=False):
+        """
+        Queues the frames of a message for the topic. Messages put with 'force'
+        ignore the depth limit, and 'append' marks append-stream messages.
+        Returns False if the message was dropped.
+        """
+        with self.__cond:
+            return self._put(topic, frames, force, append, True)
+
+    def _put(self, topic, frames, force, append, wake):
+        topic_queue = self.__queues.get(topic)
+        if topic_queue is None:
+            topic_queue = self.__queues[topic] = deque()
+        counters = self._get_counters(topic)
+        if not force:
+            depth, policy, timeout = self._get_policy(topic)
+            if len(topic_queue) >= depth:
+                if policy == SendQueue.BLOCK:
+                    # make sure the proxy knows there is something to drain
+                    self._signal()
+                    end = time.time() + timeout
+                    while len(topic_queue) >= depth:
+                        remaining = end - time.time()
+                        if remaining <= 0:
+                            break
+                        self.__cond.wait(remaining)
+                    if len(topic_queue) >= depth and not append:
+                        counters['timeouts'] += 1
+                        counters['dropped'] += 1
+                        return False
+                elif policy == SendQueue.DROP_OLDEST:
+                    dropped = self._drop_superseded(topic_queue, append)
+                    self.__pending -= dropped
+                    counters['dropped'] += dropped
+                elif not append:
+                    counters['dropped'] += 1
+                    return False
+        topic_queue.append((frames, append))
+        self.__order.append(topic)
+        counters['queued'] += 1
+        self.__pending += 1
+        if wake:
+            self._signal()
+        return True
+
+    def put_many(self, messages):
+        """
+        Queues a batch of messages with a single lock acquisition and at most
+        one wakeup. Takes a list of (topic, frames, force, append) tuples and
+        returns the number of messages that were queued.
+        """
+        with self.__cond:
+            queued = 0
+            for topic, frames, force, append in messages:
+                if self._put(topic, frames, force, append, False):
+                    queued += 1
+            self._signal()
+            return queued
+
+    def drain(self):
+        """
+        Removes all the queued messages. Returns a list of (topic, frames, append)
+        tuples in the order they were queued.
+        """
+        with self.__cond:
+            messages = []
+            while self.__order:
+                topic = self.__order.popleft()
+                topic_queue = self.__queues[topic]
+                # the message of a ticket may already have been dropped
+                if topic_queue:
+                    frames, append = topic_queue.popleft()
+                    messages.append((topic, frames, append))
+                    self.__counters[topic]['sent'] += 1
+            self.__pending = 0
+            self.__signaled = False
+            self.__cond.notify_all()
+            return messages
+
+    def stats(self, topic=None):
+        """
+        Returns a dictionary of the queued, sent, dropped and timeout counters
+        for the topic, or a dictionary of them for all topics.
+        """
+        with self.__cond:
+            if topic is not None:
+                return dict(self._get_counters(topic))
+            return {name: dict(counters) for name, counters in self.__counters.items()}
+
+    @staticmethod
+    def _drop_superseded(topic_queue, append):
+        """
+        Drops the queued messages before the first full message after the
+        oldest one, or all of them if there is none and the new message is a
+        full message. Returns the number of messages dropped.
+        """
+        for index, (_, queued_append) in enumerate(topic_queue):
+            if index > 0 and not queued_append:
+                break
+        else:
+            # only a new full message replaces the queued ones
+            index = 0 if append else len(topic_queue)
+        for _ in range(index):
+            topic_queue.popleft()
+        return index
+
+    def _signal(self):
+        if self.__pending and not self.__signaled:
+            self.__signaled = True
+            self.wake()
+
+    def _get_policy(self, topic):
+        return self.__overrides.get(topic, (self.depth, self.policy, self.timeout))
+
+    def _get_counters(self, topic):
+        counters = self.__counters.get(topic)
+        if counters is None:
+            counters = self.__counters[topic] = {'queued': 0, 'sent': 0, 'dropped': 0, 'timeouts': 0}
+        return counters
+
+    def _check_policy(self, policy):
+        if policy not in SendQueue.POLICIES:
+            raise ValueError('Unknown send queue policy \'%s\' - must be one of: %s' %
+                             (policy, ', '.join(SendQueue.POLICIES)))
 
 
-class ZMQPublisher(object):
-    def __init__(self, comm_offset=config.APP_COMM_OFFSET):
+class PublisherBase(object):
+    """
+    Base class with the topic bookkeeping shared by the publisher implementations:
+    the last-value cache, the topic registry and the subscriber counts.
+    """
+    def __init__(self, sub_callback=None, cache_bytes=config.APP_CACHE_BYTES, cache_ttl=config.APP_CACHE_TTL):
+        self.cache = LastValueCache(cache_bytes, cache_ttl)
+        self.registry = TopicRegistry()
+        self.serializer = Serializer()
+        self.sub_counts = {}
+        self.sub_callback = sub_callback
+        self._last_send = {}
+        self._last_desc = {}
+        self._resync = set()
+        self._crops = {}
+        self._crop_topics = set()
+        self._crops_lock = threading.Lock()
+
+    def subscribers(self, topic=None):
+        """
+        Returns the number of live subscribers to the topic, or a dictionary of
+        the subscriber counts of all watched topics if no topic is specified.
+        """
+        if topic is None:
+            return dict(self.sub_counts)
+        return self.sub_counts.get(topic, 0)
+
+    def wants(self, topic):
+        """
+        Returns True if data published to the topic would be used: either the
+        topic has subscribers, it has never been published, or its entry in the
+        last-value cache is due for a refresh.
+        """
+        if self.sub_counts.get(topic, 0) > 0:
+            return True
+        last_send = self._last_send.get(topic)
+        return last_send is None or time.time() - last_send >= config.APP_IDLE_REFRESH
+
+    def cache_stats(self):
+        """
+        Returns a dictionary of the last-value cache usage statistics.
+        """
+        return self.cache.stats()
+
+    def topics(self):
+        """
+        Returns a dictionary of TopicInfo metadata objects for all known topics.
+        """
+        return self.registry.topics()
+
+    def request_resync(self, topic):
+        """
+        Records that a client missed append-stream messages of the topic, so
+        that its publisher sends a full message next.
+        """
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('Resync requested for topic: %s', topic)
+        self._resync.add(topic)
+
+    def resync_requested(self, topic):
+        """
+        Returns True if a client requested a resync of the topic since the last
+        call, in which case the next message should not be an append message.
+        """
+        try:
+            self._resync.remove(topic)
+            return True
+        except KeyError:
+            return False
+
+    def enable_crops(self, topic):
+        """
+        Registers that the image topic is published by a manager which handles
+        the crop requests of clients, so requests for it are accepted.
+        """
+        with self._crops_lock:
+            self._crop_topics.add(topic)
+
+    def disable_crops(self, topic):
+        """
+        Stops accepting crop requests for the image topic and drops the ones
+        which are still pending.
+        """
+        with self._crops_lock:
+            self._crop_topics.discard(topic)
+            self._crops.pop(topic, None)
+
+    def request_crop(self, topic, client, roi):
+        """
+        Records a request from a client for a full resolution crop of the image
+        topic, with the region of interest 'roi' given as (x0, x1, y0, y1) or
+        None to cancel the crop. Returns the derived topic the crop is
+        published to, or an empty string if no manager handles crops of the
+        topic.
+        """
+        with self._crops_lock:
+            if topic not in self._crop_topics:
+                if LOG.isEnabledFor(logging.WARN):
+                    LOG.warning('Crop requested by %s for topic which does not support crops: %s', client, topic)
+                return ''
+            self._crops.setdefault(topic, {})[client] = roi
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('Crop %s requested by %s for topic: %s', roi, client, topic)
+        return config.APP_SUBTOPIC_FORMAT % (topic, config.APP_CROP_NAME % client)
+
+    def crop_requests(self, topic):
+        """
+        Returns a dictionary of the clients which requested crops of the topic
+        since the last call to their requested regions of interest.
+        """
+        with self._crops_lock:
+            return self._crops.pop(topic, {})
+
+    def _prepare_send(self, topic, data):
+        """
+        Checks if data for the topic should be sent. Returns a tuple of a boolean
+        which is False if the send should be skipped, and a TopicInfo object if
+        the metadata of the topic changed since the last send.
+        """
+        if topic.startswith(config.APP_RESERVED_TOPIC):
+            raise PublishError('Cannot publish data to internally reserved topic: %s' % topic)
+        if not self.wants(topic):
+            return False, None
+        self._last_send[topic] = time.time()
+        desc = TopicInfo.describe(data)
+        if desc != self._last_desc.get(topic):
+            self._last_desc[topic] = desc
+            return True, TopicInfo(topic, *desc)
+        return True, None
+
+    def _prepare_retire(self, topic):
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('Retiring topic: %s', topic)
+        self._last_send.pop(topic, None)
+        self._last_desc.pop(topic, None)
+
+    def _published(self, topic, frames, append=False):
+        """
+        Updates the cache and registry for a message that was published. Returns
+        a TopicUpdate to broadcast if the topic was not yet known.
+        """
+        update = None
+        if topic not in self.registry:
+            update = self.registry.add(TopicInfo(topic))
+        self.registry.touch(topic, time.time())
+        self.cache.put(topic, frames, append)
+        return update
+
+    def _retired(self, topic):
+        """
+        Drops a retired topic from the cache and registry. Returns a TopicUpdate
+        to broadcast if the topic was known.
+        """
+        self.cache.remove(topic)
+        return self.registry.remove(topic)
+
+    def _subscription(self, msg):
+        """
+        Processes a subscription message from the data socket. Returns a list of
+        the messages (each a list of frames) to resend for the new subscriber or
+        None.
+        """
+        sub = parse_subscription(msg)
+        if sub is None:
+            if LOG.isEnabledFor(logging.WARN):
+                LOG.warn('Received subscription message for invalid topic - ignoring!')
+            return None
+        subscribe, topic = sub
+        if not subscribe:
+            if LOG.isEnabledFor(logging.DEBUG):
+                LOG.debug('Received unsubscription message for topic: %s' % topic)
+            self._update_sub_count(topic, -1)
+            return None
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('Received subscription message for topic: %s' % topic)
+        self._update_sub_count(topic, 1)
+        if topic == config.APP_TOPIC_LIST:
+            return [[topic_frame(topic)] + serialize(self.registry.snapshot())]
+        cached = self.cache.get(topic)
+        if cached is not None:
+            if LOG.isEnabledFor(logging.DEBUG):
+                LOG.debug('Found %d cached messages to resend for topic: %s' % (len(cached), topic))
+            return [[topic_frame(topic, append)] + frames for frames, append in cached]
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('No cached message found for topic: %s' % topic)
+        return None
+
+    def _update_sub_count(self, topic, delta):
+        count = max(self.sub_counts.get(topic, 0) + delta, 0)
+        if count:
+            self.sub_counts[topic] = count
+        else:
+            self.sub_counts.pop(topic, None)
+        if self.sub_callback is not None:
+            self.sub_callback(topic, count)
+
+
+class ZMQPublisher(PublisherBase):
+    def __init__(self, comm_offset=config.APP_COMM_OFFSET, sub_callback=None,
+                 cache_bytes=config.APP_CACHE_BYTES, cache_ttl=config.APP_CACHE_TTL):
+        super(ZMQPublisher, self).__init__(sub_callback, cache_bytes, cache_ttl)
         self.context = zmq.Context()
         self.data_socket = self.context.socket(zmq.XPUB)
-        self.comm_socket = self.context.socket(zmq.REP)
+        self.comm_socket = self.context.socket(zmq.ROUTER)
         self.proxy_send_socket = self.context.socket(zmq.PUB)
         self.proxy_recv_socket = self.context.socket(zmq.SUB)
         self.proxy_url = "inproc://send-proxy"
+        self.send_queue = SendQueue(self._wake_proxy)
         self.proxy_thread = threading.Thread(target=self._send_proxy)
         self.comm_offset = comm_offset
         self.initialized = False
         self.tempdir = None
-        self.cache = {
-            config.APP_TOPIC_LIST: []
-        }
         atexit.register(self._clean_tmpdir)
 
     @property
@@ -148,8 +1166,11 @@ class ZMQPublisher(object):
             LOG.debug('Publisher data socket buffer size set to %d', bufsize)
         self.data_socket.set_hwm(bufsize)
 
-        # set the data socket to verbose mode
-        self.data_socket.setsockopt(zmq.XPUB_VERBOSE, True)
+        # set the data socket to verbose mode - pass all unsubscribes too if supported
+        if hasattr(zmq, 'XPUB_VERBOSER'):
+            self.data_socket.setsockopt(zmq.XPUB_VERBOSER, True)
+        else:
+            self.data_socket.setsockopt(zmq.XPUB_VERBOSE, True)
         # set the subscription filter on the proxy socket
         self.proxy_recv_socket.setsockopt_string(zmq.SUBSCRIBE, u"")
 
@@ -177,13 +1198,79 @@ class ZMQPublisher(object):
                 LOG.warning('Unable to bind proxy sockets for publisher - disabling!')
 
     def send(self, topic, data):
+        """
+        Queues a data object to be published to the topic. Returns False if the
+        message was skipped or dropped by the send queue policy.
+        """
+        if self.initialized:
+            do_send, info = self._prepare_send(topic, data)
+            if do_send:
+                if LOG.isEnabledFor(logging.DEBUG):
+                    LOG.debug('Publishing data to topic: %s', topic)
+                if info is not None:
+                    # (re)register the topic with the proxy if its metadata changed
+                    self.send_queue.put(config.APP_REGISTER_TOPIC, serialize(info), force=True)
+                return self.send_queue.put(topic, self.serializer.dumps(data), append=is_append(data))
+        return False
+
+    def send_many(self, topic_data):
+        """
+        Queues data objects for several topics at once. The messages are
+        serialized in one pass and handed to the proxy as a single batch.
+
+        Takes a dictionary (or iterable of pairs) of topic names to data objects.
+        Returns the number of messages that were queued.
+        """
+        if not self.initialized:
+            return 0
+        if hasattr(topic_data, 'items'):
+            topic_data = topic_data.items()
+        infos = []
+        topics = []
+        objs = []
+        for topic, data in topic_data:
+            do_send, info = self._prepare_send(topic, data)
+            if do_send:
+                if info is not None:
+                    infos.append(info)
+                topics.append(topic)
+                objs.append(data)
+        messages = [(config.APP_REGISTER_TOPIC, serialize(info), True, False) for info in infos]
+        for topic, data, frames in zip(topics, objs, self.serializer.dumps_many(objs)):
+            messages.append((topic, frames, False, is_append(data)))
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('Publishing batch of %d messages', len(messages))
+        return self.send_queue.put_many(messages)
+
+    def retire(self, topic):
+        """
+        Removes the topic from the last-value cache and the broadcasted list of
+        known topics.
+        """
+        if self.initialized:
+            self._prepare_retire(topic)
+            self.send_queue.put(config.APP_RETIRE_TOPIC, [topic.encode('utf-8')], force=True)
+
+    def send_stats(self, topic=None):
+        """
+        Returns the send queue counters for the topic, or for all topics if no
+        topic is specified.
+        """
+        return self.send_queue.stats(topic)
+
+    def forward(self, topic, frames, append=False):
+        """
+        Publishes already serialized message frames to the topic. Unlike send
+        this allows the internally reserved topics, since it is meant for
+        relaying the messages of an upstream publisher.
+        """
         if self.initialized:
-            if topic.startswith(config.APP_RESERVED_TOPIC):
-                raise PublishError('Cannot publish data to internally reserved topic: %s' % topic)
             if LOG.isEnabledFor(logging.DEBUG):
-                LOG.debug('Publishing data to topic: %s', topic)
-            self.proxy_send_socket.send_string(topic, zmq.SNDMORE)
-            self.proxy_send_socket.send_pyobj(data)
+                LOG.debug('Forwarding data to topic: %s', topic)
+            self.send_queue.put(topic, frames, force=topic.startswith(config.APP_RESERVED_TOPIC), append=append)
+
+    def _wake_proxy(self):
+        self.proxy_send_socket.send(b'')
 
     def _send_proxy(self):
         # set up a poller for incoming data from proxy or subscrition messages
@@ -192,39 +1279,59 @@ class ZMQPublisher(object):
         proxy_poller.register(self.data_socket, zmq.POLLIN)
         while not self.proxy_recv_socket.closed and not self.data_socket.closed:
             ready_socks = dict(proxy_poller.poll())
-            # if proxy socket has inbound data foward it to the data publisher
+            # if the proxy socket has a wakeup forward the queued messages to the data publisher
             if self.proxy_recv_socket in ready_socks:
-                topic = self.proxy_recv_socket.recv_string()
-                data = self.proxy_recv_socket.recv_pyobj()
-                if LOG.isEnabledFor(logging.DEBUG):
-                    LOG.debug('Received data on proxy socket for topic: %s' % topic)
-                self.data_socket.send_string(topic + config.ZMQ_TOPIC_DELIM_CHAR, zmq.SNDMORE)
-                self.data_socket.send_pyobj(data)
-                if topic not in self.cache:
-                    self.cache[config.APP_TOPIC_LIST].append(topic)
-                    self.data_socket.send_string(config.APP_TOPIC_LIST + config.ZMQ_TOPIC_DELIM_CHAR, zmq.SNDMORE)
-                    self.data_socket.send_pyobj(self.cache[config.APP_TOPIC_LIST])
-                self.cache[topic] = data
+                self._drain_wakeups()
+                for topic, frames, append in self.send_queue.drain():
+                    if LOG.isEnabledFor(logging.DEBUG):
+                        LOG.debug('Received data on proxy socket for topic: %s' % topic)
+                    if topic.startswith(config.APP_RESERVED_TOPIC):
+                        self._handle_internal(topic, frames)
+                    else:
+                        self.data_socket.send_multipart([topic_frame(topic, append)] + frames)
+                        update = self._published(topic, frames, append)
+                        if update is not None:
+                            self._send_topic_list(update)
             # if the data socket has inbound data check for new subs
             if self.data_socket in ready_socks:
-                topic_msg = self.data_socket.recv_string()
-                if topic_msg[0] == '\x01':
-                    if topic_msg[-1] != '\x00':
-                        if LOG.isEnabledFor(logging.WARN):
-                            LOG.warn('Received new subscription message for invalid topic - ignoring!')
-                    else:
-                        topic = topic_msg[1:-1]
-                        if LOG.isEnabledFor(logging.DEBUG):
-                            LOG.debug('Received subscription message for topic: %s' % topic)
-                        try:
-                            last_data = self.cache[topic]
-                            if LOG.isEnabledFor(logging.DEBUG):
-                                LOG.debug('Found cached message to resend for topic: %s' % topic)
-                            self.data_socket.send_string(topic + config.ZMQ_TOPIC_DELIM_CHAR, zmq.SNDMORE)
-                            self.data_socket.send_pyobj(last_data)
-                        except KeyError:
-                            if LOG.isEnabledFor(logging.DEBUG):
-                                LOG.debug('No cached message found for topic: %s' % topic)
+                resend = self._subscription(self.data_socket.recv())
+                if resend is not None:
+                    for msg in resend:
+                        self.data_socket.send_multipart(msg)
+
+    def _drain_wakeups(self):
+        while True:
+            try:
+                self.proxy_recv_socket.recv(zmq.NOBLOCK)
+            except zmq.ZMQError as e:
+                if e.errno == zmq.EAGAIN:
+                    break
+                raise
+
+    def _send_topic_list(self, update):
+        self.data_socket.send_multipart([topic_frame(config.APP_TOPIC_LIST)] + serialize(update))
+
+    def _handle_internal(self, topic, frames):
+        if topic == config.APP_REGISTER_TOPIC:
+            self._send_topic_list(self.registry.add(deserialize(frames)))
+        elif topic == config.APP_RETIRE_TOPIC:
+            update = self._retired(frames[0].decode('utf-8'))
+            if update is not None:
+                self._send_topic_list(update)
+        elif topic == config.APP_TOPIC_LIST:
+            # topic list update forwarded from an upstream publisher
+            self._merge_topic_list(deserialize(frames))
+        elif LOG.isEnabledFor(logging.WARN):
+            LOG.warning('Received message for unknown internal topic: %s', topic)
+
+    def _merge_topic_list(self, update):
+        if update.snapshot:
+            removed = [name for name in self.registry.names if name not in update.topics]
+        else:
+            removed = update.removed
+        delta = self.registry.update(update.topics, removed)
+        if delta is not None:
+            self._send_topic_list(delta)
 
     def _initialize_icp(self):
         try:
@@ -288,13 +1395,10 @@ class ZMQSubscriber(object):
         self.client_info = client_info
         self.context = zmq.Context()
         self.data_socket = self.context.socket(zmq.SUB)
-        self.topic_str = self.client_info.topic + config.ZMQ_TOPIC_DELIM_CHAR
-        # Handle byte versus unicode strings for the topic
-        if isinstance(self.topic_str, bytes):
-            self.topic_str = self.topic_str.decode('ascii')
+        self.topic_str = self._make_topic_str(self.client_info.topic)
         self.data_socket.setsockopt_string(zmq.SUBSCRIBE, self.topic_str)
         self.data_socket.set_hwm(self.client_info.buffer)
-        self.comm_socket = self.context.socket(zmq.REQ)
+        self.comm_socket = self.context.socket(zmq.DEALER)
         self.connected = False
         if connect:
             self.connect()
@@ -308,9 +1412,31 @@ class ZMQSubscriber(object):
     def sock_init(self, sock, con_str):
         sock.connect(con_str)
 
+    def _make_topic_str(self, topic):
+        topic_str = topic + config.ZMQ_TOPIC_DELIM_CHAR
+        # Handle byte versus unicode strings for the topic
+        if isinstance(topic_str, bytes):
+            topic_str = topic_str.decode('ascii')
+        return topic_str
+
+    def subscribe(self, topic):
+        self.data_socket.setsockopt_string(zmq.SUBSCRIBE, self._make_topic_str(topic))
+
+    def unsubscribe(self, topic):
+        self.data_socket.setsockopt_string(zmq.UNSUBSCRIBE, self._make_topic_str(topic))
+
     def data_recv(self, flags=0):
-        self.data_socket.recv(flags)
-        return self.data_socket.recv_pyobj(flags)
+        return deserialize(self.data_socket.recv_multipart(flags)[1:])
+
+    def data_recv_raw(self, flags=0):
+        """
+        Receives the next message without deserializing it. Returns a tuple of
+        the topic name, the list of serialized message frames and the append
+        flag of the message.
+        """
+        msg = self.data_socket.recv_multipart(flags)
+        topic, append = parse_topic_flags(msg[0])
+        return topic, msg[1:], append
 
     def get_socket_gen(self):
         while True:
@@ -318,7 +1444,9 @@ class ZMQSubscriber(object):
             data = None
             while count < self.client_info.recvlimit:
                 try:
-                    data = self.data_recv(flags=zmq.NOBLOCK)
+                    newer = self.data_recv(flags=zmq.NOBLOCK)
+                    # data types which send incremental updates merge the skipped messages
+                    data = newer if data is None or not hasattr(data, 'merge') else data.merge(newer)
                     count += 1
                 except zmq.ZMQError as e:
                     if e.errno == zmq.EAGAIN:
@@ -334,34 +1462,88 @@ class ZMQSubscriber(object):
             yield data
 
 
+def comm_envelope(frames):
+    """
+    Splits a message received on the ROUTER comm socket into the routing
+    envelope for the reply and the request header and body. DEALER clients
+    send a request id after the empty delimiter frame, while REQ clients of
+    older versions do not. Returns None for malformed messages.
+    """
+    if len(frames) == 5 and frames[1] == b'':
+        return frames[:3], frames[3], frames[4]
+    elif len(frames) == 4 and frames[1] == b'':
+        return frames[:2], frames[2], frames[3]
+    return None
+
+
+def encode_comm(msg, is_pyobj):
+    return pickle.dumps(msg, pickle.HIGHEST_PROTOCOL) if is_pyobj else msg.encode('utf-8')
+
+
+def decode_comm(frame, is_pyobj):
+    return pickle.loads(frame) if is_pyobj else frame.decode('utf-8')
+
+
 class ZMQListener(object):
+    """
+    Handles the requests sent by clients to the ROUTER comm socket of a
+    publisher.
+
+    The requests are read by a listener thread and handled by a pool of
+    'workers' threads (inline if there are none), so a slow request does not
+    hold up the others. The replies are handed back to the listener thread,
+    which is the only user of the comm socket, over an inproc socket. Each
+    reply carries the request id of the request, so replies can be sent in
+    any order. Requests with the same header are handled one at a time in
+    the order they were received, so for example the messages put to a
+    message handler keep their order. Requests with an unknown header get an
+    error reply.
+    """
     MessageHandle = namedtuple('MessageHandle', 'msg type')
 
-    def __init__(self, comm_socket):
+    def __init__(self, comm_socket, workers=config.APP_COMM_WORKERS):
         self._reset = config.RESET_REQ_HEADER
         self._signal = re.compile(config.RESET_REQ_STR % '(.*)')
         self._reply = config.RESET_REP_STR
+        self._resync = config.RESYNC_REQ_HEADER
+        self.resync_callback = None
+        self._crop = config.CROP_REQ_HEADER
+        self.crop_callback = None
         self.__comm_socket = comm_socket
-        self.__reset_flag = threading.Event()
+        self.__reply_url = 'inproc://comm-replies-%x' % id(self)
+        self.__reply_recv = comm_socket.context.socket(zmq.PULL)
+        self.__reply_recv.bind(self.__reply_url)
+        self.__reply_send = comm_socket.context.socket(zmq.PUSH)
+        self.__reply_send.connect(self.__reply_url)
+        self.__reply_lock = threading.Lock()
+        self.__pool = None
+        if workers > 0 and ThreadPoolExecutor is not None:
+            self.__pool = ThreadPoolExecutor(max_workers=workers)
+        # requests waiting behind one with the same header which is being handled
+        self.__lanes = {}
+        self.__lanes_lock = threading.Lock()
+        self.__reset_flags = ResetFlags()
         self.__message_handler = {}
         self.__thread = threading.Thread(target=self.comm_listener)
         self.__thread.daemon = True
 
-    def send_reply(self, header, msg, send_py_obj=False):
-        self.__comm_socket.send_string(header, zmq.SNDMORE)
-        if send_py_obj:
-            self.__comm_socket.send_pyobj(msg)
-        else:
-            self.__comm_socket.send_string(msg)
+    def send_reply(self, route, header, msg, send_py_obj=False):
+        """
+        Queues a reply to the client request with the routing envelope 'route'.
+        This can be called from any thread.
+        """
+        frames = route + [header.encode('utf-8'), encode_comm(msg, send_py_obj)]
+        with self.__reply_lock:
+            self.__reply_send.send_multipart(frames)
 
-    def register_handler(self, name, limit=0, is_pyobj=True):
+    def register_handler(self, name, limit=0, is_pyobj=True, callback=None, executor=None):
         if LOG.isEnabledFor(logging.DEBUG):
-            LOG.debug('Attempting to register message handler: name=%s, limit=%s, pyobj=%s', (name, limit, is_pyobj))
+            LOG.debug('Attempting to register message handler: name=%s, limit=%s, pyobj=%s', name, limit, is_pyobj)
         if name in self.__message_handler:
             if LOG.isEnabledFor(logging.WARN):
                 LOG.warning('Attempted to register message handler which already exists: %s', name)
             raise ValueError('Message handler \'%s\' already registered' % name)
-        handler = self.__message_handler[name] = MessageHandler(name, limit, is_pyobj)
+        handler = self.__message_handler[name] = MessageHandler(name, limit, is_pyobj, callback, executor)
         if LOG.isEnabledFor(logging.INFO):
             LOG.info('Sucessfully registered message handler: %s' % name)
         return handler
@@ -370,92 +1552,419 @@ class ZMQListener(object):
         return self.__message_handler.get(name)
 
     def comm_listener(self):
+        poller = zmq.Poller()
+        poller.register(self.__comm_socket, zmq.POLLIN)
+        poller.register(self.__reply_recv, zmq.POLLIN)
         while not self.__comm_socket.closed:
-            header = self.__comm_socket.recv_string()
-            if header == self._reset:
-                msg = self.__comm_socket.recv_string()
-                signal_matcher = self._signal.match(msg)
-                if signal_matcher is not None:
-                    self.set_flag()
-                    self.send_reply(self._reset, self._reply % signal_matcher.group(1))
-                    if LOG.isEnabledFor(logging.INFO):
-                        LOG.info('Received valid reset request: %s', msg)
-                else:
-                    self.send_reply(self._reset, "invalid request from client")
-                    if LOG.isEnabledFor(logging.WARN):
-                        LOG.warning('Invalid request received on comm port: %s', msg)
-            else:
-                if header in self.__message_handler:
-                    if self.__message_handler[header].is_pyobj:
-                        msg = self.__comm_socket.recv_pyobj()
-                    else:
-                        msg = self.__comm_socket.recv_string()
-                    try:
-                        self.__message_handler[header].put(msg)
-                        if LOG.isEnabledFor(logging.DEBUG):
-                            LOG.debug('Message for handler \'%s\' processed', header)
-                        self.send_reply(header, 'Message for handler processed')
-                    except queue.Full:
-                        if LOG.isEnabledFor(logging.WARN):
-                            LOG.warning('Message handler \'%s\' is full - request dropped', header)
-                        self.send_reply(header, 'Message handler full - request dropped')
-                else:
-                    if LOG.isEnabledFor(logging.DEBUG):
-                        LOG.debug('Received message for unregistered handler: %s', header)
+            try:
+                ready_socks = dict(poller.poll())
+                if self.__reply_recv in ready_socks:
+                    self.__comm_socket.send_multipart(self.__reply_recv.recv_multipart())
+                if self.__comm_socket in ready_socks:
+                    self._dispatch(self.__comm_socket.recv_multipart())
+            except zmq.ZMQError:
+                if self.__comm_socket.closed:
+                    break
+                raise
+            except Exception:
+                # a bad request must not stop the listener from serving the others
+                LOG.exception('Failed to dispatch request received on comm port')
+
+    def _dispatch(self, frames):
+        request = comm_envelope(frames)
+        if request is None:
+            if LOG.isEnabledFor(logging.WARN):
+                LOG.warning('Malformed request received on comm port - %d frames', len(frames))
+            return
+        if self.__pool is None:
+            self._handle(*request)
+            return
+        header = request[1]
+        with self.__lanes_lock:
+            lane = self.__lanes.get(header)
+            if lane is not None:
+                lane.append(request)
+                return
+            self.__lanes[header] = deque([request])
+        self.__pool.submit(self._handle_lane, header)
+
+    def _handle_lane(self, header):
+        """
+        Handles the queued requests with the header until there are none left.
+        """
+        while True:
+            with self.__lanes_lock:
+                lane = self.__lanes[header]
+                if not lane:
+                    del self.__lanes[header]
+                    return
+                request = lane.popleft()
+            self._handle(*request)
+
+    def _handle(self, route, header, body):
+        # undecodable headers are replaced, so they get the reply to an unknown header
+        header = header.decode('utf-8', 'replace')
+        try:
+            self.send_reply(route, header, self._process(header, body))
+        except Exception:
+            LOG.exception('Failed to handle request received on comm port')
+            self.send_reply(route, header, 'error handling request')
+
+    def _process(self, header, body):
+        """
+        Handles a request and returns the reply string.
+        """
+        if header == self._reset:
+            msg = decode_comm(body, False)
+            signal_matcher = self._signal.match(msg)
+            if signal_matcher is not None:
+                self.set_flag()
+                if LOG.isEnabledFor(logging.INFO):
+                    LOG.info('Received valid reset request: %s', msg)
+                return self._reply % signal_matcher.group(1)
+            if LOG.isEnabledFor(logging.WARN):
+                LOG.warning('Invalid request received on comm port: %s', msg)
+            return 'invalid request from client'
+        elif header == config.RESET_TOPIC_REQ_HEADER:
+            topic = decode_comm(body, False)
+            self.set_flag(topic)
+            if LOG.isEnabledFor(logging.INFO):
+                LOG.info('Received reset request for topic: %s', topic)
+            return config.RESET_TOPIC_REP_STR % topic
+        elif header == self._resync:
+            topic = decode_comm(body, False)
+            if self.resync_callback is not None:
+                self.resync_callback(topic)
+            return config.RESYNC_REP_STR % topic
+        elif header == self._crop:
+            try:
+                topic, client, roi = decode_comm(body, True)
+            except (ValueError, TypeError):
+                topic = None
+            # an empty reply tells the client the crop is not available
+            if topic is None or self.crop_callback is None:
+                if LOG.isEnabledFor(logging.WARN):
+                    LOG.warning('Unable to handle crop request received on comm port')
+                return ''
+            return self.crop_callback(topic, client, roi)
+        elif header in self.__message_handler:
+            handler = self.__message_handler[header]
+            try:
+                handler.put(decode_comm(body, handler.is_pyobj))
+                if LOG.isEnabledFor(logging.DEBUG):
+                    LOG.debug('Message for handler \'%s\' processed', header)
+                return 'Message for handler processed'
+            except queue.Full:
+                if LOG.isEnabledFor(logging.WARN):
+                    LOG.warning('Message handler \'%s\' is full - request dropped', header)
+                return 'Message handler full - request dropped'
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('Received message for unregistered handler: %s', header)
+        return 'No message handler registered for: %s' % header
 
-    def get_flag(self):
-        return self.__reset_flag.is_set()
+    def get_flag(self, topic=None):
+        return self.__reset_flags.is_set(topic)
 
-    def set_flag(self):
-        self.__reset_flag.set()
+    def set_flag(self, topic=None):
+        self.__reset_flags.set(topic)
 
-    def clear_flag(self):
-        self.__reset_flag.clear()
+    def clear_flag(self, topic=None):
+        self.__reset_flags.clear(topic)
+
+    @property
+    def reset_flags(self):
+        return self.__reset_flags
 
     def start(self):
         if not self.__thread.is_alive():
             self.__thread.start()
 
 
+class RequestTimeout(Exception):
+    """
+    Class for exceptions raised when a server does not reply to a request in
+    time.
+    """
+    pass
+
+
+class RequestFuture(object):
+    """
+    The pending reply to a request sent by ZMQRequester.
+    """
+    def __init__(self, header, deadline):
+        self.header = header
+        self.deadline = deadline
+        self.__done = threading.Event()
+        self.__callbacks = []
+        self.__lock = threading.Lock()
+        self.__result = None
+        self.__exception = None
+
+    def done(self):
+        return self.__done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the reply and returns it. Raises RequestTimeout if the server
+        did not reply in time.
+        """
+        if not self.__done.wait(timeout):
+            raise RequestTimeout('No reply yet to request: %s' % self.header)
+        if self.__exception is not None:
+            raise self.__exception
+        return self.__result
+
+    def exception(self, timeout=None):
+        if not self.__done.wait(timeout):
+            raise RequestTimeout('No reply yet to request: %s' % self.header)
+        return self.__exception
+
+    def add_done_callback(self, callback):
+        """
+        Adds a function which is called with the future once the reply arrives
+        or the request times out - right away if that already happened.
+        Callbacks run on the requester thread so they should not block.
+        """
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _finish(self, result, exception):
+        with self.__lock:
+            self.__result = result
+            self.__exception = exception
+            self.__done.set()
+            callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                LOG.exception('Request callback failed for request: %s', self.header)
+
+
 class ZMQRequester(object):
+    """
+    Sends requests to the comm socket of a server over a DEALER socket.
+
+    Requests are tagged with a request id and return a RequestFuture, so any
+    number of them can be outstanding at once. The socket is only used by a
+    requester thread, started on the first request, which sends the queued
+    requests, matches the replies to their futures and times out requests
+    which are not answered within their timeout.
+    """
     def __init__(self, comm_socket):
         self._reset = config.RESET_REQ_HEADER
         self._request = config.RESET_REQ_STR % socket.gethostname()
         self._req_reply = config.RESET_REP_STR % socket.gethostname()
         self.__comm_socket = comm_socket
-        self.__comm_lock = threading.Lock()
-        self.__pending_flag = threading.Event()
+        self.__wake_url = 'inproc://comm-requests-%x' % id(self)
+        self.__wake_recv = comm_socket.context.socket(zmq.PULL)
+        self.__wake_recv.bind(self.__wake_url)
+        self.__wake_send = comm_socket.context.socket(zmq.PUSH)
+        self.__wake_send.connect(self.__wake_url)
+        self.__lock = threading.Lock()
+        self.__ids = itertools.count()
+        self.__pending = {}
+        # guards the pending reset and resync requests, which are only sent once
+        self.__signal_lock = threading.Lock()
+        self.__reset_pending = None
+        self.__resync_pending = {}
         self.__thread = None
 
-    def send_request(self, header, msg, send_py_obj=True, recv_py_obj=False):
-        with self.__comm_lock:
-            self.__comm_socket.send_string(header, zmq.SNDMORE)
-            if send_py_obj:
-                self.__comm_socket.send_pyobj(msg)
-            else:
-                self.__comm_socket.send_string(msg)
-            rep_header = self.__comm_socket.recv_string()
-            if header != rep_header and LOG.isEnabledFor(logging.WARN):
-                LOG.warning('Request header does not match repy header: \'%s\' and \'%s\'', header, rep_header)
-            if recv_py_obj:
-                rep_msg = self.__comm_socket.recv_pyobj()
-            else:
-                rep_msg = self.__comm_socket.recv_string()
+    def send_request_async(self, header, msg, send_py_obj=True, recv_py_obj=False, timeout=config.APP_TIMEOUT):
+        """
+        Sends a request to the server without waiting for the reply. Returns a
+        RequestFuture for the reply, which fails with RequestTimeout if there
+        is no reply within 'timeout' seconds.
+        """
+        future = RequestFuture(header, None if timeout is None else time.time() + timeout)
+        frames = [header.encode('utf-8'), encode_comm(msg, send_py_obj)]
+        with self.__lock:
+            req_id = str(next(self.__ids)).encode('ascii')
+            self.__pending[req_id] = (future, recv_py_obj)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self._request_loop)
+                self.__thread.daemon = True
+                self.__thread.start()
+            self.__wake_send.send_multipart([b'', req_id] + frames)
+        return future
+
+    def send_request(self, header, msg, send_py_obj=True, recv_py_obj=False, timeout=config.APP_TIMEOUT):
+        """
+        Sends a request to the server and waits for the reply. Raises
+        RequestTimeout if there is no reply within 'timeout' seconds.
+        """
+        return self.send_request_async(header, msg, send_py_obj, recv_py_obj, timeout).result()
 
-            return rep_msg
+    def _request_loop(self):
+        poller = zmq.Poller()
+        poller.register(self.__comm_socket, zmq.POLLIN)
+        poller.register(self.__wake_recv, zmq.POLLIN)
+        while not self.__comm_socket.closed:
+            try:
+                ready_socks = dict(poller.poll(self._poll_timeout()))
+                if self.__wake_recv in ready_socks:
+                    self._forward_requests()
+                if self.__comm_socket in ready_socks:
+                    self._receive_replies()
+            except zmq.ZMQError:
+                if self.__comm_socket.closed:
+                    break
+                raise
+            self._expire_requests()
+
+    def _poll_timeout(self):
+        with self.__lock:
+            deadlines = [future.deadline for future, _ in self.__pending.values() if future.deadline is not None]
+        if not deadlines:
+            return None
+        return max(0, int(1000 * (min(deadlines) - time.time())) + 1)
+
+    def _forward_requests(self):
+        while True:
+            try:
+                self.__comm_socket.send_multipart(self.__wake_recv.recv_multipart(zmq.NOBLOCK))
+            except zmq.ZMQError as e:
+                if e.errno == zmq.EAGAIN:
+                    break
+                raise
+
+    def _receive_replies(self):
+        while True:
+            try:
+                frames = self.__comm_socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.ZMQError as e:
+                if e.errno == zmq.EAGAIN:
+                    break
+                raise
+            if len(frames) != 4 or frames[0] != b'':
+                if LOG.isEnabledFor(logging.WARN):
+                    LOG.warning('Malformed reply received on comm port - %d frames', len(frames))
+                continue
+            _, req_id, rep_header, rep_msg = frames
+            with self.__lock:
+                pending = self.__pending.pop(req_id, None)
+            if pending is None:
+                # the request already timed out
+                continue
+            future, recv_py_obj = pending
+            rep_header = rep_header.decode('utf-8')
+            if future.header != rep_header and LOG.isEnabledFor(logging.WARN):
+                LOG.warning('Request header does not match repy header: \'%s\' and \'%s\'', future.header, rep_header)
+            try:
+                future.set_result(decode_comm(rep_msg, recv_py_obj))
+            except Exception as err:
+                future.set_exception(err)
+
+    def _expire_requests(self):
+        now = time.time()
+        with self.__lock:
+            expired = [req_id for req_id, (future, _) in self.__pending.items()
+                       if future.deadline is not None and future.deadline <= now]
+            futures = [self.__pending.pop(req_id)[0] for req_id in expired]
+        for future in futures:
+            if LOG.isEnabledFor(logging.WARN):
+                LOG.warning('Server did not reply to request: %s', future.header)
+            future.set_exception(RequestTimeout('Server did not reply to request: %s' % future.header))
+
+    def _check_reply(self, future, expected, name):
+        try:
+            reply = future.result()
+        except RequestTimeout:
+            return
+        if reply != expected and LOG.isEnabledFor(logging.ERROR):
+            LOG.error('Server returned unexpected reply to %s request: %s', name, reply)
 
     def reset_signal(self):
-        # check to see if there is another pending reset req
-        if not self.__pending_flag.is_set():
+        """
+        Asks the server to reset its plots and waits for the reply.
+        """
+        self.send_reset_signal()
+        future = self.__reset_pending
+        if future is not None:
+            future.exception()
+
+    def send_reset_signal(self, *args):
+        """
+        Asks the server to reset its plots without waiting for the reply. Does
+        nothing if a reset request is still pending.
+        """
+        with self.__signal_lock:
+            if self.__reset_pending is not None and not self.__reset_pending.done():
+                return
             if LOG.isEnabledFor(logging.DEBUG):
                 LOG.debug('Sending reset request to server')
-            self.__pending_flag.set()
-            reply = self.send_request(self._reset, self._request, False)
-            if reply != self._req_reply and LOG.isEnabledFor(logging.ERROR):
-                LOG.error('Server returned unexpected reply to reset request: %s', reply)
-            self.__pending_flag.clear()
+            future = self.__reset_pending = self.send_request_async(self._reset, self._request, False)
+        future.add_done_callback(lambda done: self._check_reply(done, self._req_reply, 'reset'))
 
-    def send_reset_signal(self, *args):
-        self.__thread = threading.Thread(target=self.reset_signal)
-        self.__thread.daemon = True
-        self.__thread.start()
+    def send_topic_reset_signal(self, topic):
+        """
+        Asks the server to reset the plot of a single topic without waiting for
+        the reply. Returns the RequestFuture for the reply.
+        """
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('Sending reset request to server for topic: %s', topic)
+        future = self.send_request_async(config.RESET_TOPIC_REQ_HEADER, topic, False)
+        future.add_done_callback(lambda done: self._check_reply(done, config.RESET_TOPIC_REP_STR % topic, 'reset'))
+        return future
+
+    def resync_signal(self, topic):
+        """
+        Asks the server to send a full message for an append-stream topic and
+        waits for the reply.
+        """
+        self.send_resync_signal(topic).exception()
+
+    def send_resync_signal(self, topic):
+        """
+        Asks the server to send a full message for an append-stream topic
+        without waiting for the reply. Returns the RequestFuture for the reply,
+        which is the one of the pending resync request of the topic if there
+        is one.
+        """
+        with self.__signal_lock:
+            future = self.__resync_pending.get(topic)
+            if future is not None:
+                return future
+            if LOG.isEnabledFor(logging.DEBUG):
+                LOG.debug('Sending resync request to server for topic: %s', topic)
+            future = self.__resync_pending[topic] = self.send_request_async(config.RESYNC_REQ_HEADER, topic, False)
+
+        def resync_done(done):
+            with self.__signal_lock:
+                self.__resync_pending.pop(topic, None)
+            self._check_reply(done, config.RESYNC_REP_STR % topic, 'resync')
+
+        future.add_done_callback(resync_done)
+        return future
+
+    def crop_signal(self, topic, client, roi):
+        """
+        Asks the server for a full resolution crop of an image topic and waits
+        for the reply. Returns the derived topic the crop is published to, or
+        None if the server can't provide it.
+        """
+        try:
+            return self.send_crop_signal(topic, client, roi).result() or None
+        except RequestTimeout:
+            return None
+
+    def send_crop_signal(self, topic, client, roi):
+        """
+        Asks the server for a full resolution crop of an image topic without
+        waiting for the reply. Returns the RequestFuture for the reply, which
+        is the derived topic the crop is published to or an empty string if
+        the server can't provide it.
+        """
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('Sending crop request to server for topic: %s', topic)
+        return self.send_request_async(config.CROP_REQ_HEADER, (topic, client, roi))
@@ -155,6 +155,14 @@ def parse_cmdline():
         help='show grid lines overlaid on plots'
     )
 
+    parser.add_argument(
+        '--window',
+        metavar='WINDOW',
+        type=float,
+        default=config.APP_WINDOW,
+        help='only show the counts of the last WINDOW seconds for delta-mode histograms'
+    )
+
     parser.add_argument(
         '--client',
         metavar='CLIENT',
@@ -196,10 +204,36 @@ def topic_client(client_info, plot_info):
         port = None
     LOG.debug('Attempting to retrieve topic list from server %s at port %s', server, port)
     topic_sub = app.ZMQSubscriber(client_info)
-    topics = topic_sub.data_recv()
+    # skip any incremental updates until the snapshot sent on subscription arrives
+    update = topic_sub.data_recv()
+    while not update.snapshot:
+        update = topic_sub.data_recv()
     LOG.info('Topic list successfully retrieved from %s', server)
     # Now print the topic list
-    LOG.info("Available topics on %s: %s", server, topics)
+    LOG.info("Available topics on %s:", server)
+    for name in sorted(update.topics):
+        LOG.info("  %s", update.topics[name].summary())
+
+
+def client_command(client_info, topic):
+    """
+    Returns the command line for running a psplot client for the topic on the
+    same server as 'client_info'. This is for starting clients from processes
+    which should not fork, like a running Qt application.
+    """
+    name_parse = re.match(r'tcp://(?P<server>\S+):(?P<port>\d+)', client_info.data_socket_url)
+    if name_parse is None:
+        raise ValueError('Unable to parse the server socket url: %s' % client_info.data_socket_url)
+    return [
+        sys.executable, '-m', 'psmon.client',
+        '--server', name_parse.group('server'),
+        '--port', name_parse.group('port'),
+        '--rate', str(client_info.rate),
+        '--buffer', str(client_info.buffer),
+        '--recv-limit', str(client_info.recvlimit),
+        '--client', client_info.renderer,
+        topic,
+    ]
 
 
 def spawn_process(client_info, plot_info, target=plot_client):
@@ -230,7 +264,8 @@ def main():
             interpol=args.interpolation,
             palette=args.palette,
             grid=args.grid,
-            auto_zrange=args.auto_z_range
+            auto_zrange=args.auto_z_range,
+            window=args.window
         )
 
         # creat the tcp socket urls from cli parameters
@@ -1,4 +1,5 @@
 import logging
+import functools
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
 
@@ -33,9 +34,13 @@ def main(client_info, plot_info):
         LOG.exception('Server returned an unknown datatype: %s', type(init_data))
         return 1
 
+    # define signal sender function
+    reset_req = app.ZMQRequester(zmqsub.comm_socket)
+
     # start the plotting rendering routine
     try:
-        plot = data_type(init_data, zmqsub.get_socket_gen(), plot_info, rate=1.0/client_info.rate)
+        plot = data_type(init_data, zmqsub.get_socket_gen(), plot_info, rate=1.0/client_info.rate,
+                         resync=functools.partial(reset_req.send_resync_signal, client_info.topic))
         plot_ani = plot.animate()  # noqa: F841
     except MplClientTypeError as err:
         LOG.critical('Server returned datagram with an unsupported type: %s', err)
@@ -63,11 +68,14 @@ def main(client_info, plot_info):
         auto_zoom_button = Button(plt.axes([az_xpos, az_ypos, az_xlen, az_ylen]), 'Auto Zoom')
         auto_zoom_button.on_clicked(plot.ax.autoscale)
 
-    # define signal sender function
-    reset_req = app.ZMQRequester(zmqsub.comm_socket)
+    # only the topic shown by this client is reset
+    reset_plots_button = Button(plt.axes([0.87, 0.015, 0.12, 0.035]), 'Reset Plot')
+    reset_plots_button.on_clicked(lambda event: reset_req.send_topic_reset_signal(client_info.topic))
 
-    reset_plots_button = Button(plt.axes([0.87, 0.015, 0.12, 0.035]), 'Reset Plots')
-    reset_plots_button.on_clicked(reset_req.send_reset_signal)
+    # delta-mode histograms keep their sums on the client so they are cleared here
+    if getattr(plot, 'counts', None) is not None:
+        clear_counts_button = Button(plt.axes([0.74, 0.015, 0.12, 0.035]), 'Clear Counts')
+        clear_counts_button.on_clicked(plot.clear_counts)
 
     try:
         plt.show()
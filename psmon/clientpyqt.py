@@ -1,7 +1,12 @@
+import os
 import sys
+import socket
 import logging
+import functools
+import itertools
+import subprocess
 
-from psmon import app, config, util
+from psmon import app, config, util, client
 
 # Suppress mpi setup output
 with util.redirect_stdout():
@@ -12,6 +17,8 @@ with util.redirect_stdout():
 
 
 LOG = logging.getLogger(__name__)
+# numbers the crops requested by this client so each gets its own topic
+CROP_COUNTER = itertools.count()
 
 
 def set_color_opt(option, value):
@@ -22,6 +29,34 @@ def set_color_opt(option, value):
             LOG.warning('Inavlid %s color for pyqtgraph: %s', option, value)
 
 
+def is_crop_topic(topic):
+    """
+    Returns True if the topic is the derived topic of a crop of an image.
+    """
+    return config.APP_SUBTOPIC_FORMAT % ('', config.APP_CROP_NAME % '') in topic
+
+
+def crop_request(requester, client_info, roi):
+    """
+    Asks the server for a full resolution crop of the topic of the client and
+    starts a new client for the derived topic it is published to.
+    """
+    def started(future):
+        try:
+            topic = future.result()
+        except app.RequestTimeout:
+            topic = None
+        if not topic:
+            LOG.warning('Server is unable to provide a crop of topic: %s', client_info.topic)
+            return
+        LOG.info('Starting client for crop topic: %s', topic)
+        subprocess.Popen(client.client_command(client_info, topic))
+
+    # the reply is handled on the requester thread so the event loop isn't blocked
+    client_id = '%s-%d-%d' % (socket.gethostname(), os.getpid(), next(CROP_COUNTER))
+    requester.send_crop_signal(client_info.topic, client_id, roi).add_done_callback(started)
+
+
 def main(client_info, plot_info):
     # initialize all the socket connections
     zmqsub = app.ZMQSubscriber(client_info)
@@ -58,17 +93,26 @@ def main(client_info, plot_info):
         min(screen_geo.height(), config.PYQT_LARGE_WIN.y),
     )
 
+    # define signal sender function
+    reset_req = app.ZMQRequester(zmqsub.comm_socket)
+
+    # crops of crops are not supported by the server
+    if is_crop_topic(client_info.topic):
+        crop = None
+    else:
+        crop = functools.partial(crop_request, reset_req, client_info)
+
     # start the plotting rendering routine
     try:
-        plot = data_type(init_data, zmqsub.get_socket_gen(), plot_info, rate=1.0/client_info.rate)
+        plot = data_type(init_data, zmqsub.get_socket_gen(), plot_info, rate=1.0/client_info.rate,
+                         resync=functools.partial(reset_req.send_resync_signal, client_info.topic),
+                         reset=functools.partial(reset_req.send_topic_reset_signal, client_info.topic),
+                         crop=crop)
         plot.animate()
     except PyQtClientTypeError as err:
         LOG.critical('Server returned datagram with an unsupported type: %s', err)
         return 1
 
-    # define signal sender function
-    # reset_req = app.ZMQRequester(zmqsub.comm_socket)
-
     if (sys.flags.interactive != 1) or not hasattr(QtCore, 'PYQT_VERSION'):
         QtWidgets.QApplication.instance().exec_()
 
@@ -9,7 +9,13 @@ Resolution = namedtuple('Resolution', 'x y')
 RESET_REQ_HEADER = 'reset'
 RESET_REQ_STR = 'reset signal - %s'
 RESET_REP_STR = 'reset signal recieved from %s'
+RESET_TOPIC_REQ_HEADER = 'reset-topic'
+RESET_TOPIC_REP_STR = 'reset requested for %s'
+RESYNC_REQ_HEADER = 'resync'
+RESYNC_REP_STR = 'resync requested for %s'
+CROP_REQ_HEADER = 'crop'
 ZMQ_TOPIC_DELIM_CHAR = '\x00'
+ZMQ_APPEND_FLAG_CHAR = '+'
 # CONFIG KEYS FOR LOGGING
 LOG_BASE_NAME = __package__
 LOG_LEVEL = 'INFO'
@@ -25,6 +31,7 @@ APP_SERVER = 'localhost'
 APP_PORT = 12323
 APP_COMM_OFFSET = 1
 APP_TIMEOUT = 5.0
+APP_COMM_WORKERS = 2
 APP_RATE = 5.0
 APP_BUFFER = 5
 APP_CLIENT = 'pyqt'
@@ -43,9 +50,36 @@ APP_TEXT_COLOR = None
 APP_PALETTE = None
 APP_GRID = False
 APP_AUTO_ZRANGE = False
+APP_WINDOW = None
 APP_LOG = False
+APP_RELAY_POLL = 100
+APP_IDLE_REFRESH = 10.0
+APP_CACHE_BYTES = 256 * 1024 * 1024
+APP_CACHE_TTL = None
+APP_CACHE_SWEEP = 1.0
+APP_SEND_DEPTH = 4
+APP_SEND_POLICY = 'drop-oldest'
+APP_SEND_TIMEOUT = 0.1
+APP_KEYFRAME_INTERVAL = 100
+APP_SPARSE_DENSITY = 0.1
+APP_ACCUM_FRAMES = 10
+APP_ACCUM_ALPHA = 0.1
+APP_SUBTOPIC_FORMAT = '%s/%s'
+APP_CROP_NAME = 'crop-%s'
+APP_CROP_TIMEOUT = 30.0
+APP_SERIAL_WORKERS = 0
+APP_WORKER_SLOTS = 4
+APP_WORKER_SLOT_BYTES = 16 * 1024 * 1024
+APP_WORKER_ALIGN = 64
+APP_WORKER_POLL = 0.1
+APP_SERIAL_CODEC = None
+APP_SERIAL_MIN_SIZE = 64 * 1024
+APP_SHARE_COMPARE_BYTES = 64 * 1024
+APP_GAUGE_KEYFRAME = 100
 APP_RESERVED_TOPIC = 'psmon-internal'
 APP_TOPIC_LIST = APP_RESERVED_TOPIC + '-topics'
+APP_RETIRE_TOPIC = APP_RESERVED_TOPIC + '-retire'
+APP_REGISTER_TOPIC = APP_RESERVED_TOPIC + '-register'
 # PYQT DEFAULT APPEARANCE CONFIG
 PYQT_SMALL_WIN = Resolution(640, 480)
 PYQT_LARGE_WIN = Resolution(3840, 2880)
@@ -56,6 +90,7 @@ PYQT_PLOT_SYMBOL = 'o'
 PYQT_COLOR_PALETTE = 'thermal'
 PYQT_AUTO_COLOR_MAX = 9
 PYQT_HIST_ALPHA = 80
+PYQT_FORMAT_CACHE_SIZE = 1024
 PTQT_HIST_LINE_COLOR = 'w'
 PYQT_MARK_SIZE = 10
 PYQT_MARK_SIZE_SMALL = 5
@@ -72,3 +107,4 @@ MPL_COLOR_PALETTE = 'hot'
 MPL_AXES_BKG_COLOR = 'w'
 MPL_HISTO_STYLE = 'steps-mid'
 MPL_HIST_ALPHA = 1.0
+MPL_FORMAT_CACHE_SIZE = 1024
@@ -15,7 +15,7 @@ def _get_banner(host, port):
     banner_base = '\n{sep}\n*  {wel:<{width}s}  *\n*  {info:<{width}s}  *\n*  {help:<{width}s}  *\n{sep}\n'
     welcome_line = 'Welcome to the psmon server request client'
     info_line = 'Connected to host \'{host:s}\' on port \'{port:d}\''.format(host=host, port=port)
-    help_line = 'Available commands: \'request\', \'reset\''
+    help_line = 'Available commands: \'request\', \'request_async\', \'reset\''
     width = max(len(welcome_line), len(info_line), len(help_line))
     separator = '*' * (width + 6)
 
@@ -65,12 +65,13 @@ def main():
 
     try:
         _zmqcontext = zmq.Context()
-        _comm_socket = _zmqcontext.socket(zmq.REQ)
+        _comm_socket = _zmqcontext.socket(zmq.DEALER)
         _comm_socket.connect('tcp://%s:%d' % (_args.server, _args.port))
         _requester = app.ZMQRequester(_comm_socket)
         host = _args.server  # noqa: F841
         port = _args.port  # noqa: F841
         request = _requester.send_request  # noqa: F841
+        request_async = _requester.send_request_async  # noqa: F841
         reset = _requester.send_reset_signal  # noqa: F841
         LOG.debug('Request client started successfully')
 
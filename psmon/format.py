@@ -1,5 +1,5 @@
 import pyqtgraph as pg
-from pyqtgraph.Qt import QtCore
+from pyqtgraph.Qt import QtCore, QtGui
 
 from psmon import config
 
@@ -64,6 +64,10 @@ LINE_MAP = {
 }
 
 
+# compiled formats shared by all the plots of the client
+FORMAT_CACHE = {}
+
+
 LEGEND_CENTER_X = -config.PYQT_SMALL_WIN.x/3
 LEGEND_CENTER_Y = -config.PYQT_SMALL_WIN.y/4
 LEGEND_TUPLE_SCALE = 100
@@ -106,7 +110,43 @@ def parse_fmt_leg(leg_offset):
             raise ValueError('Illegal legend offset value: %s' % str(leg_offset))
 
 
-def parse_fmt_str(fmt_str, color_index):
+def compiled_fmt(key, compile_func, *args):
+    """
+    Returns the compiled format for 'key', calling compile_func with 'args' to
+    create it if it is not cached yet. Compiled formats are tuples, so they can
+    be shared between plots. The cache is emptied if it grows past
+    config.PYQT_FORMAT_CACHE_SIZE entries.
+    """
+    compiled = FORMAT_CACHE.get(key)
+    if compiled is None:
+        if len(FORMAT_CACHE) >= config.PYQT_FORMAT_CACHE_SIZE:
+            FORMAT_CACHE.clear()
+        compiled = FORMAT_CACHE[key] = compile_func(*args)
+    return compiled
+
+
+def fmt_kwargs(compiled):
+    """
+    Returns the keyword arguments of a compiled format with copies of its pens
+    and brushes, so changing them does not change the cached ones shared with
+    other plots. Qt shares the data of the copies until one is changed, so
+    they are cheap to make.
+    """
+    kwargs = {}
+    for name, value in compiled:
+        if isinstance(value, QtGui.QPen):
+            value = QtGui.QPen(value)
+        elif isinstance(value, QtGui.QBrush):
+            value = QtGui.QBrush(value)
+        kwargs[name] = value
+    return kwargs
+
+
+def parse_fmt_str(fmt_str):
+    return compiled_fmt(('str', fmt_str), compile_fmt_str, fmt_str)
+
+
+def compile_fmt_str(fmt_str):
     color = None
     line_style = None
     marker = None
@@ -144,9 +184,13 @@ def parse_fmt_str(fmt_str, color_index):
 
 
 def parse_fmt_xyplot(fmt_str, color_index=0):
+    return fmt_kwargs(compiled_fmt(('xyplot', fmt_str, color_index), compile_fmt_xyplot, fmt_str, color_index))
+
+
+def compile_fmt_xyplot(fmt_str, color_index):
     line = None
     fmt_dict = {}
-    color, line_style, marker, marker_size = parse_fmt_str(fmt_str, color_index)
+    color, line_style, marker, marker_size = parse_fmt_str(fmt_str)
 
     # set color by rotating scheme if none is specified
     if color is None:
@@ -162,17 +206,22 @@ def parse_fmt_xyplot(fmt_str, color_index=0):
     if marker is not None or line is not None:
         fmt_dict['symbol'] = marker
     if color is not None:
-        fmt_dict['symbolBrush'] = color
+        fmt_dict['symbolBrush'] = pg.mkBrush(color)
     if marker_size is not None:
         fmt_dict['symbolSize'] = marker_size
 
-    return fmt_dict
+    return tuple(fmt_dict.items())
 
 
 def parse_fmt_hist(fmt_str, fill=True, color_index=0):
+    return fmt_kwargs(compiled_fmt(('hist', fmt_str, fill, color_index), compile_fmt_hist, fmt_str, fill,
+                                   color_index))
+
+
+def compile_fmt_hist(fmt_str, fill, color_index):
     line = None
     fmt_dict = {}
-    color, line_style, marker, marker_size = parse_fmt_str(fmt_str, color_index)
+    color, line_style, marker, marker_size = parse_fmt_str(fmt_str)
 
     # set color by rotating scheme if none is specified
     if color is None:
@@ -188,10 +237,10 @@ def parse_fmt_hist(fmt_str, fill=True, color_index=0):
             line = pg.mkPen(color, style=line_style)
 
     # brush entry should always be present in the output
-    fmt_dict['fillBrush'] = color
+    fmt_dict['fillBrush'] = pg.mkBrush(color)
 
     # only pass add these entries if they are non-null
     if line is not None:
         fmt_dict['pen'] = line
 
-    return fmt_dict
+    return tuple(fmt_dict.items())
@@ -1,6 +1,7 @@
 import sys
 import math
 import logging
+import numpy as np
 try:
     from collections.abc import Mapping
 except ImportError:
@@ -9,12 +10,14 @@ except ImportError:
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 from matplotlib import rcParams
+from matplotlib.ticker import FuncFormatter, ScalarFormatter
 from matplotlib.axes._base import _process_plot_format
 
 from psmon import config
 from psmon.util import is_py_iter, arg_inflate_flat, arg_inflate_tuple, inflate_input, check_data
-from psmon.util import window_ratio, ts_to_dt
-from psmon.plots import Hist, Image, XYPlot, MultiPlot
+from psmon.util import window_ratio, ts_to_dt, DateConverter, RingBuffer, AppendBuffer, HistAccumulator
+from psmon.util import SparseImageBuffer, dequantize, to_quantized
+from psmon.plots import Hist, Hist2D, Image, SparseImage, XYPlot, MultiPlot, Scalar
 
 
 LOG = logging.getLogger(__name__)
@@ -22,12 +25,32 @@ LOG = logging.getLogger(__name__)
 
 TypeMap = {
     Hist: 'HistClient',
+    Hist2D: 'Hist2DClient',
     Image: 'ImageClient',
+    SparseImage: 'ImageClient',
     XYPlot: 'XYPlotClient',
     MultiPlot: 'MultiPlotClient',
+    Scalar: 'ScalarClient',
 }
 
 
+# parsed format strings shared by all the plots of the client
+FORMAT_CACHE = {}
+
+
+def process_plot_format(fmt):
+    """
+    Returns the linestyle, marker and color of a matplotlib format string,
+    parsing each format string only once.
+    """
+    parsed = FORMAT_CACHE.get(fmt)
+    if parsed is None:
+        if len(FORMAT_CACHE) >= config.MPL_FORMAT_CACHE_SIZE:
+            FORMAT_CACHE.clear()
+        parsed = FORMAT_CACHE[fmt] = _process_plot_format(fmt)
+    return parsed
+
+
 def type_getter(data_type, mod_name=__name__):
     plot_type_name = TypeMap.get(data_type)
     if plot_type_name is None:
@@ -59,10 +82,36 @@ class PlotClient(object):
         self.multi_plot = False
         self.xdate = init.xdate
         self.ydate = init.ydate
+        self.shared = None
+        self.dates = {}
+        # callback for asking the server to resync an append-stream topic
+        self.resync = kwargs.get('resync')
+
+    def to_dt(self, timestamps, key=None):
+        """
+        Converts timestamps to datetimes. When updated as part of a MultiPlot the
+        conversions of arrays shared between its plots are only done once.
+        Otherwise if 'key' is given the conversion of the previous update with
+        the same key is reused for the points which are unchanged.
+        """
+        if self.shared is not None and isinstance(timestamps, np.ndarray):
+            shared_key = id(timestamps)
+            if shared_key not in self.shared:
+                self.shared[shared_key] = ts_to_dt(timestamps)
+            return self.shared[shared_key]
+        if key is None:
+            return ts_to_dt(timestamps)
+        if key not in self.dates:
+            self.dates[key] = DateConverter()
+        return self.dates[key].convert(timestamps)
 
     def update_sub(self, data):
         pass
 
+    def request_resync(self):
+        if self.resync is not None:
+            self.resync()
+
     def update(self, data):
         if data is not None:
             self.set_title(data.ts)
@@ -138,10 +187,11 @@ class PlotClient(object):
         inflated_args = arg_inflate_tuple(1, check_data(x_vals), check_data(y_vals), new_fmts)
         for index, (plot, data_tup, old_fmt) in enumerate(zip(plots, inflated_args, old_fmts)):
             x_val, y_val, new_fmt = data_tup
-            plot.set_data(ts_to_dt(x_val) if self.xdate else x_val, ts_to_dt(y_val) if self.ydate else y_val)
+            plot.set_data(self.to_dt(x_val, ('x', index)) if self.xdate else x_val,
+                          self.to_dt(y_val, ('y', index)) if self.ydate else y_val)
             if new_fmt != old_fmt:
                 # parse the format string
-                linestyle, marker, color = _process_plot_format(new_fmt)
+                linestyle, marker, color = process_plot_format(new_fmt)
                 linestyle = linestyle or rcParams['lines.linestyle']
                 marker = marker or rcParams['lines.marker']
                 color = color or rcParams['lines.color']
@@ -159,7 +209,7 @@ class PlotClient(object):
 
 
 class MultiPlotClient(object):
-    def __init__(self, init, framegen, info, rate):
+    def __init__(self, init, framegen, info, rate, **kwargs):
         # set default column and row values
         ncols = init.size
         nrows = 1
@@ -187,7 +237,8 @@ class MultiPlotClient(object):
         self.ax = self.ax.flatten()
         if self.figure.canvas.manager is not None:
             self.figure.canvas.manager.set_window_title(init.title)
-        self.plots = [type_getter(type(data_obj))(data_obj, None, info, rate, figax=(self.figure, subax))
+        self.plots = [type_getter(type(data_obj))(data_obj, None, info, rate, figax=(self.figure, subax),
+                                                  resync=kwargs.get('resync'))
                       for data_obj, subax in zip(init.data_con, self.ax)]
         self.framegen = framegen
         self.rate_ms = rate * 1000
@@ -196,8 +247,12 @@ class MultiPlotClient(object):
 
     def update(self, data):
         if data is not None:
+            # the subplots may reference the same arrays (e.g. a common x axis)
+            shared = {}
             for plot, plot_data in zip(self.plots, data.data_con):
+                plot.shared = shared
                 plot.update(plot_data)
+                plot.shared = None
 
     def animate(self):
         return animation.FuncAnimation(self.figure, self.update, self.ani_func, interval=self.rate_ms)
@@ -207,28 +262,30 @@ class MultiPlotClient(object):
 
 
 class ImageClient(PlotClient):
+    # the corner of the axes where the first pixel of the image goes
+    origin = None
+
     def __init__(self, init_im, framegen, info, rate=1, **kwargs):
         super(ImageClient, self).__init__(init_im, framegen, info, rate, **kwargs)
+        # dense copy of the image for topics which send sparse images
+        self.sparse = SparseImageBuffer()
+        self.sparse.apply(init_im)
         # if a color palette is specified check to see if it valid
         cmap = plt.get_cmap(config.MPL_COLOR_PALETTE)
         # deal with custom axis ranges if requested
-        if init_im.pos is None and init_im.scale is None:
-            extent = None
-        else:
-            x1 = 0 if init_im.pos is None else init_im.pos[0]
-            xscale = 1 if init_im.scale is None else init_im.scale[0]
-            y1 = 0 if init_im.pos is None else init_im.pos[1]
-            yscale = 1 if init_im.scale is None else init_im.scale[1]
-            extent = [x1, x1 + xscale * init_im.image.shape[1], y1 + yscale * init_im.image.shape[0], y1]
+        extent = self.image_extent(init_im)
         if self.info.palette is not None:
             try:
                 cmap = plt.get_cmap(self.info.palette)
             except ValueError:
                 LOG.warning('Inavlid color palette for matplotlib: %s - Falling back to default: %s',
                             self.info.palette, cmap.name)
-        self.im = self.ax.imshow(init_im.image, interpolation=self.info.interpol, cmap=cmap, extent=extent)
-        self.im.set_clim(self.info.zrange)
+        self.im = self.ax.imshow(init_im.image, interpolation=self.info.interpol, cmap=cmap, extent=extent,
+                                 origin=self.origin)
         self.cb = self.figure.colorbar(self.im, ax=self.ax)
+        self.quant = None
+        if not self.set_quantization(init_im):
+            self.im.set_clim(self.info.zrange)
         self.set_cb_col()
         self.aspect_lock = init_im.aspect_lock
         self.aspect_ratio = init_im.aspect_ratio
@@ -241,22 +298,89 @@ class ImageClient(PlotClient):
         Updates the data in the image - none means their was no update for this interval
         """
         if data is not None:
+            self.sparse.apply(data)
             if self.aspect_lock != data.aspect_lock or self.aspect_ratio != data.aspect_ratio:
                 self.aspect_lock = data.aspect_lock
                 self.aspect_ratio = data.aspect_ratio
                 self.set_aspect(self.aspect_lock, self.aspect_ratio)
+            self.set_quantization(data)
             self.im.set_data(data.image)
         return self.im
 
+    def set_quantization(self, data):
+        """
+        Quantized images are shown without converting them back, so the color
+        limits are set in quantized units instead: the z range if one was
+        specified and otherwise the full range of the quantized type. The
+        colorbar labels still show the original units. Returns True if the
+        image is quantized.
+        """
+        quant = (data.qoffset, data.qstep, data.qlog) if data.quantized else None
+        if quant != self.quant:
+            self.quant = quant
+            if quant is not None:
+                if self.info.zrange is not None:
+                    self.im.set_clim(*to_quantized(self.info.zrange, *quant))
+                else:
+                    self.im.set_clim(0, np.iinfo(data.image.dtype).max)
+                self.cb.formatter = FuncFormatter(lambda value, pos: '%.4g' % dequantize(value, *quant))
+            else:
+                self.cb.formatter = ScalarFormatter()
+                if self.info.zrange is not None:
+                    self.im.set_clim(self.info.zrange)
+                else:
+                    self.im.autoscale()
+            self.cb.update_ticks()
+        return quant is not None
+
+    def image_extent(self, data):
+        """
+        Returns the extent of the image on the axes or None to place it using
+        its pixel indices.
+        """
+        if data.pos is None and data.scale is None:
+            return None
+        x1 = 0 if data.pos is None else data.pos[0]
+        xscale = 1 if data.scale is None else data.scale[0]
+        y1 = 0 if data.pos is None else data.pos[1]
+        yscale = 1 if data.scale is None else data.scale[1]
+        return [x1, x1 + xscale * data.image.shape[1], y1 + yscale * data.image.shape[0], y1]
+
     def set_cb_col(self):
         if self.info.fore_col is not None:
             self.cb.outline.set_color(self.info.fore_col)
             self.set_ax_col(self.cb.ax)
 
 
+class Hist2DClient(ImageClient):
+    # histograms always have the first y bin at the bottom
+    origin = 'lower'
+
+    def __init__(self, init_hist, datagen, info, rate=1, **kwargs):
+        super(Hist2DClient, self).__init__(init_hist, datagen, info, rate, **kwargs)
+        self.extent = self.image_extent(init_hist)
+
+    def image_extent(self, data):
+        return [data.xbins[0], data.xbins[-1], data.ybins[0], data.ybins[-1]]
+
+    def update_sub(self, data):
+        """
+        Updates the data in the histogram - none means their was no update for this interval
+        """
+        if data is not None:
+            extent = self.image_extent(data)
+            if extent != self.extent:
+                self.extent = extent
+                self.im.set_extent(extent)
+        return super(Hist2DClient, self).update_sub(data)
+
+
 class HistClient(PlotClient):
     def __init__(self, init_hist, datagen, info, rate=1, **kwargs):
         super(HistClient, self).__init__(init_hist, datagen, info, rate, **kwargs)
+        self.counts = None
+        self.last_data = None
+        self.apply_counts(init_hist)
         # convert to datetime if requested
         bins = ts_to_dt(init_hist.bins) if self.xdate else init_hist.bins
         values = ts_to_dt(init_hist.values) if self.ydate else init_hist.values
@@ -277,16 +401,51 @@ class HistClient(PlotClient):
         self.set_grid_lines()
         self.add_legend(self.hists, init_hist.values, init_hist.leg_label, init_hist.leg_offset)
 
+    def apply_counts(self, data):
+        """
+        Adds the counts of a delta-mode message to the client side sums,
+        replacing the values of the message with the counts to show. A resync is
+        requested if a message was missed.
+        """
+        if data.seq is not None:
+            if self.counts is None:
+                self.counts = HistAccumulator(self.info.window)
+            if not self.counts.apply(data):
+                LOG.warning('Missed delta messages - requesting a resync')
+                self.request_resync()
+            self.last_data = data
+
+    def clear_counts(self, *args):
+        """
+        Resets the counts shown for a delta-mode histogram.
+        """
+        if self.counts is not None:
+            self.counts.reset()
+            self.refresh_counts()
+
+    def refresh_counts(self):
+        counts = self.counts.view()
+        if self.last_data is not None and counts:
+            self.last_data.values = counts if is_py_iter(self.last_data.values) else counts[0]
+            self.draw_hists(self.last_data)
+
     def update_sub(self, data):
         if data is not None:
-            # pyqtgraph needs a trailing bin edge that mpl doesn't so check for that
-            corrected_bins = self.correct_bins(data.bins, data.values)
-            self.update_plot_data(self.hists, corrected_bins, data.values, data.formats, self.formats)
-            self.fill(corrected_bins, data.values, data.fills)
-            self.ax.relim()
-            self.ax.autoscale_view()
+            self.apply_counts(data)
+            self.draw_hists(data)
+        elif self.counts is not None and self.counts.window is not None:
+            # let counts that are older than the window drop off
+            self.refresh_counts()
         return self.hists
 
+    def draw_hists(self, data):
+        # pyqtgraph needs a trailing bin edge that mpl doesn't so check for that
+        corrected_bins = self.correct_bins(data.bins, data.values)
+        self.update_plot_data(self.hists, corrected_bins, data.values, data.formats, self.formats)
+        self.fill(corrected_bins, data.values, data.fills)
+        self.ax.relim()
+        self.ax.autoscale_view()
+
     def correct_bins(self, bins, values):
         """
         Checks that number of bins is correct for matplotlib. pyqtgraph needs a
@@ -329,6 +488,8 @@ class HistClient(PlotClient):
 class XYPlotClient(PlotClient):
     def __init__(self, init_plot, datagen, info, rate=1, **kwargs):
         super(XYPlotClient, self).__init__(init_plot, datagen, info, rate, **kwargs)
+        self.stream = None
+        self.apply_stream(init_plot)
         plot_args = arg_inflate_flat(
             1,
             ts_to_dt(init_plot.xdata) if self.xdate else init_plot.xdata,
@@ -343,9 +504,68 @@ class XYPlotClient(PlotClient):
         self.set_grid_lines()
         self.add_legend(self.plots, init_plot.ydata, init_plot.leg_label, init_plot.leg_offset)
 
+    def apply_stream(self, data):
+        """
+        Adds the points of an append-stream message to the client side buffer,
+        replacing the series of the message with the buffered ones. A resync is
+        requested if a message was missed.
+        """
+        if data.seq is not None:
+            if self.stream is None:
+                self.stream = AppendBuffer()
+            if not self.stream.apply(data):
+                LOG.warning('Missed append messages - requesting a resync')
+                self.request_resync()
+
     def update_sub(self, data):
         if data is not None:
+            self.apply_stream(data)
             self.update_plot_data(self.plots, data.xdata, data.ydata, data.formats, self.formats)
             self.ax.relim()
             self.ax.autoscale_view()
         return self.plots
+
+
+class ScalarClient(PlotClient):
+    def __init__(self, init_plot, datagen, info, rate=1, **kwargs):
+        super(ScalarClient, self).__init__(init_plot, datagen, info, rate, **kwargs)
+        self.times = RingBuffer(init_plot.npoints)
+        self.values = RingBuffer(init_plot.npoints)
+        self.add_points(init_plot)
+        self.plots = self.ax.plot(
+            ts_to_dt(self.times.data) if self.xdate else self.times.data,
+            ts_to_dt(self.values.data) if self.ydate else self.values.data,
+            init_plot.formats
+        )
+        self.formats = [init_plot.formats]
+        self.set_aspect()
+        self.set_xy_ranges()
+        self.set_log_scale()
+        self.set_grid_lines()
+        self.add_legend(self.plots, self.values.data, init_plot.leg_label, init_plot.leg_offset)
+
+    def add_points(self, data):
+        """
+        Adds the batch of points to the history kept by the client, or replaces
+        the history with the points of a message which is not a batch
+        """
+        if not data.append:
+            self.times = RingBuffer(data.npoints)
+            self.values = RingBuffer(data.npoints)
+        elif data.npoints != self.times.size:
+            times = RingBuffer(data.npoints)
+            values = RingBuffer(data.npoints)
+            times.extend(self.times.data)
+            values.extend(self.values.data)
+            self.times = times
+            self.values = values
+        self.times.extend(data.times)
+        self.values.extend(data.values)
+
+    def update_sub(self, data):
+        if data is not None:
+            self.add_points(data)
+            self.update_plot_data(self.plots, self.times.data, self.values.data, data.formats, self.formats)
+            self.ax.relim()
+            self.ax.autoscale_view()
+        return self.plots
@@ -8,11 +8,12 @@ except ImportError:
     from collections import Mapping
 
 import pyqtgraph as pg
-from pyqtgraph.Qt import QtCore
+from pyqtgraph.Qt import QtCore, QtGui
 
 from psmon import config
-from psmon.util import arg_inflate_tuple, window_ratio, merge_dicts, check_data, ts_to_str
-from psmon.plots import Hist, Image, XYPlot, MultiPlot
+from psmon.util import arg_inflate_tuple, is_py_iter, window_ratio, merge_dicts, check_data, ts_to_str, RingBuffer, \
+    AppendBuffer, HistAccumulator, SparseImageBuffer, dequantize, to_quantized
+from psmon.plots import Hist, Hist2D, Image, SparseImage, XYPlot, MultiPlot, Scalar
 from psmon.format import parse_fmt_xyplot, parse_fmt_hist, parse_fmt_leg
 
 
@@ -21,9 +22,12 @@ LOG = logging.getLogger(__name__)
 
 TypeMap = {
     Hist: 'HistClient',
+    Hist2D: 'Hist2DClient',
     Image: 'ImageClient',
+    SparseImage: 'ImageClient',
     XYPlot: 'XYPlotClient',
     MultiPlot: 'MultiPlotClient',
+    Scalar: 'ScalarClient',
 }
 
 
@@ -44,6 +48,10 @@ class PlotClient(object):
         self.title = init.title
         self.xdate = init.xdate
         self.ydate = init.ydate
+        # callback for asking the server to resync an append-stream topic
+        self.resync = kwargs.get('resync')
+        # callback for asking the server to reset the topic of the plot
+        self.reset = kwargs.get('reset')
         if 'figwin' in kwargs:
             self.is_win = False
             self.fig_win = kwargs['figwin']
@@ -85,6 +93,9 @@ class PlotClient(object):
         self.set_log_scale()
         # show grid lines if requested
         self.set_grid_lines()
+        if self.reset is not None:
+            reset_action = self.plot_view.getViewBox().menu.addAction('Reset plot')
+            reset_action.triggered.connect(self.request_reset)
         # create cursor event listener
         self.proxy = pg.SignalProxy(
             self.plot_view.scene().sigMouseMoved,
@@ -95,6 +106,14 @@ class PlotClient(object):
     def update_sub(self, data):
         pass
 
+    def request_resync(self):
+        if self.resync is not None:
+            self.resync()
+
+    def request_reset(self):
+        if self.reset is not None:
+            self.reset()
+
     def update(self, data):
         """
         Base update function - meant for basic functionality that should happen for all plot/image updates.
@@ -244,6 +263,9 @@ class PlotClient(object):
 class ImageClient(PlotClient):
     def __init__(self, init_im, framegen, info, rate=1, **kwargs):
         super(ImageClient, self).__init__(init_im, framegen, info, rate, **kwargs)
+        # dense copy of the image for topics which send sparse images
+        self.sparse = SparseImageBuffer()
+        self.sparse.apply(init_im)
         self.im_pos = init_im.pos
         self.im_scale = init_im.scale
         self.aspect_lock = init_im.aspect_lock
@@ -268,26 +290,36 @@ class ImageClient(PlotClient):
         self.cb.gradient.loadPreset(cm)
 
         # Set up colorbar ranges if specified
-        if self.info.zrange is not None:
-            self.cb.setLevels(*self.info.zrange)
-            self.cb.setHistogramRange(*self.info.zrange)
-        else:
-            self.cb.setHistogramRange(*self.cb.getLevels())
+        self.quant = None
+        if not self.set_quantization(init_im):
+            if self.info.zrange is not None:
+                self.cb.setLevels(*self.info.zrange)
+                self.cb.setHistogramRange(*self.info.zrange)
+            else:
+                self.cb.setHistogramRange(*self.cb.getLevels())
 
         if config.PYQT_USE_ALT_IMG_ORIGIN:
             self.plot_view.invertY()
         self.plot_view.addItem(self.im)
         self.plot_layout.addItem(self.cb)
 
+        # callback for requesting a full resolution crop of the image from the server
+        self.crop = kwargs.get('crop')
+        if self.crop is not None and not isinstance(init_im, Hist2D):
+            crop_action = self.plot_view.getViewBox().menu.addAction('Open full resolution crop of view')
+            crop_action.triggered.connect(self.request_crop)
+
     def update_sub(self, data):
         """
         Updates the data in the image - none means their was no update for this interval
         """
         if data is not None:
+            self.sparse.apply(data)
             if self.aspect_lock != data.aspect_lock or self.aspect_ratio != data.aspect_ratio:
                 self.aspect_lock = data.aspect_lock
                 self.aspect_ratio = data.aspect_ratio
                 self.set_aspect(self.aspect_lock, self.aspect_ratio)
+            self.set_quantization(data)
             self.im.setImage(data.image.T, autoLevels=self.info.auto_zrange)
             if self.info.auto_zrange:
                 self.cb.setLevels(*self.im.getLevels())
@@ -300,9 +332,52 @@ class ImageClient(PlotClient):
                 self.im_scale = data.scale
         return self.im
 
+    def request_crop(self):
+        """
+        Requests a crop with the part of the image which is currently visible.
+        """
+        rect = self.im.mapRectFromView(self.plot_view.getViewBox().viewRect())
+        ncols, nrows = self.im.image.shape[:2]
+        x0 = max(0, int(math.floor(rect.left())))
+        x1 = min(ncols, int(math.ceil(rect.right())))
+        y0 = max(0, int(math.floor(rect.top())))
+        y1 = min(nrows, int(math.ceil(rect.bottom())))
+        if x0 < x1 and y0 < y1:
+            self.crop((x0, x1, y0, y1))
+        else:
+            LOG.warning('The visible part of image \'%s\' is empty - no crop requested', self.title)
+
+    def set_quantization(self, data):
+        """
+        Quantized images are shown without converting them back, so the color
+        levels are set in quantized units instead: the z range if one was
+        specified and otherwise the full range of the quantized type. Returns
+        True if the image is quantized.
+        """
+        quant = (data.qoffset, data.qstep, data.qlog) if data.quantized else None
+        if quant != self.quant:
+            self.quant = quant
+            if quant is not None:
+                if self.info.zrange is not None:
+                    levels = to_quantized(self.info.zrange, *quant)
+                else:
+                    levels = (0, np.iinfo(data.image.dtype).max)
+                self.cb.setLevels(*levels)
+                self.cb.setHistogramRange(*levels)
+        return quant is not None
+
+    def pixel_value(self, x_index, y_index):
+        """
+        Returns the value of a pixel of the image in the original units.
+        """
+        z_val = self.im.image[x_index][y_index]
+        if self.quant is not None:
+            z_val = dequantize(z_val, *self.quant)
+        return z_val
+
     def cursor_hover_evt_sub(self, x_pos, y_pos):
         if 0 <= x_pos < self.im.image.shape[0] and 0 <= y_pos < self.im.image.shape[1]:
-            z_val = self.im.image[int(x_pos)][int(y_pos)]
+            z_val = self.pixel_value(int(x_pos), int(y_pos))
             # for image of float type show decimal places
             if hasattr(z_val, 'dtype') and np.issubdtype(z_val, np.integer):
                 label_str = 'x=%d, y=%d, z=%d'
@@ -331,11 +406,58 @@ class ImageClient(PlotClient):
             self.cursor_hover_hevt_sub(mouse_pos.y())
 
 
+class Hist2DClient(ImageClient):
+    def __init__(self, init_hist, framegen, info, rate=1, **kwargs):
+        super(Hist2DClient, self).__init__(init_hist, framegen, info, rate, **kwargs)
+        # histograms always have the first y bin at the bottom
+        if config.PYQT_USE_ALT_IMG_ORIGIN:
+            self.plot_view.invertY(False)
+        self.xbins = None
+        self.ybins = None
+        self.overflow = init_hist.overflow
+        self.place_image(init_hist)
+
+    def place_image(self, data):
+        """
+        Maps the pixels of the image onto the bin edges of the histogram.
+        """
+        if not (np.array_equal(data.xbins, self.xbins) and np.array_equal(data.ybins, self.ybins)):
+            self.xbins = data.xbins
+            self.ybins = data.ybins
+            transform = QtGui.QTransform()
+            transform.translate(self.xbins[0], self.ybins[0])
+            transform.scale(
+                (self.xbins[-1] - self.xbins[0]) / (len(self.xbins) - 1),
+                (self.ybins[-1] - self.ybins[0]) / (len(self.ybins) - 1)
+            )
+            self.im.setTransform(transform)
+
+    def update_sub(self, data):
+        """
+        Updates the data in the histogram - none means their was no update for this interval
+        """
+        if data is not None:
+            self.overflow = data.overflow
+            self.place_image(data)
+        return super(Hist2DClient, self).update_sub(data)
+
+    def cursor_hover_evt_sub(self, x_pos, y_pos):
+        xindex = np.searchsorted(self.xbins, x_pos, side='right') - 1
+        yindex = np.searchsorted(self.ybins, y_pos, side='right') - 1
+        if 0 <= xindex < self.im.image.shape[0] and 0 <= yindex < self.im.image.shape[1]:
+            label_str = 'x=%.5g, y=%.5g, z=%.5g' % (x_pos, y_pos, self.pixel_value(xindex, yindex))
+            if self.overflow is not None:
+                label_str += ', outside=%.5g' % (np.sum(self.overflow) - self.overflow[1][1])
+            self.info_label.setText(label_str, size='10pt')
+
+
 class XYPlotClient(PlotClient):
     def __init__(self, init_plot, framegen, info, rate=1, **kwargs):
         super(XYPlotClient, self).__init__(init_plot, framegen, info, rate, **kwargs)
         self.plots = []
         self.formats = []
+        self.stream = None
+        self.apply_stream(init_plot)
         self.add_legend(init_plot.leg_label, init_plot.leg_offset)
         inflated_args = arg_inflate_tuple(
             1,
@@ -356,11 +478,25 @@ class XYPlotClient(PlotClient):
                 )
             )
 
+    def apply_stream(self, data):
+        """
+        Adds the points of an append-stream message to the client side buffer,
+        replacing the series of the message with the buffered ones. A resync is
+        requested if a message was missed.
+        """
+        if data.seq is not None:
+            if self.stream is None:
+                self.stream = AppendBuffer()
+            if not self.stream.apply(data):
+                LOG.warning('Missed append messages for plot \'%s\' - requesting a resync', self.title)
+                self.request_resync()
+
     def update_sub(self, data):
         """
         Updates the data in the plot - none means their was no update for this interval
         """
         if data is not None:
+            self.apply_stream(data)
             inflated_args = arg_inflate_tuple(
                 1,
                 check_data(data.xdata),
@@ -378,11 +514,61 @@ class XYPlotClient(PlotClient):
         return self.plots
 
 
+class ScalarClient(PlotClient):
+    def __init__(self, init_plot, framegen, info, rate=1, **kwargs):
+        super(ScalarClient, self).__init__(init_plot, framegen, info, rate, **kwargs)
+        self.times = RingBuffer(init_plot.npoints)
+        self.values = RingBuffer(init_plot.npoints)
+        self.format = init_plot.formats
+        self.add_legend(init_plot.leg_label, init_plot.leg_offset)
+        self.add_points(init_plot)
+        self.plot = self.plot_view.plot(
+            x=self.times.data,
+            y=self.values.data,
+            name=config.PYQT_LEGEND_FORMAT % init_plot.leg_label,
+            **parse_fmt_xyplot(self.format, 0)
+        )
+
+    def add_points(self, data):
+        """
+        Adds the batch of points to the history kept by the client, or replaces
+        the history with the points of a message which is not a batch
+        """
+        if not data.append:
+            self.times = RingBuffer(data.npoints)
+            self.values = RingBuffer(data.npoints)
+        elif data.npoints != self.times.size:
+            times = RingBuffer(data.npoints)
+            values = RingBuffer(data.npoints)
+            times.extend(self.times.data)
+            values.extend(self.values.data)
+            self.times = times
+            self.values = values
+        self.times.extend(data.times)
+        self.values.extend(data.values)
+
+    def update_sub(self, data):
+        """
+        Updates the data in the plot - none means their was no update for this interval
+        """
+        if data is not None:
+            self.add_points(data)
+            if data.formats != self.format:
+                self.format = data.formats
+                self.plot.setData(x=self.times.data, y=self.values.data, **parse_fmt_xyplot(self.format, 0))
+            else:
+                self.plot.setData(x=self.times.data, y=self.values.data)
+        return self.plot
+
+
 class HistClient(PlotClient):
     def __init__(self, init_hist, framegen, info, rate=1, **kwargs):
         super(HistClient, self).__init__(init_hist, framegen, info, rate, **kwargs)
         self.hists = []
         self.formats = []
+        self.counts = None
+        self.last_data = None
+        self.apply_counts(init_hist)
         self.add_legend(init_hist.leg_label, init_hist.leg_offset)
         inflated_args = arg_inflate_tuple(
             1,
@@ -405,30 +591,68 @@ class HistClient(PlotClient):
                     **parse_fmt_hist(format_val, fill_val, cval)
                 )
             )
+        if self.counts is not None:
+            reset_action = self.plot_view.getViewBox().menu.addAction('Reset counts')
+            reset_action.triggered.connect(self.clear_counts)
+
+    def apply_counts(self, data):
+        """
+        Adds the counts of a delta-mode message to the client side sums,
+        replacing the values of the message with the counts to show. A resync is
+        requested if a message was missed.
+        """
+        if data.seq is not None:
+            if self.counts is None:
+                self.counts = HistAccumulator(self.info.window)
+            if not self.counts.apply(data):
+                LOG.warning('Missed delta messages for histogram \'%s\' - requesting a resync', self.title)
+                self.request_resync()
+            self.last_data = data
+
+    def clear_counts(self):
+        """
+        Resets the counts shown for a delta-mode histogram.
+        """
+        if self.counts is not None:
+            self.counts.reset()
+            self.refresh_counts()
+
+    def refresh_counts(self):
+        counts = self.counts.view()
+        if self.last_data is not None and counts:
+            self.last_data.values = counts if is_py_iter(self.last_data.values) else counts[0]
+            self.draw_hists(self.last_data)
 
     def update_sub(self, data):
         """
         Updates the data in the histogram - none means their was no update for this interval
         """
         if data is not None:
-            inflated_args = arg_inflate_tuple(
-                1,
-                check_data(data.bins),
-                check_data(data.values),
-                data.formats,
-                data.fills
-            )
-            for index, (hist, data_tup, format_tup) in enumerate(zip(self.hists, inflated_args, self.formats)):
-                bins, values, new_format, new_fill = data_tup
-                old_format, old_fill, cval = format_tup
-                if new_format != old_format or new_fill != old_fill:
-                    fillLevel = 0 if new_fill else None
-                    self.formats[index] = (new_format, new_fill, cval)
-                    hist.setData(x=bins, y=values, fillLevel=fillLevel, **parse_fmt_hist(new_format, new_fill, cval))
-                else:
-                    hist.setData(x=bins, y=values)
+            self.apply_counts(data)
+            self.draw_hists(data)
+        elif self.counts is not None and self.counts.window is not None:
+            # let counts that are older than the window drop off
+            self.refresh_counts()
         return self.hists
 
+    def draw_hists(self, data):
+        inflated_args = arg_inflate_tuple(
+            1,
+            check_data(data.bins),
+            check_data(data.values),
+            data.formats,
+            data.fills
+        )
+        for index, (hist, data_tup, format_tup) in enumerate(zip(self.hists, inflated_args, self.formats)):
+            bins, values, new_format, new_fill = data_tup
+            old_format, old_fill, cval = format_tup
+            if new_format != old_format or new_fill != old_fill:
+                fillLevel = 0 if new_fill else None
+                self.formats[index] = (new_format, new_fill, cval)
+                hist.setData(x=bins, y=values, fillLevel=fillLevel, **parse_fmt_hist(new_format, new_fill, cval))
+            else:
+                hist.setData(x=bins, y=values)
+
 
 class MultiPlotClient(object):
     def __init__(self, init, framegen, info, rate=1, **kwargs):
@@ -436,7 +660,9 @@ class MultiPlotClient(object):
         self.title = init.title
         if init.use_windows:
             self.is_win = None
-            self.plots = [type_getter(type(data_obj))(data_obj, None, info, rate) for data_obj in init.data_con]
+            self.plots = [type_getter(type(data_obj))(data_obj, None, info, rate, resync=kwargs.get('resync'),
+                                                      reset=kwargs.get('reset'))
+                          for data_obj in init.data_con]
         else:
             if 'figwin' in kwargs:
                 self.is_win = False
@@ -457,7 +683,9 @@ class MultiPlotClient(object):
             ratio_calc = window_ratio(config.PYQT_SMALL_WIN, config.PYQT_LARGE_WIN)
             if init.ncols is None:
                 self.fig_win.resize(*ratio_calc(init.size, 1))
-                self.plots = [type_getter(type(data_obj))(data_obj, None, info, rate, figwin=self.fig_win)
+                self.plots = [type_getter(type(data_obj))(data_obj, None, info, rate, figwin=self.fig_win,
+                                                          resync=kwargs.get('resync'),
+                                                          reset=kwargs.get('reset'))
                               for data_obj in init.data_con]
             else:
                 self.plots = []
@@ -475,7 +703,9 @@ class MultiPlotClient(object):
                 for index, data_obj in enumerate(init.data_con):
                     if index > 0 and index % ncols == 0:
                         self.fig_win.nextRow()
-                    self.plots.append(type_getter(type(data_obj))(data_obj, None, info, rate, figwin=self.fig_win))
+                    self.plots.append(type_getter(type(data_obj))(data_obj, None, info, rate, figwin=self.fig_win,
+                                                                  resync=kwargs.get('resync'),
+                                                                  reset=kwargs.get('reset')))
         self.framegen = framegen
         self.rate_ms = rate * 1000
         self.info = info
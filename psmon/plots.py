@@ -1,27 +1,149 @@
-class Plot(object):
+import numpy as np
+
+from psmon import config
+
+
+def _share_array(array, arrays, seen):
     """
-    A data container representing a Plot object for the psmon client
+    Returns the index of the array in the list of shared arrays - adding it if
+    neither the same array object nor, for arrays of at most
+    config.APP_SHARE_COMPARE_BYTES, an equal one has been added already.
+    Larger arrays are only shared by identity so no full comparisons are done.
     """
-    def __init__(self, ts, title, xlabel, ylabel, xdate=False, ydate=False):
-        self.ts = ts
-        self.title = title
-        self.xlabel = xlabel
-        self.ylabel = ylabel
-        self.xdate = xdate
-        self.ydate = ydate
+    key = id(array)
+    if key not in seen:
+        value_key = None
+        if array.nbytes <= config.APP_SHARE_COMPARE_BYTES:
+            value_key = (array.dtype.str, array.shape, array.tobytes())
+        index = seen.get(value_key)
+        if index is None:
+            index = len(arrays)
+            arrays.append(array)
+            if value_key is not None:
+                seen[value_key] = index
+        seen[key] = index
+    return seen[key]
+
+
+def _rebuild(cls, version, values):
+    """
+    Recreates a data container from the field values produced by its __reduce__.
+
+    The values are matched to the fields by name using the layout of the
+    schema version they were sent with, and fields missing from it are set to
+    None. Values of unknown (newer) versions are assumed to only append
+    fields, so the extra values are dropped.
+    """
+    obj = cls.__new__(cls)
+    fields = cls.fields()
+    names = cls.layout(version)
+    if names is None:
+        names = fields
+    values = dict(zip(names, values))
+    for name in fields:
+        object.__setattr__(obj, name, values.get(name))
+    return obj
+
+
+class Container(object):
+    """
+    Base class of the psmon data containers.
+
+    The attributes of a container are declared as __slots__, which together
+    with those of its base classes make up its schema. Containers are pickled
+    as a tuple of their field values plus the schema version, so the attribute
+    names are not part of each message.
+
+    Classes which add fields bump their 'version'. Fields appended to the end
+    of the schema need nothing more, since values missing from older messages
+    become None. Adding fields to a class with subclasses puts them in the
+    middle of the subclass schemas though, so each of those classes bumps its
+    version too and records the field names of the previous version in its
+    own 'layouts', so older messages are still decoded by name.
+    """
+    __slots__ = ()
+    # the schema version of the container
+    version = 1
+    # the field names of the older schema versions of the class, by version
+    layouts = {}
+    # fields which must not be None for the container to be valid
+    required = ()
+
+    @classmethod
+    def fields(cls):
+        """
+        Returns the names of the fields of the container in schema order.
+        """
+        fields = cls.__dict__.get('_fields')
+        if fields is None:
+            fields = ()
+            for base in reversed(cls.__mro__):
+                fields += tuple(base.__dict__.get('__slots__', ()))
+            cls._fields = fields
+        return fields
+
+    @classmethod
+    def layout(cls, version):
+        """
+        Returns the names of the fields of the schema 'version' of the
+        container in order, or None if the version is unknown.
+        """
+        if version == cls.version:
+            return cls.fields()
+        return cls.__dict__.get('layouts', {}).get(version)
+
+    def __reduce__(self):
+        values = tuple(getattr(self, name, None) for name in self.fields())
+        extra = getattr(self, '__dict__', None)
+        if extra:
+            # subclasses which do not declare __slots__ keep their extra attributes
+            return _rebuild, (type(self), self.version, values), extra
+        return _rebuild, (type(self), self.version, values)
+
+    def __repr__(self):
+        return '%s(%s)' % (
+            type(self).__name__,
+            ', '.join('%s=%r' % (name, getattr(self, name, None)) for name in self.fields())
+        )
+
+    def merge(self, newer):
+        """
+        Combines this container with a newer one received in the same client
+        update interval. Returns the combined container - by default just the
+        newer one, since each message holds the complete plot.
+        """
+        return newer
 
     @property
     def valid(self):
         """
-        This attribute is True if this Plot object is valid
+        This attribute is True if this container is valid
 
         Conditions:
-         - Always True for Plot class objects - subclasses can override
+         - All the fields listed in 'required' must not be None
         """
+        for name in self.required:
+            if getattr(self, name, None) is None:
+                return False
         return True
 
 
-class MultiPlot(object):
+class Plot(Container):
+    """
+    A data container representing a Plot object for the psmon client
+    """
+    __slots__ = ('ts', 'title', 'xlabel', 'ylabel', 'xdate', 'ydate')
+
+    def __init__(self, ts, title, xlabel, ylabel, xdate=False, ydate=False):
+        self.ts = ts
+        self.title = title
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.xdate = xdate
+        self.ydate = ydate
+
+
+class MultiPlot(Container):
     """
     A data container of arbitary subtypes of the Plot class - can contain an
     arbitrary number of Plot objects
@@ -32,6 +154,7 @@ class MultiPlot(object):
     - use_windows: tells the client to render the individual plots in separate
             windows if that feature is supported by the client
     """
+    __slots__ = ('ts', 'title', 'data_con', 'ncols', 'use_windows')
 
     def __init__(self, ts, title, data_con=None, ncols=None, use_windows=False):
         self.ts = ts
@@ -62,6 +185,46 @@ class MultiPlot(object):
         """
         return len(self.data_con)
 
+    def __reduce__(self):
+        """
+        Pickles the contained Plot objects in a columnar form: every numpy array
+        (or sequence of them) is replaced by a reference into a single list of
+        arrays, in which arrays shared by several plots (e.g. a common x axis)
+        only appear once.
+        """
+        arrays = []
+        seen = {}
+        plots = []
+        for data in self.data_con:
+            if not isinstance(data, Plot) or getattr(data, '__dict__', None):
+                plots.append(data)
+                continue
+            values = []
+            refs = {}
+            for index, value in enumerate(getattr(data, name, None) for name in data.fields()):
+                if isinstance(value, np.ndarray):
+                    refs[index] = _share_array(value, arrays, seen)
+                    value = None
+                elif isinstance(value, (list, tuple)) and value and all(isinstance(val, np.ndarray) for val in value):
+                    refs[index] = type(value)(_share_array(val, arrays, seen) for val in value)
+                    value = None
+                values.append(value)
+            plots.append((type(data), data.version, tuple(values), refs))
+        values = tuple(getattr(self, name, None) for name in self.fields() if name != 'data_con')
+        return _rebuild_multi, (type(self), self.version, values, arrays, plots)
+
+    def merge(self, newer):
+        """
+        Merges the contained Plot objects with those of a newer MultiPlot with
+        the same layout.
+        """
+        if isinstance(newer, MultiPlot) and newer.size == self.size:
+            newer.data_con = [
+                data.merge(new_data) if isinstance(data, Container) else new_data
+                for data, new_data in zip(self.data_con, newer.data_con)
+            ]
+        return newer
+
     @property
     def valid(self):
         """
@@ -80,39 +243,141 @@ class MultiPlot(object):
         return len(self.data_con) != 0
 
 
+def _rebuild_multi(cls, version, values, arrays, plots):
+    """
+    Recreates a MultiPlot from its columnar form - the rebuilt plots reference
+    the same array objects wherever they were shared.
+    """
+    data_con = []
+    for entry in plots:
+        if isinstance(entry, tuple):
+            plot_cls, plot_version, plot_values, refs = entry
+            plot_values = list(plot_values)
+            for index, ref in refs.items():
+                plot_values[index] = arrays[ref] if isinstance(ref, int) else type(ref)(arrays[i] for i in ref)
+            entry = _rebuild(plot_cls, plot_version, plot_values)
+        data_con.append(entry)
+    values = list(values)
+    values.insert((cls.layout(version) or cls.fields()).index('data_con'), data_con)
+    return _rebuild(cls, version, values)
+
+
 class Image(Plot):
     """
     A data container for image data for the psmon client
+
+    Optional arguments
+    - qoffset: for images quantized to integers the value of a pixel is
+            qoffset + qstep * image (see util.dequantize)
+    - qstep: the step between the quantized values
+    - qlog: if True the quantization is logarithmic instead of linear
     """
+    __slots__ = ('image', 'aspect_ratio', 'aspect_lock', 'pos', 'scale', 'qoffset', 'qstep', 'qlog')
+    required = ('image',)
+    version = 2
+    layouts = {
+        1: ('ts', 'title', 'xlabel', 'ylabel', 'xdate', 'ydate', 'image', 'aspect_ratio', 'aspect_lock', 'pos',
+            'scale'),
+    }
 
     def __init__(self, ts, title, image, xlabel=None, ylabel=None,
-                 aspect_ratio=None, aspect_lock=True, pos=None, scale=None):
+                 aspect_ratio=None, aspect_lock=True, pos=None, scale=None,
+                 qoffset=None, qstep=None, qlog=False):
         super(Image, self).__init__(ts, title, xlabel, ylabel, False, False)
         self.image = image
         self.aspect_ratio = aspect_ratio
         self.aspect_lock = aspect_lock
         self.pos = pos
         self.scale = scale
+        self.qoffset = qoffset
+        self.qstep = qstep
+        self.qlog = qlog
 
     @property
-    def valid(self):
+    def quantized(self):
         """
-        This attribute is True if this Image object is valid
-
-        Conditions:
-         - The 'image' attribute of must not be None
+        This attribute is True if the image is quantized to integers
         """
-        return self.image is not None
+        return self.qstep is not None
+
+
+class SparseImage(Image):
+    """
+    A data container for image data which is mostly zeros for the psmon
+    client. Only the non-zero pixels are stored, using their flat indices in
+    the image.
+
+    Arguments
+    - shape: the shape of the full image
+    - indices: the flat indices of the non-zero pixels, or the flat indices of
+            the first pixel of each run of non-zero pixels if 'lengths' is set
+    - values: the values of the non-zero pixels
+
+    Optional arguments
+    - lengths: the lengths of the runs of non-zero pixels for run-length
+            encoded images
+    """
+    __slots__ = ('shape', 'indices', 'values', 'lengths')
+    required = ('shape', 'indices', 'values')
+    version = 2
+    layouts = {
+        1: Image.layouts[1] + ('shape', 'indices', 'values', 'lengths'),
+    }
+
+    def __init__(self, ts, title, shape, indices, values, lengths=None, xlabel=None, ylabel=None,
+                 aspect_ratio=None, aspect_lock=True, pos=None, scale=None):
+        super(SparseImage, self).__init__(ts, title, None, xlabel, ylabel, aspect_ratio, aspect_lock, pos, scale)
+        self.shape = shape
+        self.indices = indices
+        self.values = values
+        self.lengths = lengths
+
+
+class Hist2D(Image):
+    """
+    A data container for 2-d histogram data for the psmon client. The counts
+    are stored in 'image' with the y bins along the first axis, and the
+    clients place the image on the axes using the bin edges.
+
+    Optional arguments
+    - overflow: 3x3 array of the counts in the regions around the grid - the
+            indices along each axis (y, x) are 0 for under the range, 1 for in
+            the range and 2 for over the range, so the center entry is the
+            total of the counts in the grid
+    """
+    __slots__ = ('xbins', 'ybins', 'overflow')
+    required = ('image', 'xbins', 'ybins')
+    version = 2
+    layouts = {
+        1: Image.layouts[1] + ('xbins', 'ybins', 'overflow'),
+    }
+
+    def __init__(self, ts, title, image, xbins, ybins, xlabel=None, ylabel=None,
+                 aspect_ratio=None, aspect_lock=False, overflow=None):
+        super(Hist2D, self).__init__(ts, title, image, xlabel, ylabel, aspect_ratio, aspect_lock)
+        self.xbins = xbins
+        self.ybins = ybins
+        self.overflow = overflow
 
 
 class Hist(Plot):
     """
     A data container for 1-d histogram data for the psmon client
+
+    Optional arguments
+    - seq: the sequence number of the message for delta-mode topics
+    - base: for delta messages the sequence number of the message that they
+            are relative to
+    - append: if True the values are only the counts added since the message
+            with sequence number 'base', which the client adds to its sums
     """
+    __slots__ = ('bins', 'values', 'leg_label', 'leg_offset', 'formats', 'fills', 'seq', 'base', 'append')
+    required = ('bins', 'values')
+    version = 2
 
     def __init__(self, ts, title, bins, values, xlabel=None, ylabel=None,
                  leg_label=None, leg_offset=None, formats='-', fills=True,
-                 xdate=False, ydate=False):
+                 xdate=False, ydate=False, seq=None, base=None, append=False):
         super(Hist, self).__init__(ts, title, xlabel, ylabel, xdate, ydate)
         self.bins = bins
         self.values = values
@@ -120,39 +385,137 @@ class Hist(Plot):
         self.leg_offset = leg_offset
         self.formats = formats
         self.fills = fills
+        self.seq = seq
+        self.base = base
+        self.append = append
 
-    @property
-    def valid(self):
+    def merge(self, newer):
         """
-        This attribute is True if this Hist object is valid
-
-        Conditions:
-         - The 'bins' and 'values' attributes must not be None
+        Adds the counts of a newer delta message to this message if it directly
+        follows it.
         """
-        return self.bins is not None and self.values is not None
+        if isinstance(newer, Hist) and newer.append and self.seq is not None and newer.base == self.seq:
+            values = _add_series(self.values, newer.values)
+            if values is not None:
+                newer.values = values
+                newer.base = self.base
+                newer.append = self.append
+        return newer
+
+
+def _add_series(old, new):
+    """
+    Adds the values of matching series. Returns None if the series do not
+    match.
+    """
+    if isinstance(old, np.ndarray) and isinstance(new, np.ndarray):
+        return old + new if old.shape == new.shape else None
+    if isinstance(old, (list, tuple)) and isinstance(new, (list, tuple)) and len(old) == len(new):
+        added = [_add_series(np.asarray(old_ser), np.asarray(new_ser)) for old_ser, new_ser in zip(old, new)]
+        return None if any(ser is None for ser in added) else added
+    return None
 
 
 class XYPlot(Plot):
     """
     A data container for xy scatter plot data for the psmon client
+
+    Optional arguments
+    - seq: the sequence number of the message for append-stream topics
+    - base: for append messages the sequence number of the message that they
+            extend - the points are only valid on top of that one
+    - append: if True the data only holds the points added to each series since
+            the message with sequence number 'base'
+    - npoints: the number of points the client keeps for each series (a single
+            value or a list of them) - None means all of them
     """
+    __slots__ = ('xdata', 'ydata', 'leg_label', 'leg_offset', 'formats', 'seq', 'base', 'append', 'npoints')
+    required = ('xdata', 'ydata')
+    version = 2
 
     def __init__(self, ts, title, xdata, ydata, xlabel=None, ylabel=None,
                  leg_label=None, leg_offset=None, formats='-',
-                 xdate=False, ydate=False):
+                 xdate=False, ydate=False, seq=None, base=None, append=False, npoints=None):
         super(XYPlot, self).__init__(ts, title, xlabel, ylabel, xdate, ydate)
         self.xdata = xdata
         self.ydata = ydata
         self.leg_label = leg_label
         self.leg_offset = leg_offset
         self.formats = formats
+        self.seq = seq
+        self.base = base
+        self.append = append
+        self.npoints = npoints
 
-    @property
-    def valid(self):
+    def merge(self, newer):
         """
-        This attribute is True if this XYPlot object is valid
+        Adds the points of a newer append message to this message if it directly
+        follows it.
+        """
+        if isinstance(newer, XYPlot) and newer.append and self.seq is not None and newer.base == self.seq:
+            xdata = _append_series(self.xdata, newer.xdata, newer.npoints)
+            ydata = _append_series(self.ydata, newer.ydata, newer.npoints)
+            if xdata is not None and ydata is not None:
+                newer.xdata = xdata
+                newer.ydata = ydata
+                newer.base = self.base
+                newer.append = self.append
+        return newer
 
-        Conditions:
-         - The 'xdata' and 'ydata' attributes must not be None
+
+def _append_series(old, new, npoints):
+    """
+    Concatenates the points of matching series keeping at most 'npoints' of
+    each. Returns None if the series do not match.
+    """
+    if isinstance(old, np.ndarray) and isinstance(new, np.ndarray):
+        merged = np.concatenate((old, new))
+        return merged if npoints is None else merged[-npoints:]
+    if isinstance(old, (list, tuple)) and isinstance(new, (list, tuple)) and len(old) == len(new):
+        if not isinstance(npoints, (list, tuple)):
+            npoints = [npoints] * len(new)
+        merged = []
+        for old_ser, new_ser, max_points in zip(old, new, npoints):
+            merged_ser = _append_series(np.asarray(old_ser), np.asarray(new_ser), max_points)
+            if merged_ser is None:
+                return None
+            merged.append(merged_ser)
+        return merged
+    return None
+
+
+class Scalar(Plot):
+    """
+    A data container for a batch of (timestamp, value) points of a single
+    scalar quantity for the psmon client. The client keeps the history of the
+    last 'npoints' points.
+
+    Optional arguments
+    - append: if True the points are only those added since the previous
+            message, which the client adds to its history. Otherwise they are
+            the complete history, which replaces the one kept by the client.
+    """
+    __slots__ = ('times', 'values', 'npoints', 'leg_label', 'leg_offset', 'formats', 'append')
+    required = ('times', 'values', 'npoints')
+
+    def __init__(self, ts, title, times, values, npoints, xlabel=None, ylabel=None,
+                 leg_label=None, leg_offset=None, formats='-', xdate=True, ydate=False, append=False):
+        super(Scalar, self).__init__(ts, title, xlabel, ylabel, xdate, ydate)
+        self.times = times
+        self.values = values
+        self.npoints = npoints
+        self.leg_label = leg_label
+        self.leg_offset = leg_offset
+        self.formats = formats
+        self.append = append
+
+    def merge(self, newer):
+        """
+        Prepends the points of this message to those of a newer batch so that
+        no points are lost when the client skips messages.
         """
-        return self.xdata is not None and self.ydata is not None
+        if isinstance(newer, Scalar) and newer.append and self.valid and newer.valid:
+            newer.times = np.concatenate((self.times, newer.times))[-newer.npoints:]
+            newer.values = np.concatenate((self.values, newer.values))[-newer.npoints:]
+            newer.append = self.append
+        return newer
@@ -1,11 +1,17 @@
+import copy
 import time
 import numpy as np
+from collections import deque
 
+from psmon import config
 from psmon import publish
 from psmon import util
 from psmon import plots
 
 
+ACCUMULATE_MODES = ('sum', 'mean', 'ema', 'max', 'rolling')
+
+
 class Manager(object):
     def __init__(self, topic, title=None, pubrate=None, publisher=None):
         self.topic = topic
@@ -13,6 +19,10 @@ class Manager(object):
         self._title = title or self.topic
         self.pubrate = pubrate
         self._publisher = publisher or publish.send
+        # only the default publisher knows which topics are being watched
+        self._wants = publish.wants if publisher is None else None
+        self._resync = publish.resync_requested if publisher is None else None
+        self._reset = publish.reset_requested if publisher is None else None
         self.__last_pub = time.time()
 
     @property
@@ -25,12 +35,83 @@ class Manager(object):
             self._data.title = title
         self._title = title
 
+    def clear(self):
+        """
+        Clears the data of the manager. This is called when a client asks for
+        the topic to be reset.
+        """
+        pass
+
     def publish(self, timestamp=None):
+        for manager in self._members():
+            manager._check_reset()
+            data = manager._prepare_publish(timestamp)
+            if data is not None:
+                manager._publisher(manager.topic, data)
+
+    def _members(self):
+        """
+        Returns the managers published together by this manager - itself and
+        any managers of topics derived from it.
+        """
+        return (self,)
+
+    def _check_reset(self):
+        """
+        Clears the manager if a client asked for its topic to be reset. This is
+        only done while publishing so the data is never cleared while the
+        analysis is filling it.
+        """
+        if self._reset is not None and self._reset(self.topic):
+            self.clear()
+
+    def _prepare_publish(self, timestamp=None):
+        """
+        Checks the publish rate and whether the topic is watched. Returns the
+        data object to publish, with its timestamp set, or None if nothing
+        should be published.
+        """
         current_time = time.time()
         if self.pubrate is None or self.pubrate * (current_time - self.__last_pub) >= 1:
             self.__last_pub = current_time
+            if self._wants is not None and not self._wants(self.topic):
+                return None
             self._data.ts = timestamp or time.ctime()
-            self._publisher(self.topic, self._data)
+            return self._data
+        return None
+
+
+class Group(object):
+    """
+    Publishes a group of managers together. Managers using the default
+    publisher are sent as a single batch with publish.send_many.
+    """
+    def __init__(self, managers=None):
+        self._managers = list(managers or [])
+
+    @property
+    def managers(self):
+        return self._managers
+
+    def add(self, manager):
+        self._managers.append(manager)
+
+    def remove(self, manager):
+        self._managers.remove(manager)
+
+    def publish(self, timestamp=None):
+        batch = {}
+        for manager in (member for manager in self._managers for member in manager._members()):
+            manager._check_reset()
+            data = manager._prepare_publish(timestamp)
+            if data is not None:
+                # managers with a custom publisher can't be batched
+                if manager._publisher != publish.send:
+                    manager._publisher(manager.topic, data)
+                else:
+                    batch[manager.topic] = data
+        if batch:
+            publish.send_many(batch)
 
 
 class MultiPlot(Manager):
@@ -38,6 +119,7 @@ class MultiPlot(Manager):
         super(MultiPlot, self).__init__(topic, title, pubrate, publisher)
         self._nplots = 0
         self._names = []
+        self._managers = []
         self._data = plots.MultiPlot(
             None,
             self._title,
@@ -60,8 +142,14 @@ class MultiPlot(Manager):
         index, new_plot = self._make(name)
         if new_plot:
             self._data.add(manager._data)
+            self._managers.append(manager)
         else:
             self._data.datacon[index] = manager._data
+            self._managers[index] = manager
+
+    def clear(self):
+        for manager in self._managers:
+            manager.clear()
 
     def _make(self, name):
         if name in self._names:
@@ -124,21 +212,291 @@ class OverlayManager(Manager):
             raise KeyError('Unknown plot name: %s' % name)
 
 
+class AppendStream(object):
+    """
+    Mixin for managers that adds the append-stream publishing mode.
+
+    In this mode each publish only sends what was added since the previous
+    publish, numbered with a sequence number. A full message (a keyframe) is
+    sent every 'keyframe' publishes, after the plots are changed or cleared,
+    and when a client asks for a resync because it missed a message. The
+    manager implements '_keyframe_sent' and '_fill_delta' to track and fill in
+    the added data.
+    """
+    def _init_stream(self, stream, keyframe):
+        self.stream = stream
+        self.keyframe = keyframe
+        self._seq = 0
+        self._since_keyframe = 0
+        self._need_keyframe = True
+
+    def _invalidate(self):
+        self._need_keyframe = True
+
+    def _prepare_publish(self, timestamp=None):
+        data = super(AppendStream, self)._prepare_publish(timestamp)
+        if data is None or not self.stream:
+            return data
+        self._seq += 1
+        data.seq = self._seq
+        resync = self._resync is not None and self._resync(self.topic)
+        if resync or self._need_keyframe or self._since_keyframe >= self.keyframe:
+            self._need_keyframe = False
+            self._since_keyframe = 0
+            self._keyframe_sent(data)
+            return data
+        delta = copy.copy(data)
+        delta.base = self._seq - 1
+        delta.append = True
+        self._fill_delta(delta)
+        self._since_keyframe += 1
+        return delta
+
+    def _keyframe_sent(self, data):
+        pass
+
+    def _fill_delta(self, delta):
+        pass
+
+
+class XYAppendStream(AppendStream):
+    """
+    Append-stream mode for the XYPlot managers, which need '_indices' with the
+    number of points added to each series and '_npoints' returning the number
+    of points clients keep.
+    """
+    def _init_stream(self, stream, keyframe):
+        super(XYAppendStream, self)._init_stream(stream, keyframe)
+        self._sent = []
+
+    def _keyframe_sent(self, data):
+        data.npoints = self._npoints()
+        self._sent = list(self._indices)
+
+    def _fill_delta(self, delta):
+        delta.npoints = self._npoints()
+        delta.xdata = []
+        delta.ydata = []
+        for index, (xdata, ydata) in enumerate(zip(self._data.xdata, self._data.ydata)):
+            start = len(xdata) - min(self._indices[index] - self._sent[index], len(xdata))
+            delta.xdata.append(xdata[start:])
+            delta.ydata.append(ydata[start:])
+        self._sent = list(self._indices)
+
+
 class Image(Manager):
-    def __init__(self, topic, title=None, xlabel=None, ylabel=None, pubrate=None, publisher=None, pedestal=None):
+    """
+    Publishes an image. If 'sparse' is set (config.APP_SPARSE_DENSITY is a
+    good default), images where the fraction of non-zero pixels is below it
+    are sent as a SparseImage with only the non-zero pixels. This is off by
+    default since clients older than the SparseImage type can't show them.
+
+    Dense images can be sent with reduced precision by setting 'quantize' to
+    one of the types in util.QUANTIZE_TYPES. For the integer types the range
+    'zrange' (or the range of each image if it is None) is mapped onto the
+    range of the type, logarithmically if 'qlog' is set.
+
+    Instead of the latest image the manager can show an accumulation of the
+    images passed to 'image', by setting 'accumulate' to one of:
+    - sum: the sum of the images
+    - mean: the mean of the images
+    - ema: the exponential moving average with weight 'alpha' for each image
+    - max: the maximum of each pixel
+    - rolling: the mean of the last 'nframes' images
+    The images are accumulated without the pedestal, which is only subtracted
+    from the result when it is published, so a new pedestal also applies to
+    the images already accumulated.
+
+    The pedestal subtracted image and the accumulation results are written to
+    a buffer which is reused, so the array returned by 'image' is only valid
+    until the next image is added.
+
+    Regions of interest and projections of the image can be added with
+    'add_roi' and 'add_projection'. These are computed when publishing and
+    sent on their own sub-topics, each with its own publish rate, so they can
+    be updated more often than the full image by setting a lower 'pubrate'
+    for the image.
+    """
+    def __init__(self, topic, title=None, xlabel=None, ylabel=None, pubrate=None, publisher=None, pedestal=None,
+                 sparse=None, quantize=None, qlog=False, zrange=None, accumulate=None,
+                 nframes=config.APP_ACCUM_FRAMES, alpha=config.APP_ACCUM_ALPHA):
         super(Image, self).__init__(topic, title, pubrate, publisher)
         self._pedestal = pedestal
         self.use_pedestal = pedestal is not None
+        self.sparse = sparse
+        self.quantization(quantize, qlog, zrange)
         self._data = plots.Image(None, self.title, None)
+        self._sparse_data = plots.SparseImage(None, self.title, None, None, None)
+        self._out = None
+        self._subtopics = []
+        # only the default publisher receives crop requests from clients
+        if publisher is None:
+            publish.enable_crops(self.topic)
+            self._crop_requests = publish.crop_requests
+        else:
+            self._crop_requests = None
+        self.accumulation(accumulate, nframes, alpha)
 
     def image(self, image=None):
         if image is None:
+            if self._pending:
+                self._finish()
             return self._data.image
+        elif self.accumulate is not None:
+            self._add(np.asarray(image))
+        elif self.use_pedestal:
+            self._data.image = np.subtract(image, self._pedestal, out=self._output(image, self._pedestal))
         else:
-            if self.use_pedestal:
-                self._data.image = image - self._pedestal
-            else:
-                self._data.image = image
+            self._data.image = image
+
+    def accumulation(self, accumulate=None, nframes=config.APP_ACCUM_FRAMES, alpha=config.APP_ACCUM_ALPHA):
+        """
+        Sets the accumulation mode of the images, or disables it if
+        'accumulate' is None. This also clears the accumulated images.
+        """
+        if accumulate is not None and accumulate not in ACCUMULATE_MODES:
+            raise ValueError('accumulate must be one of: %s' % ', '.join(ACCUMULATE_MODES))
+        nframes = int(nframes)
+        if nframes <= 0:
+            raise ValueError('nframes must be greater than 0')
+        if not 0 < alpha <= 1:
+            raise ValueError('alpha must be greater than 0 and at most 1')
+        self.accumulate = accumulate
+        self.nframes = nframes
+        self.alpha = alpha
+        self._acc = None
+        self._ring = None
+        self.clear()
+
+    def clear(self):
+        """
+        Clears the accumulated images. The accumulation buffers are zeroed in
+        place so they don't need to be allocated again.
+        """
+        if self._acc is not None:
+            self._acc[...] = 0
+        if self._ring is not None:
+            self._ring[...] = 0
+        self._ring_index = 0
+        self._count = 0
+        self._pending = False
+
+    def count(self):
+        """
+        Returns the number of images in the accumulation.
+        """
+        return self._count
+
+    def add_roi(self, name, x0, x1, y0, y1, title=None, pubrate=None):
+        """
+        Adds a region of interest of the image with the pixel columns x0:x1 and
+        rows y0:y1. It is published on the sub-topic 'name' of the image topic.
+        Returns the manager of the region of interest.
+        """
+        return self._add_subtopic(ImageROI(self, name, (x0, x1, y0, y1), title, pubrate))
+
+    def add_projection(self, name, axis, roi=None, mean=False, title=None, pubrate=None):
+        """
+        Adds a projection of the image onto the 'x' or 'y' axis, optionally
+        limited to the region of interest 'roi' given as (x0, x1, y0, y1). The
+        pixels are summed, or averaged if 'mean' is set. It is published as an
+        XYPlot on the sub-topic 'name' of the image topic. Returns the manager
+        of the projection.
+        """
+        return self._add_subtopic(ImageProjection(self, name, axis, roi, mean, title, pubrate))
+
+    def subtopic(self, name):
+        for manager in self._subtopics:
+            if manager.name == name:
+                return manager
+        raise KeyError(name)
+
+    def remove_subtopic(self, name):
+        self._subtopics.remove(self.subtopic(name))
+
+    def _add_subtopic(self, manager):
+        if any(sub.name == manager.name for sub in self._subtopics):
+            raise ValueError('Image already has a sub-topic named: %s' % manager.name)
+        self._subtopics.append(manager)
+        return manager
+
+    def _update_crops(self):
+        """
+        Adds, moves and removes the regions of interest requested by clients.
+        Requested regions which are not watched for APP_CROP_TIMEOUT seconds
+        are removed as well, since clients can exit without cancelling them.
+        """
+        for client, roi in self._crop_requests(self.topic).items():
+            name = config.APP_CROP_NAME % client
+            try:
+                self.remove_subtopic(name)
+            except KeyError:
+                pass
+            if roi is not None:
+                try:
+                    x0, x1, y0, y1 = (int(value) for value in roi)
+                except (ValueError, TypeError):
+                    continue
+                self._add_subtopic(ImageROI(self, name, (x0, x1, y0, y1), timeout=config.APP_CROP_TIMEOUT))
+        for manager in [sub for sub in self._subtopics if getattr(sub, 'expired', False)]:
+            self._subtopics.remove(manager)
+
+    def _members(self):
+        if self._crop_requests is not None:
+            self._update_crops()
+        return (self,) + tuple(self._subtopics)
+
+    def _output(self, *arrays):
+        shape = np.broadcast(*arrays).shape
+        dtype = np.result_type(*arrays)
+        if self._out is None or self._out.shape != shape or self._out.dtype != dtype:
+            self._out = np.empty(shape, dtype=dtype)
+        return self._out
+
+    def _add(self, image):
+        if self._acc is None or self._acc.shape != image.shape:
+            self._acc = np.zeros(image.shape)
+            self._count = 0
+            if self.accumulate == 'rolling':
+                self._ring = np.zeros((self.nframes,) + image.shape)
+                self._ring_index = 0
+        if self.accumulate in ('sum', 'mean'):
+            self._acc += image
+        elif self._count == 0 and self.accumulate in ('ema', 'max'):
+            self._acc[...] = image
+        elif self.accumulate == 'ema':
+            self._acc *= 1 - self.alpha
+            self._acc += self.alpha * image
+        elif self.accumulate == 'max':
+            np.maximum(self._acc, image, out=self._acc)
+        elif self.accumulate == 'rolling':
+            slot = self._ring[self._ring_index]
+            self._acc -= slot
+            slot[...] = image
+            self._acc += slot
+            self._ring_index = (self._ring_index + 1) % self.nframes
+            if self._ring_index == 0:
+                # resum once per cycle so rounding errors do not build up
+                np.sum(self._ring, axis=0, out=self._acc)
+        self._count = min(self._count + 1, self.nframes) if self.accumulate == 'rolling' else self._count + 1
+        self._pending = True
+
+    def _finish(self):
+        """
+        Writes the result of the accumulation to the image.
+        """
+        pedestal = self._pedestal if self.use_pedestal else 0
+        out = self._output(self._acc, pedestal)
+        if self.accumulate == 'sum':
+            np.multiply(pedestal, -self._count, out=out)
+            out += self._acc
+        elif self.accumulate in ('mean', 'rolling'):
+            np.divide(self._acc, self._count, out=out)
+            out -= pedestal
+        else:
+            np.subtract(self._acc, pedestal, out=out)
+        self._data.image = out
+        self._pending = False
 
     def pedestal(self, pedestal=None):
         if pedestal is None:
@@ -147,10 +505,352 @@ class Image(Manager):
             self._pedestal = pedestal
             self.use_pedestal = True
 
+    def quantization(self, quantize=None, qlog=False, zrange=None):
+        """
+        Sets the reduced precision type used for sending the image, or disables
+        it if 'quantize' is None.
+        """
+        if quantize is not None and quantize not in util.QUANTIZE_TYPES:
+            raise ValueError('quantize must be one of: %s' % ', '.join(util.QUANTIZE_TYPES))
+        self.quantize = quantize
+        self.qlog = qlog
+        self.zrange = zrange
 
-class StripChart(OverlayManager):
-    def __init__(self, topic, title=None, xlabel=None, ylabel=None, leg_offset=None, pubrate=None, publisher=None):
+    def _prepare_publish(self, timestamp=None):
+        data = super(Image, self)._prepare_publish(timestamp)
+        if data is not None and self._pending:
+            self._finish()
+        if data is None or not isinstance(data.image, np.ndarray):
+            return data
+        # the encoding is only done for the images which are actually sent
+        encoded = None if self.sparse is None else util.sparse_encode(data.image, self.sparse)
+        if encoded is None:
+            if self.quantize is None:
+                return data
+            # the published copy holds the quantized image so the full image is kept
+            quantized = copy.copy(data)
+            quantized.image, quantized.qoffset, quantized.qstep = util.quantize(
+                data.image, self.quantize, self.qlog, self.zrange
+            )
+            quantized.qlog = self.qlog and quantized.qstep is not None
+            return quantized
+        sparse = self._sparse_data
+        for name in plots.Image.fields():
+            if name != 'image':
+                setattr(sparse, name, getattr(data, name))
+        sparse.shape = data.image.shape
+        sparse.indices, sparse.values, sparse.lengths = encoded
+        return sparse
+
+
+class ImageSubTopic(Manager):
+    """
+    Manager of a topic derived from an Image manager. It publishes with the
+    same publisher as the image to the sub-topic 'name' of the image topic.
+
+    Arguments:
+     - parent: the Image manager the sub-topic is derived from
+     - name: the name of the sub-topic
+     - compute: function called with the data of the sub-topic and the latest
+            image when the sub-topic is published. It returns the updated data
+            or None to skip publishing it.
+
+    Optional arguments:
+     - title: the title of the sub-topic plot
+     - pubrate: the maximum rate at which the sub-topic is published
+    """
+    def __init__(self, parent, name, compute, title=None, pubrate=None):
+        super(ImageSubTopic, self).__init__(
+            config.APP_SUBTOPIC_FORMAT % (parent.topic, name),
+            title or '%s %s' % (parent.title, name),
+            pubrate,
+            None if parent._wants is not None else parent._publisher
+        )
+        self.name = name
+        self._parent = parent
+        self._compute = compute
+
+    @staticmethod
+    def _region(roi):
+        if roi is None:
+            return Ellipsis
+        x0, x1, y0, y1 = roi
+        return slice(y0, y1), slice(x0, x1)
+
+    def _prepare_publish(self, timestamp=None):
+        data = super(ImageSubTopic, self)._prepare_publish(timestamp)
+        # only compute from the image when the sub-topic is actually sent
+        if data is None:
+            return None
+        image = self._parent.image()
+        if not isinstance(image, np.ndarray):
+            return None
+        return self._compute(data, image)
+
+
+class ImageROI(ImageSubTopic):
+    def __init__(self, parent, name, roi, title=None, pubrate=None, timeout=None):
+        super(ImageROI, self).__init__(parent, name, self._crop, title, pubrate)
+        self.roi = roi
+        self.timeout = timeout
+        self._watched = time.time()
+        self._data = plots.Image(None, self._title, None)
+
+    @property
+    def expired(self):
+        """
+        This attribute is True if the region of interest has a timeout and its
+        topic has had no subscribers for longer than it.
+        """
+        if self.timeout is None:
+            return False
+        if publish.subscribers(self.topic) > 0:
+            self._watched = time.time()
+        return time.time() - self._watched > self.timeout
+
+    def _crop(self, data, image):
+        data.image = image[self._region(self.roi)]
+        # place the region where it is in the full image
+        data.pos = (self.roi[0] or 0, self.roi[2] or 0)
+        return data
+
+
+class ImageProjection(ImageSubTopic):
+    def __init__(self, parent, name, axis, roi=None, mean=False, title=None, pubrate=None):
+        super(ImageProjection, self).__init__(parent, name, self._project, title, pubrate)
+        if axis not in ('x', 'y'):
+            raise ValueError('axis must be one of: x, y')
+        self.axis = axis
+        self.roi = roi
+        self.mean = mean
+        self._data = plots.XYPlot(None, self._title, None, None, xlabel=axis, ylabel='mean' if mean else 'sum')
+
+    def _project(self, data, image):
+        region = image[self._region(self.roi)]
+        # an x projection collapses the rows of the image
+        reduce_axis = 0 if self.axis == 'x' else 1
+        data.ydata = region.mean(axis=reduce_axis) if self.mean else region.sum(axis=reduce_axis)
+        start = 0
+        if self.roi is not None:
+            start = self.roi[0] if self.axis == 'x' else self.roi[2]
+            start = start or 0
+        if data.xdata is None or len(data.xdata) != len(data.ydata) or data.xdata[0] != start:
+            data.xdata = np.arange(start, start + len(data.ydata))
+        return data
+
+
+class Histogram2D(Manager):
+    """
+    Accumulates a 2-d histogram on a fixed grid of bins. Entries outside the
+    range of the grid are kept in under/overflow bins, which are published as
+    the 'overflow' counts of the Hist2D data.
+
+    When filling on several MPI ranks the counts can be summed on one rank
+    with 'reduce' before publishing from it.
+    """
+    def __init__(self, topic, nxbins, xmin, xmax, nybins, ymin, ymax, title=None, xlabel=None, ylabel=None,
+                 pubrate=None, publisher=None):
+        super(Histogram2D, self).__init__(topic, title, pubrate, publisher)
+        self._data = plots.Hist2D(None, self._title, None, None, None, xlabel=xlabel, ylabel=ylabel)
+        self.make_hist(nxbins, xmin, xmax, nybins, ymin, ymax)
+
+    def make_hist(self, nxbins, xmin, xmax, nybins, ymin, ymax):
+        self._nbins = (nxbins, nybins)
+        self._ranges = ((xmin, xmax), (ymin, ymax))
+        self._data.xbins = util.make_bins(nxbins, xmin, xmax)
+        self._data.ybins = util.make_bins(nybins, ymin, ymax)
+        # flat counts of the grid padded with the under/overflow bins
+        self._counts = np.zeros((nybins + 2) * (nxbins + 2))
+
+    def xbins(self):
+        return self._data.xbins
+
+    def ybins(self):
+        return self._data.ybins
+
+    def counts(self):
+        """
+        Returns the counts of the grid including the under/overflow bins with
+        the y bins along the first axis. This is a view of the accumulated
+        counts, which can be used for combining the counts of several
+        histograms.
+        """
+        return self._counts.reshape(self._nbins[1] + 2, self._nbins[0] + 2)
+
+    def values(self):
+        return self.counts()[1:-1, 1:-1]
+
+    def overflow(self):
+        counts = self.counts()
+        regions = (slice(0, 1), slice(1, -1), slice(-1, None))
+        return np.array([[counts[yreg, xreg].sum() for xreg in regions] for yreg in regions])
+
+    def _bin_index(self, values, nbins, vmin, vmax):
+        index = (values - vmin) * (nbins / float(vmax - vmin))
+        np.floor(index, out=index)
+        np.clip(index, -1, nbins, out=index)
+        index = index.astype(np.intp) + 1
+        # the upper edge is included in the last bin like np.histogram
+        index[values == vmax] = nbins
+        return index
+
+    def add(self, xvalue, yvalue, weights=None):
+        xvalue, yvalue = np.broadcast_arrays(np.asarray(xvalue, dtype=float), np.asarray(yvalue, dtype=float))
+        xvalue = xvalue.ravel()
+        yvalue = yvalue.ravel()
+        if weights is not None:
+            weights = np.broadcast_to(weights, xvalue.shape).ravel()
+        finite = np.isfinite(xvalue) & np.isfinite(yvalue)
+        if not finite.all():
+            xvalue = xvalue[finite]
+            yvalue = yvalue[finite]
+            if weights is not None:
+                weights = weights[finite]
+        (xmin, xmax), (ymin, ymax) = self._ranges
+        flat = self._bin_index(yvalue, self._nbins[1], ymin, ymax)
+        flat *= self._nbins[0] + 2
+        flat += self._bin_index(xvalue, self._nbins[0], xmin, xmax)
+        self._counts += np.bincount(flat, weights=weights, minlength=self._counts.size)
+
+    def clear(self):
+        self._counts[:] = 0
+
+    def reduce(self, comm=None, root=0):
+        """
+        Sums the counts of all the MPI ranks of 'comm' (default: COMM_WORLD)
+        into the counts on the 'root' rank. The counts on the other ranks are
+        cleared so that calling this repeatedly keeps the counts on the root
+        rank cumulative. Returns True on the root rank.
+        """
+        from mpi4py import MPI
+        if comm is None:
+            comm = MPI.COMM_WORLD
+        if comm.Get_rank() == root:
+            comm.Reduce(MPI.IN_PLACE, self._counts, op=MPI.SUM, root=root)
+            return True
+        else:
+            comm.Reduce(self._counts, None, op=MPI.SUM, root=root)
+            self.clear()
+            return False
+
+    def _prepare_publish(self, timestamp=None):
+        data = super(Histogram2D, self)._prepare_publish(timestamp)
+        if data is not None:
+            data.image = np.array(self.values())
+            data.overflow = self.overflow()
+        return data
+
+
+class Gauge(Manager):
+    """
+    Publishes the values of a single scalar quantity. Each publish only sends
+    the points added since the previous one, which clients add to the history
+    of the last 'npoints' points they keep. The complete history is sent
+    instead every 'keyframe' publishes and after the number of points is
+    changed, so clients which missed a batch or joined late catch up.
+    """
+    def __init__(self, topic, npoints, title=None, xlabel=None, ylabel=None, leg_label=None, leg_offset=None,
+                 formatter='-', pubrate=None, publisher=None, keyframe=config.APP_GAUGE_KEYFRAME):
+        super(Gauge, self).__init__(topic, title, pubrate, publisher)
+        npoints = int(npoints)
+        if npoints <= 0:
+            raise ValueError('npoints must be greater than 0')
+        self.keyframe = keyframe
+        # points added since the last publish
+        self._times = deque(maxlen=npoints)
+        self._values = deque(maxlen=npoints)
+        # the history sent with keyframes
+        self._history_times = util.RingBuffer(npoints)
+        self._history_values = util.RingBuffer(npoints)
+        self._since_keyframe = 0
+        self._need_keyframe = True
+        self._cleared = False
+        self._data = plots.Scalar(
+            None,
+            self._title,
+            None,
+            None,
+            npoints,
+            xlabel=xlabel,
+            ylabel=ylabel,
+            leg_label=leg_label,
+            leg_offset=leg_offset,
+            formats=formatter,
+        )
+
+    def npoints(self, npoints=None):
+        if npoints is None:
+            return self._data.npoints
+        else:
+            npoints = int(npoints)
+            if npoints > 0:
+                self._times = deque(self._times, maxlen=npoints)
+                self._values = deque(self._values, maxlen=npoints)
+                self._history_times = self._resize_history(self._history_times, npoints)
+                self._history_values = self._resize_history(self._history_values, npoints)
+                self._data.npoints = npoints
+                self._need_keyframe = True
+            else:
+                raise ValueError('npoints must be greater than 0')
+
+    def format(self, newformat=None):
+        if newformat is None:
+            return self._data.formats
+        else:
+            self._data.formats = newformat
+
+    def add(self, value, timestamp=None):
+        self._times.append(time.time() if timestamp is None else timestamp)
+        self._values.append(value)
+
+    def clear(self):
+        """
+        Clears the points of the gauge. The next publish sends the empty
+        history, so clients clear theirs as well.
+        """
+        self._times.clear()
+        self._values.clear()
+        self._history_times.clear()
+        self._history_values.clear()
+        self._need_keyframe = True
+        self._cleared = True
+
+    @staticmethod
+    def _resize_history(history, npoints):
+        resized = util.RingBuffer(npoints)
+        resized.extend(history.data)
+        return resized
+
+    def _prepare_publish(self, timestamp=None):
+        # only publish when there are new points, or to clear the clients after a reset
+        if not (self._times or self._cleared) or super(Gauge, self)._prepare_publish(timestamp) is None:
+            return None
+        self._cleared = False
+        times = np.array(self._times, dtype=float)
+        values = np.array(self._values, dtype=float)
+        self._times.clear()
+        self._values.clear()
+        self._history_times.extend(times)
+        self._history_values.extend(values)
+        if self._need_keyframe or self._since_keyframe >= self.keyframe:
+            self._need_keyframe = False
+            self._since_keyframe = 0
+            self._data.times = self._history_times.data.copy()
+            self._data.values = self._history_values.data.copy()
+            self._data.append = False
+        else:
+            self._since_keyframe += 1
+            self._data.times = times
+            self._data.values = values
+            self._data.append = True
+        return self._data
+
+
+class StripChart(XYAppendStream, OverlayManager):
+    def __init__(self, topic, title=None, xlabel=None, ylabel=None, leg_offset=None, pubrate=None, publisher=None,
+                 stream=False, keyframe=config.APP_KEYFRAME_INTERVAL):
         super(StripChart, self).__init__(topic, title, pubrate, publisher)
+        self._init_stream(stream, keyframe)
         self._indices = []
         self._index_zeros = []
         self._xdata = []
@@ -182,9 +882,13 @@ class StripChart(OverlayManager):
                     self._ydata[index] = np.copy(self._ydata[index][-npoints:])
                 self._data.xdata[index] = self._xdata[index][:self._indices[index]]
                 self._data.ydata[index] = self._ydata[index][:self._indices[index]]
+                self._invalidate()
             else:
                 raise ValueError('npoints must be greater than 0')
 
+    def _npoints(self):
+        return [xdata.size for xdata in self._xdata]
+
     def xdata(self, name):
         return self._xdata[self._get_index(name)]
 
@@ -195,6 +899,7 @@ class StripChart(OverlayManager):
         npoints = int(npoints)
         if npoints <= 0:
             raise ValueError('npoints must be greater than 0')
+        self._invalidate()
         index, new_plot = self._make(name)
         if new_plot:
             self._indices.append(0)
@@ -237,6 +942,7 @@ class StripChart(OverlayManager):
         self._data.ydata[index] = self._ydata[index][:self._indices[index]]
 
     def clear(self, name=None):
+        self._invalidate()
         if name is None:
             for index in range(self._noverlay):
                 self._indices[index] = 0
@@ -307,9 +1013,11 @@ class LinePlot(OverlayManager):
             self._ydata[index] = np.zeros(0)
 
 
-class ScatterPlot(OverlayManager):
-    def __init__(self, topic, title=None, xlabel=None, ylabel=None, leg_offset=None, pubrate=None, publisher=None):
+class ScatterPlot(XYAppendStream, OverlayManager):
+    def __init__(self, topic, title=None, xlabel=None, ylabel=None, leg_offset=None, pubrate=None, publisher=None,
+                 stream=False, keyframe=config.APP_KEYFRAME_INTERVAL):
         super(ScatterPlot, self).__init__(topic, title, pubrate, publisher)
+        self._init_stream(stream, keyframe)
         self._indices = []
         self._xdata = []
         self._ydata = []
@@ -325,6 +1033,10 @@ class ScatterPlot(OverlayManager):
             formats=self._formats,
         )
 
+    def _npoints(self):
+        # clients keep all the points of a scatter plot
+        return None
+
     def xdata(self, name):
         return self._xdata[self._get_index(name)]
 
@@ -335,6 +1047,7 @@ class ScatterPlot(OverlayManager):
         size = int(size)
         if size <= 0:
             raise ValueError('initial size must be greater than 0')
+        self._invalidate()
         index, new_plot = self._make(name)
         if new_plot:
             self._indices.append(0)
@@ -367,6 +1080,7 @@ class ScatterPlot(OverlayManager):
         self._data.ydata[index] = self._ydata[index][:self._indices[index]]
 
     def clear(self, name=None):
+        self._invalidate()
         if name is None:
             for index in range(self._noverlay):
                 self._indices[index] = 0
@@ -379,9 +1093,13 @@ class ScatterPlot(OverlayManager):
             self._data.ydata[index] = self._ydata[index][:self._indices[index]]
 
 
-class Histogram(OverlayManager):
-    def __init__(self, topic, title=None, xlabel=None, ylabel=None, leg_offset=None, pubrate=None, publisher=None):
+class Histogram(AppendStream, OverlayManager):
+    def __init__(self, topic, title=None, xlabel=None, ylabel=None, leg_offset=None, pubrate=None, publisher=None,
+                 stream=False, keyframe=config.APP_KEYFRAME_INTERVAL):
         super(Histogram, self).__init__(topic, title, pubrate, publisher)
+        self._init_stream(stream, keyframe)
+        # counts added since the last publish for the delta messages of stream mode
+        self._pending = []
         self._nbins = []
         self._ranges = []
         self._bins = []
@@ -406,12 +1124,14 @@ class Histogram(OverlayManager):
         return self._values[self._get_index(name)]
 
     def make_hist(self, name, nbins, bmin, bmax, formatter='-', fills=True):
+        self._invalidate()
         index, new_hist = self._make(name)
         if new_hist:
             self._nbins.append(nbins)
             self._ranges.append((bmin, bmax))
             self._bins.append(util.make_bins(nbins, bmin, bmax))
             self._values.append(np.zeros(nbins))
+            self._pending.append(np.zeros(nbins))
             self._formats.append(formatter)
             self._fills.append(fills)
         else:
@@ -419,17 +1139,30 @@ class Histogram(OverlayManager):
             self._ranges[index] = (bmin, bmax)
             self._bins[index] = util.make_bins(nbins, bmin, bmax)
             self._values[index] = np.zeros(nbins)
+            self._pending[index] = np.zeros(nbins)
             self._formats[index] = formatter
             self._fills[index] = fills
 
     def add(self, name, value):
         index = self._get_index(name)
-        self._values[index] += np.histogram(value, self._nbins[index], range=self._ranges[index])[0]
+        counts = np.histogram(value, self._nbins[index], range=self._ranges[index])[0]
+        self._values[index] += counts
+        if self.stream:
+            self._pending[index] += counts
 
     def clear(self, name=None):
+        self._invalidate()
         if name is None:
             for value in self._values:
                 value[:] = 0
         else:
             index = self._get_index(name)
             self._values[index][:] = 0
+
+    def _keyframe_sent(self, data):
+        for pending in self._pending:
+            pending[:] = 0
+
+    def _fill_delta(self, delta):
+        delta.values = [np.copy(pending) for pending in self._pending]
+        self._keyframe_sent(delta)
@@ -37,6 +37,8 @@ class _Publish(object):
         self.port = port
         self._publisher = app.ZMQPublisher()
         self._reset_listener = app.ZMQListener(self._publisher.comm_socket)
+        self._reset_listener.resync_callback = self._publisher.request_resync
+        self._reset_listener.crop_callback = self._publisher.request_crop
         self._spawner = client.spawn_process
         self._redirect = util.redirect_stdout
         self.client_opts = app.ClientInfo(
@@ -64,6 +66,31 @@ class _Publish(object):
          - topic: The name of the topic to which the data is being published.
          - data: The data object to be published to suscribers.
         """
+        self._autoinit()
+        self._check_local(topic)
+        self._publisher.send(topic, data)
+
+    def send_many(self, topic_data):
+        """
+        Publishes data objects to several topics at once. This is cheaper than
+        calling send for each topic since the messages are serialized and handed
+        to the publisher as a single batch.
+
+        Arguments
+         - topic_data: A dictionary of topic names to the data objects to be
+                published to them.
+        """
+        self._autoinit()
+        if self.local:
+            for topic in topic_data:
+                self._check_local(topic)
+        self._publisher.send_many(topic_data)
+
+    def _autoinit(self):
+        """
+        Initializes the publish module on the first send if it was not
+        explicitly initialized.
+        """
         if not self.initialized and not self.disabled:
             try:
                 with self._redirect():
@@ -77,6 +104,10 @@ class _Publish(object):
             except ImportError:
                 self.init()
 
+    def _check_local(self, topic):
+        """
+        Spawns a local client for the topic if needed when publishing locally.
+        """
         if self.local:
             if topic in self.active_clients:
                 if not self.active_clients[topic].is_alive():
@@ -84,7 +115,125 @@ class _Publish(object):
             else:
                 self._create_client(topic)
 
-        self._publisher.send(topic, data)
+    def wants(self, topic):
+        """
+        Returns True if data sent to the topic would currently be published.
+
+        Topics without any subscribers are only sent at a low rate to keep the
+        last-value cache fresh, so callers can use this to skip building data
+        for topics nobody is watching.
+
+        Arguments
+         - topic: The name of the topic to check.
+        """
+        return not self.initialized or self._publisher.wants(topic)
+
+    def resync_requested(self, topic):
+        """
+        Returns True if a client missed append-stream messages for the topic
+        and asked for a resync since the last call. The next message sent to
+        the topic should then hold the complete data.
+
+        Arguments
+         - topic: The name of the topic to check.
+        """
+        return self._publisher.resync_requested(topic)
+
+    def enable_crops(self, topic):
+        """
+        Accepts requests from clients for full resolution crops of the image
+        topic. Only call this if the crop requests of the topic are handled
+        with crop_requests, as plotting.Image managers do.
+
+        Arguments
+         - topic: The name of the image topic.
+        """
+        self._publisher.enable_crops(topic)
+
+    def disable_crops(self, topic):
+        """
+        Stops accepting requests from clients for crops of the image topic.
+
+        Arguments
+         - topic: The name of the image topic.
+        """
+        self._publisher.disable_crops(topic)
+
+    def crop_requests(self, topic):
+        """
+        Returns a dictionary of the client ids which requested full resolution
+        crops of the image topic since the last call to the requested regions
+        of interest, which are (x0, x1, y0, y1) tuples or None for cancelled
+        crops.
+
+        Arguments
+         - topic: The name of the topic to check.
+        """
+        return self._publisher.crop_requests(topic)
+
+    def subscribers(self, topic=None):
+        """
+        Returns the number of clients suscribed to the topic, or a dictionary of
+        the subscriber counts of all watched topics if no topic is specified.
+
+        Optional arguments
+         - topic: The name of the topic to check.
+        """
+        return self._publisher.subscribers(topic)
+
+    def retire(self, topic):
+        """
+        Retires a topic that will no longer be published. Its last message is
+        dropped from the cache and it is removed from the list of known topics.
+
+        Arguments
+         - topic: The name of the topic to retire.
+        """
+        self._publisher.retire(topic)
+
+    def send_policy(self, topic=None, depth=None, policy=None, timeout=None):
+        """
+        Configures the bounded queue of messages waiting to be sent, either for
+        all topics or just for the specified one.
+
+        Optional arguments
+         - topic: The name of the topic to configure - all topics if None.
+         - depth: The maximum number of queued messages per topic.
+         - policy: What to do when the queue of a topic is full: 'drop-oldest',
+                'drop-newest' or 'block' (wait up to timeout then drop).
+         - timeout: The maximum time in seconds to block when the policy is 'block'.
+        """
+        self._publisher.send_queue.set_policy(topic, depth, policy, timeout)
+
+    def serialization(self, workers=None, codec=None):
+        """
+        Configures how published data is serialized.
+
+        Optional arguments
+         - workers: The number of threads used to encode the array buffers of
+                messages concurrently - zero disables the worker pool.
+         - codec: The compression codec used for large array buffers: 'lz4' or
+                'zstd' (the python module must be installed), or False to
+                disable compression.
+        """
+        self._publisher.serializer.configure(workers, codec)
+
+    def send_stats(self, topic=None):
+        """
+        Returns a dictionary of the queued, sent, dropped and timeout counters of
+        the send queue for the topic, or a dictionary of them for all topics.
+
+        Optional arguments
+         - topic: The name of the topic - all topics if None.
+        """
+        return self._publisher.send_stats(topic)
+
+    def cache_stats(self):
+        """
+        Returns a dictionary of statistics on the usage of the last-value cache
+        such as its size in bytes, hit rate and number of evictions.
+        """
+        return self._publisher.cache_stats()
 
     def _create_client(self, topic):
         """
@@ -95,7 +244,7 @@ class _Publish(object):
         self.client_opts.topic = topic
         self.active_clients[topic] = self._spawner(self.client_opts, self.plot_opts)
 
-    def init(self, port=None, bufsize=None, local=None):
+    def init(self, port=None, bufsize=None, local=None, cache_bytes=None, cache_ttl=None):
         """
         Initializes the publish module.
 
@@ -103,6 +252,8 @@ class _Publish(object):
          - port: The tcp port number to use with the publish module.
          - bufsize: The zmq buffer size to use with the publish module.
          - local: When true all plots are published to a client launched locally.
+         - cache_bytes: The maximum total size in bytes of the last-value cache.
+         - cache_ttl: The time in seconds after which cached messages expire.
         """
         if port is not None:
             self.port = port
@@ -110,6 +261,10 @@ class _Publish(object):
             self.client_opts.buffer = bufsize
         if local is not None:
             self.local = local
+        if cache_bytes is not None:
+            self._publisher.cache.max_bytes = cache_bytes
+        if cache_ttl is not None:
+            self._publisher.cache.ttl = cache_ttl
         # update to the port publisher found available
         self.port = self._publisher.initialize(self.port, self.client_opts.buffer, self.local)
         self._reset_listener.start()
@@ -124,6 +279,13 @@ class _Publish(object):
          - name: all messages sent from clients with this header will be handled by
         this message handler
 
+        Optional arguments
+         - limit: the maximum number of pending messages, 0 for no limit
+         - is_pyobj: whether the messages are python objects or strings
+         - callback: function called with each message instead of queueing it
+         - executor: the executor the callback is run on, a thread of the
+        handler's own if not specified
+
         Returns a refernce to the newly created handler.
         """
         return self._reset_listener.register_handler(name, **kwargs)
@@ -137,18 +299,39 @@ class _Publish(object):
         """
         return self._reset_listener.get_handler(name)
 
-    def get_reset_flag(self):
+    def get_reset_flag(self, topic=None):
         """
         Gets the state of the client reset flag. This will be set if any client
-        has sent a reset message, and will remain set until cleared.
+        has sent a reset message for all topics, and will remain set until
+        cleared. Reset messages for a single topic only set the flag of that
+        topic.
+
+        Optional arguments
+         - topic: get the reset flag of this topic instead, which is also set by
+        reset messages for the topic alone
         """
-        return self._reset_listener.get_flag()
+        return self._reset_listener.get_flag(topic)
 
-    def clear_reset_flag(self):
+    def clear_reset_flag(self, topic=None):
+        """
+        Clears the client reset flag. Resets which have not been seen yet by
+        reset_requested, like the ones of the plotting managers, are kept.
+
+        Optional arguments
+         - topic: clear the reset flag of this topic instead
         """
-        Clears any set reset flags.
+        self._reset_listener.clear_flag(topic)
+
+    def reset_requested(self, topic):
+        """
+        Returns whether a client has asked for the topic to be reset since the
+        last call, either for the topic alone or for all topics. This clears
+        the reset flag of the topic but not the one returned by get_reset_flag.
+
+        Arguments
+         - topic: the topic to check
         """
-        self._reset_listener.clear_flag()
+        return self._reset_listener.reset_flags.consume(topic)
 
     def wait(self):
         """
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+import sys
+import zmq
+import time
+import itertools
+import logging
+import argparse
+
+from psmon import app, config, log_level_parse
+# Queue module changed to queue in py3
+if sys.version_info < (3,):
+    import Queue as queue
+else:
+    import queue
+
+
+LOG = logging.getLogger(config.LOG_BASE_NAME)
+
+
+class Relay(object):
+    """
+    Republishes the topics of an upstream psmon server to downstream clients.
+
+    The relay holds a single upstream subscription per topic no matter how many
+    downstream clients are watching it, and only pulls topics which currently
+    have at least one downstream subscriber. Since the downstream side is a
+    regular ZMQPublisher relays can be chained.
+    """
+    def __init__(self, client_info, port=config.APP_PORT, bufsize=config.APP_BUFFER, local=config.APP_LOCAL):
+        self.port = port
+        self.bufsize = bufsize
+        self.local = local
+        self.watched = set()
+        self.upstream_topics = app.TopicRegistry()
+        self._sub_changes = queue.Queue()
+        self._comm_ids = itertools.count()
+        self._comm_pending = {}
+        self.publisher = app.ZMQPublisher(sub_callback=self._sub_changed)
+        self.subscriber = app.ZMQSubscriber(client_info, connect=False)
+
+    def _sub_changed(self, topic, count):
+        # called from the publisher proxy thread so hand off to the relay loop
+        self._sub_changes.put((topic, count))
+
+    def _update_subscriptions(self):
+        while True:
+            try:
+                topic, count = self._sub_changes.get_nowait()
+            except queue.Empty:
+                break
+            if topic.startswith(config.APP_RESERVED_TOPIC):
+                continue
+            if count > 0 and topic not in self.watched:
+                if LOG.isEnabledFor(logging.DEBUG):
+                    LOG.debug('Subscribing to upstream topic: %s', topic)
+                self.subscriber.subscribe(topic)
+                self.watched.add(topic)
+            elif count == 0 and topic in self.watched:
+                if LOG.isEnabledFor(logging.DEBUG):
+                    LOG.debug('Unsubscribing from upstream topic: %s', topic)
+                self.subscriber.unsubscribe(topic)
+                self.watched.discard(topic)
+
+    def _forward_data(self):
+        while True:
+            try:
+                topic, frames, append = self.subscriber.data_recv_raw(flags=zmq.NOBLOCK)
+            except zmq.ZMQError as e:
+                if e.errno == zmq.EAGAIN:
+                    break
+                else:
+                    raise
+            if topic == config.APP_TOPIC_LIST and not self.upstream_topics.apply(app.deserialize(frames)):
+                # missed a topic list update so resubscribe to get a new snapshot
+                if LOG.isEnabledFor(logging.WARN):
+                    LOG.warning('Missed upstream topic list update - requesting a new snapshot')
+                self.subscriber.unsubscribe(topic)
+                self.subscriber.subscribe(topic)
+                continue
+            self.publisher.forward(topic, frames, append)
+
+    def _forward_request(self):
+        frames = self.publisher.comm_socket.recv_multipart()
+        request = app.comm_envelope(frames)
+        if request is None:
+            if LOG.isEnabledFor(logging.WARN):
+                LOG.warning('Malformed request received from downstream client - %d frames', len(frames))
+            return
+        route, header, body = request
+        # tag the request with an id of our own so replies can be matched to the downstream client
+        req_id = str(next(self._comm_ids)).encode('ascii')
+        self._comm_pending[req_id] = (route, header, time.time())
+        self.subscriber.comm_socket.send_multipart([b'', req_id, header, body])
+
+    def _forward_reply(self):
+        frames = self.subscriber.comm_socket.recv_multipart()
+        if len(frames) != 4 or frames[0] != b'':
+            if LOG.isEnabledFor(logging.WARN):
+                LOG.warning('Malformed reply received from upstream server - %d frames', len(frames))
+            return
+        pending = self._comm_pending.pop(frames[1], None)
+        # drop late replies to requests that have already timed out
+        if pending is not None:
+            self.publisher.comm_socket.send_multipart(pending[0] + frames[2:])
+
+    def _expire_requests(self):
+        now = time.time()
+        for req_id, (route, header, sent) in list(self._comm_pending.items()):
+            if now - sent > config.APP_TIMEOUT:
+                if LOG.isEnabledFor(logging.WARN):
+                    LOG.warning('Upstream server did not reply to request: %s', header)
+                del self._comm_pending[req_id]
+                self.publisher.comm_socket.send_multipart(route + [header, b'upstream request timed out'])
+
+    def run(self):
+        if self.publisher.initialize(self.port, self.bufsize, self.local) is None:
+            LOG.error('Unable to start the relay publisher')
+            return 1
+        self.subscriber.connect()
+
+        poller = zmq.Poller()
+        poller.register(self.subscriber.data_socket, zmq.POLLIN)
+        poller.register(self.subscriber.comm_socket, zmq.POLLIN)
+        poller.register(self.publisher.comm_socket, zmq.POLLIN)
+        while True:
+            self._update_subscriptions()
+            ready_socks = dict(poller.poll(config.APP_RELAY_POLL))
+            if self.subscriber.data_socket in ready_socks:
+                self._forward_data()
+            if self.subscriber.comm_socket in ready_socks:
+                self._forward_reply()
+            if self.publisher.comm_socket in ready_socks:
+                self._forward_request()
+            self._expire_requests()
+
+
+def parse_cmdline():
+    parser = argparse.ArgumentParser(
+        description='Psmon relay for serving many clients from a single upstream server'
+    )
+
+    parser.add_argument(
+        '-s',
+        '--server',
+        metavar='SERVER',
+        default=config.APP_SERVER,
+        help='the host name of the upstream server (default: %s)' % config.APP_SERVER
+    )
+
+    parser.add_argument(
+        '-p',
+        '--port',
+        metavar='PORT',
+        type=int,
+        default=config.APP_PORT,
+        help='the tcp port of the upstream server (default: %d)' % config.APP_PORT
+    )
+
+    parser.add_argument(
+        '-l',
+        '--listen-port',
+        metavar='LISTEN_PORT',
+        type=int,
+        default=config.APP_PORT,
+        help='the tcp port the relay publishes on (default: %d)' % config.APP_PORT
+    )
+
+    parser.add_argument(
+        '-b',
+        '--buffer',
+        metavar='BUFFER',
+        type=int,
+        default=config.APP_BUFFER,
+        help='the size in messages of send/recieve buffers (default: %d)' % config.APP_BUFFER
+    )
+
+    parser.add_argument(
+        '--log',
+        metavar='LOG',
+        default=config.LOG_LEVEL,
+        help='the logging level of the relay (default %s)' % config.LOG_LEVEL
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    try:
+        args = parse_cmdline()
+
+        # set levels for loggers that we care about
+        LOG.setLevel(log_level_parse(args.log))
+
+        client_info = app.ClientInfo(
+            'tcp://%s:%d' % (args.server, args.port),
+            'tcp://%s:%d' % (args.server, args.port+config.APP_COMM_OFFSET),
+            args.buffer,
+            config.APP_RATE,
+            config.APP_RECV_LIMIT,
+            config.APP_TOPIC_LIST,
+            None,
+            True)
+        LOG.info('Starting relay for server %s on port %d', args.server, args.port)
+
+        return Relay(client_info, args.listen_port, args.buffer).run()
+    except KeyboardInterrupt:
+        print('\nExitting relay!')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
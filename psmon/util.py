@@ -1,6 +1,8 @@
 import os
 import sys
 import numpy as np
+import time
+import calendar
 import collections
 import datetime as dt
 from itertools import chain
@@ -42,6 +44,323 @@ def convert_to_array(obj):
         return np.array([obj])
 
 
+class RingBuffer(object):
+    """
+    A history of the most recent 'size' values, which is always available as a
+    contiguous numpy array. Twice the size is allocated so the values only need
+    to be moved back to the start of the storage once every 'size' appends.
+
+    If 'size' is None the buffer keeps all the values, doubling its storage
+    when it runs out of room.
+    """
+    def __init__(self, size, dtype=float):
+        self.size = None if size is None else int(size)
+        if self.size is not None and self.size <= 0:
+            raise ValueError('size must be greater than 0')
+        self._buf = np.zeros(2 * (self.size or 512), dtype=dtype)
+        self._start = 0
+        self._end = 0
+
+    @property
+    def data(self):
+        """
+        Returns a view of the values in the buffer from oldest to newest
+        """
+        return self._buf[self._start:self._end]
+
+    def __len__(self):
+        return self._end - self._start
+
+    def clear(self):
+        self._start = 0
+        self._end = 0
+
+    def extend(self, values):
+        values = np.ravel(values)
+        if self.size is None:
+            if self._end + values.size > self._buf.size:
+                self._buf = np.resize(self._buf, 2 * (self._end + values.size))
+            self._buf[self._end:self._end+values.size] = values
+            self._end += values.size
+            return
+        values = values[-self.size:]
+        nvalues = values.size
+        if self._end + nvalues > self._buf.size:
+            keep = min(self.size - nvalues, self._end - self._start)
+            self._buf[:keep] = self._buf[self._end-keep:self._end]
+            self._start = 0
+            self._end = keep
+        self._buf[self._end:self._end+nvalues] = values
+        self._end += nvalues
+        self._start = max(self._start, self._end - self.size)
+
+
+class AppendBuffer(object):
+    """
+    Client side copy of the series of an append-stream XYPlot topic.
+    """
+    def __init__(self):
+        self.seq = None
+        self._xbufs = []
+        self._ybufs = []
+
+    def apply(self, data):
+        """
+        Adds the points of a full or append XYPlot message to the buffered
+        series, and then replaces the series of the message with the buffered
+        ones. Returns False if an append message does not directly follow the
+        last message, in which case the client should request a resync.
+        """
+        single = not is_py_iter(data.xdata)
+        xdata = [data.xdata] if single else data.xdata
+        ydata = [data.ydata] if single else data.ydata
+        npoints = data.npoints if is_py_iter(data.npoints) else [data.npoints] * len(xdata)
+        in_sync = True
+        if data.append and self.seq is not None and data.seq <= self.seq:
+            # already applied - e.g. a cached message resent for a new subscriber
+            xdata = ydata = ()
+        else:
+            if data.append and (data.base != self.seq or len(xdata) != len(self._xbufs)):
+                in_sync = False
+            if not data.append or len(xdata) != len(self._xbufs):
+                self._xbufs = [RingBuffer(size) for size in npoints]
+                self._ybufs = [RingBuffer(size) for size in npoints]
+            self.seq = data.seq
+        for xbuf, ybuf, xvals, yvals in zip(self._xbufs, self._ybufs, xdata, ydata):
+            xbuf.extend(xvals)
+            ybuf.extend(yvals)
+        if single:
+            data.xdata = self._xbufs[0].data
+            data.ydata = self._ybufs[0].data
+        else:
+            data.xdata = [buf.data for buf in self._xbufs]
+            data.ydata = [buf.data for buf in self._ybufs]
+        return in_sync
+
+
+class HistAccumulator(object):
+    """
+    Client side running sums of the values of a delta-mode Hist topic.
+
+    Optional arguments
+    - window: if set only the counts received in the last 'window' seconds
+            are shown instead of the sums since the last reset
+    """
+    def __init__(self, window=None):
+        self.window = window
+        self.seq = None
+        self._totals = None
+        self._baseline = None
+        self._history = collections.deque()
+        # cached keyframes resent to a new subscriber are followed by deltas
+        # that have already been recorded in the history
+        self._replay_until = None
+
+    def reset(self):
+        """
+        Clears the counts shown by the client without affecting the sums.
+        """
+        if self._totals is not None:
+            self._baseline = [np.copy(total) for total in self._totals]
+        self._history.clear()
+
+    def _record(self, deltas):
+        if self.window is not None:
+            self._history.append((time.time(), deltas))
+
+    def _matches(self, values):
+        return self._totals is not None and len(values) == len(self._totals) and \
+            all(value.shape == total.shape for value, total in zip(values, self._totals))
+
+    def _apply_keyframe(self, seq, values):
+        if self._matches(values) and self.seq is not None and seq <= self.seq:
+            self._replay_until = self.seq
+        elif self._matches(values) and self.seq is not None and seq == self.seq + 1:
+            self._record([value - total for value, total in zip(values, self._totals)])
+        else:
+            self._baseline = None
+            self._history.clear()
+            self._record([np.copy(value) for value in values])
+        self._totals = [np.array(value, dtype=float) for value in values]
+        self.seq = seq
+        return True
+
+    def _apply_delta(self, seq, base, values):
+        if self.seq is not None and seq <= self.seq:
+            # already applied - e.g. a cached message resent for a new subscriber
+            return True
+        if not self._matches(values):
+            return False
+        for total, value in zip(self._totals, values):
+            total += value
+        if self._replay_until is None or seq > self._replay_until:
+            self._replay_until = None
+            self._record(values)
+        in_sync = base == self.seq
+        self.seq = seq
+        return in_sync
+
+    def view(self):
+        """
+        Returns the counts to show, which are the sums over the window if one
+        is set and otherwise the sums since the last reset.
+        """
+        if self._totals is None:
+            return []
+        if self.window is not None:
+            cutoff = time.time() - self.window
+            while self._history and self._history[0][0] < cutoff:
+                self._history.popleft()
+            counts = [np.zeros_like(total) for total in self._totals]
+            for _, deltas in self._history:
+                for count, delta in zip(counts, deltas):
+                    count += delta
+            return counts
+        if self._baseline is not None:
+            return [total - base for total, base in zip(self._totals, self._baseline)]
+        return [np.copy(total) for total in self._totals]
+
+    def apply(self, data):
+        """
+        Adds the counts of a full or delta Hist message to the sums, and then
+        replaces the values of the message with the counts to show. Returns
+        False if a delta message does not directly follow the last message, in
+        which case the client should request a resync.
+        """
+        single = not is_py_iter(data.values)
+        values = [data.values] if single else data.values
+        values = [np.asarray(value) for value in values]
+        if data.append:
+            in_sync = self._apply_delta(data.seq, data.base, values)
+        else:
+            in_sync = self._apply_keyframe(data.seq, values)
+        counts = self.view()
+        if counts:
+            data.values = counts[0] if single else counts
+        return in_sync
+
+
+QUANTIZE_TYPES = ('float32', 'float16', 'uint8', 'uint16')
+
+
+def quantize(image, dtype, log=False, zrange=None):
+    """
+    Reduces the precision of an image for sending it. Float types are just a
+    cast, while for integer types the range 'zrange' (default: the range of
+    the image) is mapped linearly, or logarithmically if 'log' is set, onto
+    the range of the type. Values outside of the range are clipped and NaNs
+    are set to the bottom of the range.
+
+    Returns a tuple of the quantized image, the offset and the step, where the
+    last two are None for float types.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return image.astype(dtype, copy=False), None, None
+    if zrange is None:
+        zmin, zmax = float(np.nanmin(image)), float(np.nanmax(image))
+    else:
+        zmin, zmax = zrange
+    qmax = np.iinfo(dtype).max
+    scaled = np.subtract(image, zmin, dtype=np.float32)
+    np.clip(scaled, 0, max(zmax - zmin, 0), out=scaled)
+    if log:
+        np.log1p(scaled, out=scaled)
+        span = np.log1p(zmax - zmin) if zmax > zmin else 0.0
+    else:
+        span = zmax - zmin
+    step = span / qmax if span > 0 else 1.0
+    scaled *= 1.0 / step
+    np.rint(scaled, out=scaled)
+    np.copyto(scaled, 0, where=np.isnan(scaled))
+    return scaled.astype(dtype), zmin, step
+
+
+def dequantize(values, offset, step, log=False):
+    """
+    Converts quantized values (or ranges of them) back to the original units.
+    """
+    values = np.multiply(values, step)
+    if log:
+        values = np.expm1(values)
+    return values + offset
+
+
+def to_quantized(values, offset, step, log=False):
+    """
+    Converts values in the original units to (unrounded) quantized values,
+    e.g. for setting color levels of a quantized image.
+    """
+    values = np.subtract(values, offset)
+    if log:
+        values = np.log1p(np.maximum(values, 0))
+    return values / step
+
+
+def sparse_encode(image, density):
+    """
+    Returns the sparse encoding of an image as a tuple of the indices, values
+    and run lengths of its non-zero pixels, or None if the fraction of non-zero
+    pixels is not below 'density'. The runs are only used (otherwise the
+    lengths are None) when they make the encoding smaller.
+    """
+    nhits = np.count_nonzero(image)
+    if nhits >= density * image.size:
+        return None
+    flat = image.ravel()
+    indices = np.flatnonzero(flat)
+    values = flat[indices]
+    index_type = np.uint32 if image.size <= np.iinfo(np.uint32).max else np.uint64
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    if 2 * (len(breaks) + 1) < nhits:
+        starts = indices[np.concatenate(([0], breaks))]
+        lengths = np.diff(np.concatenate(([0], breaks, [nhits])))
+        return starts.astype(index_type), values, lengths.astype(index_type)
+    return indices.astype(index_type), values, None
+
+
+def sparse_indices(indices, lengths=None):
+    """
+    Returns the flat indices of all the pixels of a sparse image.
+    """
+    if lengths is None:
+        return indices
+    lengths = lengths.astype(np.intp)
+    offsets = indices.astype(np.intp) - np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.arange(np.sum(lengths)) + np.repeat(offsets, lengths)
+
+
+class SparseImageBuffer(object):
+    """
+    Client side dense copy of the image of a topic which sends sparse images.
+    Only the pixels set by the previous sparse image are cleared before the
+    new ones are set.
+    """
+    def __init__(self):
+        self.image = None
+        self._last = None
+
+    def apply(self, data):
+        """
+        Replaces the image of a sparse image message with the dense buffer
+        filled from its pixels. Dense images are passed through as they are.
+        """
+        if getattr(data, 'indices', None) is None:
+            # the next sparse image has to clear the whole buffer
+            self._last = None
+            return
+        shape = tuple(data.shape)
+        if self.image is None or self.image.shape != shape or self.image.dtype != data.values.dtype:
+            self.image = np.zeros(shape, dtype=data.values.dtype)
+        elif self._last is None:
+            self.image.fill(0)
+        else:
+            self.image.flat[self._last] = 0
+        self._last = sparse_indices(data.indices, data.lengths)
+        self.image.flat[self._last] = data.values
+        data.image = self.image
+
+
 def check_data(obj):
     """
     Checks that the deepest nested sequence object is a numpy array and
@@ -112,11 +431,52 @@ def merge_dicts(base, updates):
     return new_dict
 
 
+def _local_offset(seconds):
+    return calendar.timegm(time.localtime(seconds)) - seconds
+
+
+def _local_offsets(seconds):
+    """
+    Returns an array of the offsets in seconds of local time from UTC at the
+    integer timestamps 'seconds'.
+
+    Changes of the offset happen on quarter hour boundaries of UTC time, so
+    the offset is only looked up at the start and end of each quarter hour
+    the timestamps fall in. The few timestamps in a quarter hour containing a
+    change are looked up one by one.
+    """
+    quarters, inverse = np.unique(seconds // 900, return_inverse=True)
+    first = np.array([_local_offset(int(quarter) * 900) for quarter in quarters], dtype=np.int64)
+    last = np.array([_local_offset(int(quarter) * 900 + 899) for quarter in quarters], dtype=np.int64)
+    offsets = first[inverse.reshape(seconds.shape)]
+    changed = (first != last)[inverse.reshape(seconds.shape)]
+    if changed.any():
+        offsets[changed] = [_local_offset(int(ts)) for ts in seconds[changed]]
+    return offsets
+
+
+def ts_to_dt64(timestamps):
+    """
+    Converts an array of timestamps to an array of local time datetime64
+    values with microsecond precision. Timestamps which aren't finite become
+    NaT.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    finite = np.isfinite(timestamps)
+    # round the fraction separately like datetime.fromtimestamp does
+    seconds = np.floor(np.where(finite, timestamps, 0))
+    micros = np.round((np.where(finite, timestamps, 0) - seconds) * 1e6).astype(np.int64)
+    seconds = seconds.astype(np.int64)
+    micros += (seconds + _local_offsets(seconds)) * 1000000
+    micros[~finite] = np.iinfo(np.int64).min
+    return micros.view('datetime64[us]')
+
+
 def ts_to_str(timestamps):
     if is_py_iter(timestamps):
         return [ts_to_str(ts) for ts in timestamps]
     elif isinstance(timestamps, np.ndarray):
-        return np.array([ts_to_str(ts) for ts in timestamps])
+        return np.char.replace(np.datetime_as_string(ts_to_dt64(timestamps), unit='s'), 'T', ' ')
     else:
         return dt.datetime.fromtimestamp(timestamps).strftime('%Y-%m-%d %H:%M:%S')
 
@@ -125,11 +485,36 @@ def ts_to_dt(timestamps):
     if is_py_iter(timestamps):
         return [ts_to_dt(ts) for ts in timestamps]
     elif isinstance(timestamps, np.ndarray):
-        return np.array([ts_to_dt(ts) for ts in timestamps])
+        return ts_to_dt64(timestamps)
     else:
         return dt.datetime.fromtimestamp(timestamps)
 
 
+class DateConverter(object):
+    """
+    Converts timestamps with ts_to_dt, reusing the result of the previous call
+    for the leading part of the array if it is unchanged. For append-only data
+    only the new points need to be converted on each update.
+    """
+    def __init__(self):
+        self._timestamps = None
+        self._dates = None
+
+    def convert(self, timestamps):
+        if not isinstance(timestamps, np.ndarray) or timestamps.ndim != 1:
+            return ts_to_dt(timestamps)
+        ncached = 0 if self._timestamps is None else self._timestamps.size
+        if 0 < ncached <= timestamps.size and np.array_equal(timestamps[:ncached], self._timestamps):
+            if ncached == timestamps.size:
+                return self._dates
+            dates = np.concatenate((self._dates, ts_to_dt64(timestamps[ncached:])))
+        else:
+            dates = ts_to_dt64(timestamps)
+        self._timestamps = np.array(timestamps, dtype=float)
+        self._dates = dates
+        return dates
+
+
 @contextmanager
 def redirect_stdout():
     sys.stdout.flush()
@@ -0,0 +1,273 @@
+import time
+import logging
+import traceback
+import multiprocessing as mp
+import numpy as np
+
+from psmon import config
+from psmon.app import PublishError
+# Queue module changed to queue in py3
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+# shared memory is only available in python 3.8+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+LOG = logging.getLogger(config.LOG_BASE_NAME)
+
+
+def _slot_layout(values, slot_bytes):
+    """
+    Returns the offsets in a slot of the numpy arrays in 'values', and the
+    number of bytes they use. Arrays are aligned to config.APP_WORKER_ALIGN.
+    """
+    offsets = []
+    used = 0
+    for value in values:
+        if isinstance(value, np.ndarray):
+            if value.dtype.hasobject:
+                raise ValueError('Arrays of python objects can not be sent to the publish worker')
+            used = -(-used // config.APP_WORKER_ALIGN) * config.APP_WORKER_ALIGN
+            offsets.append(used)
+            used += value.nbytes
+        else:
+            offsets.append(None)
+    if used > slot_bytes:
+        raise ValueError('Arrays of %d bytes do not fit in the %d byte slots of the publish worker'
+                         % (used, slot_bytes))
+    return offsets
+
+
+def _write_slot(buf, base, values, offsets):
+    """
+    Copies the numpy arrays in 'values' into the shared memory buffer and
+    returns their descriptions. Other values are passed as they are.
+    """
+    encoded = []
+    for value, offset in zip(values, offsets):
+        if offset is None:
+            encoded.append(('o', value))
+        else:
+            dest = np.ndarray(value.shape, dtype=value.dtype, buffer=buf, offset=base + offset)
+            np.copyto(dest, value)
+            encoded.append(('a', base + offset, value.dtype.str, value.shape))
+    return encoded
+
+
+def _read_slot(buf, encoded, copy):
+    values = []
+    for item in encoded:
+        if item[0] == 'o':
+            values.append(item[1])
+        else:
+            _, offset, dtype, shape = item
+            value = np.ndarray(shape, dtype=np.dtype(dtype), buffer=buf, offset=offset)
+            if copy:
+                value = value.copy()
+            else:
+                value.flags.writeable = False
+            values.append(value)
+    return values
+
+
+def _worker_main(setup, shm_name, commands, free_slots, errors, copy, init_opts):
+    # imported here since the plotting module pulls in the publish module
+    from psmon import publish, plotting
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        try:
+            if init_opts is not None:
+                publish.init(**init_opts)
+            handlers, managers = setup()
+            group = plotting.Group(managers)
+        except Exception:
+            LOG.exception('Publish worker setup failed')
+            errors.put(('setup', traceback.format_exc()))
+            return
+        running = True
+        while running:
+            batch = [commands.get()]
+            # handle everything that is already waiting before publishing
+            while True:
+                try:
+                    batch.append(commands.get_nowait())
+                except queue.Empty:
+                    break
+            slots = []
+            for command in batch:
+                if command is None:
+                    running = False
+                    break
+                name, slot, args, kwargs = command
+                slots.append(slot)
+                try:
+                    args = _read_slot(shm.buf, args, copy)
+                    kwargs = dict(zip(kwargs[0], _read_slot(shm.buf, kwargs[1], copy)))
+                    handlers[name](*args, **kwargs)
+                except Exception:
+                    LOG.exception('Publish worker failed to handle command: %s', name)
+                    errors.put((name, traceback.format_exc()))
+            try:
+                group.publish()
+            except Exception:
+                LOG.exception('Publish worker failed to publish')
+                errors.put(('publish', traceback.format_exc()))
+            # the arrays may be read until the plots are published
+            for slot in slots:
+                free_slots.put(slot)
+    finally:
+        shm.close()
+
+
+class PublishWorker(object):
+    """
+    Runs plotting managers and publishes them from a separate process.
+
+    The managers are created in the worker process by calling 'setup', which
+    must be a module level function so it can be pickled. It returns a
+    dictionary of command names to functions, for example the add methods of
+    histograms, and a list of the managers the worker should publish. Calling
+    submit with a command name copies the numpy array arguments into a free
+    slot of a shared memory block and has the worker call the function with
+    them, so the analysis only pays for the copy. The managers are published
+    whenever the worker has handled all of the submitted commands.
+
+    The worker is started with the 'spawn' method of multiprocessing, so the
+    main module of the analysis is imported again in the worker and needs an
+    'if __name__ == "__main__"' guard.
+
+    Exceptions raised by 'setup', by the functions of the commands and while
+    publishing are reported back and logged by submit. Once the worker has
+    stopped submit raises a PublishError with the reason, if one was
+    reported, instead of waiting for a slot which is never freed.
+
+    Arguments:
+     - setup: function called in the worker process which returns a
+            dictionary of command names to functions and a list of managers
+
+    Optional arguments:
+     - nslots: the number of commands which can be pending at once
+     - slot_bytes: the size in bytes of the slot of each command
+     - copy: if True the worker copies arrays out of the shared memory before
+            passing them on. Otherwise functions get read-only views which are
+            only valid until the managers are published, so this should only be
+            disabled if the functions don't keep the arrays, like the add
+            methods of histograms do not.
+     - init_opts: keyword arguments for publish.init in the worker process.
+            If None the publish module is initialized on the first send.
+    """
+    def __init__(self, setup, nslots=config.APP_WORKER_SLOTS, slot_bytes=config.APP_WORKER_SLOT_BYTES, copy=True,
+                 init_opts=None):
+        if shared_memory is None:
+            raise ValueError('The publish worker requires the multiprocessing.shared_memory module')
+        if nslots <= 0:
+            raise ValueError('nslots must be greater than 0')
+        self.nslots = nslots
+        self.slot_bytes = -(-int(slot_bytes) // config.APP_WORKER_ALIGN) * config.APP_WORKER_ALIGN
+        self._shm = shared_memory.SharedMemory(create=True, size=self.nslots * self.slot_bytes)
+        # spawn a fresh interpreter so the worker doesn't inherit the zmq sockets of this one
+        ctx = mp.get_context('spawn')
+        self._commands = ctx.Queue()
+        self._free_slots = ctx.Queue()
+        for slot in range(self.nslots):
+            self._free_slots.put(slot)
+        self._errors = ctx.Queue()
+        self._error = None
+        self._process = ctx.Process(
+            target=_worker_main,
+            args=(setup, self._shm.name, self._commands, self._free_slots, self._errors, copy, init_opts)
+        )
+        self._process.daemon = True
+        self._process.start()
+
+    @property
+    def alive(self):
+        return self._process.is_alive()
+
+    def _check(self):
+        """
+        Logs the failures reported by the worker. Raises a PublishError if the
+        worker is no longer running.
+        """
+        while True:
+            try:
+                name, trace = self._errors.get_nowait()
+            except queue.Empty:
+                break
+            self._error = 'Publish worker failed in %s:\n%s' % (name, trace)
+            if LOG.isEnabledFor(logging.ERROR):
+                LOG.error(self._error)
+        if not self._process.is_alive():
+            raise PublishError(self._error or 'Publish worker is not running')
+
+    def submit(self, name, *args, **kwargs):
+        """
+        Has the worker call the function of the command 'name' with the rest of
+        the arguments. Numpy arrays are passed through shared memory and the
+        other arguments are pickled.
+
+        If all the slots are in use this waits for one to be freed, unless the
+        keyword argument 'block' is False, and gives up after 'timeout' seconds
+        (config.APP_TIMEOUT by default). Returns whether the command was sent.
+        Raises a PublishError if the worker is no longer running.
+        """
+        block = kwargs.pop('block', True)
+        timeout = kwargs.pop('timeout', config.APP_TIMEOUT)
+        names = list(kwargs)
+        values = list(args) + [kwargs[key] for key in names]
+        offsets = _slot_layout(values, self.slot_bytes)
+        self._check()
+        slot = self._get_slot(block, timeout)
+        if slot is None:
+            if LOG.isEnabledFor(logging.WARN):
+                LOG.warning('No free publish worker slot - command dropped: %s', name)
+            return False
+        encoded = _write_slot(self._shm.buf, slot * self.slot_bytes, values, offsets)
+        self._commands.put((name, slot, encoded[:len(args)], (names, encoded[len(args):])))
+        return True
+
+    def _get_slot(self, block, timeout):
+        """
+        Returns a free slot, or None if none is freed in time. While waiting
+        the worker is checked every config.APP_WORKER_POLL seconds, so a
+        stopped worker raises a PublishError without waiting for the timeout.
+        """
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            wait = config.APP_WORKER_POLL if end is None else min(config.APP_WORKER_POLL, end - time.time())
+            try:
+                return self._free_slots.get(block and wait > 0, max(wait, 0))
+            except queue.Empty:
+                if not block or (end is not None and time.time() >= end):
+                    return None
+            self._check()
+
+    def close(self, timeout=config.APP_TIMEOUT):
+        """
+        Stops the worker once it has handled the submitted commands and frees
+        the shared memory.
+        """
+        if self._process.is_alive():
+            self._commands.put(None)
+            self._process.join(timeout)
+            if self._process.is_alive():
+                if LOG.isEnabledFor(logging.WARN):
+                    LOG.warning('Publish worker did not stop in time - terminating it')
+                self._process.terminate()
+                self._process.join()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,6 +1,21 @@
 import os
 import re
+import sys
 from setuptools import setup
+from setuptools.command.build_py import build_py
+
+
+# modules which use syntax of newer versions of python
+PY3_MODULES = {
+    'aio': (3, 5),
+}
+
+
+class BuildPy(build_py):
+    """Leaves out modules which can't be compiled by the running python"""
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        return [(pkg, mod, path) for pkg, mod, path in modules if sys.version_info >= PY3_MODULES.get(mod, (0,))]
 
 
 def get_version(pkg):
@@ -23,6 +38,7 @@ setup(
     author_email='ddamiani@slac.stanford.edu',
     url='https://confluence.slac.stanford.edu/display/PSDM/Visualization+Tools',
     packages=['psmon'],
+    cmdclass={'build_py': BuildPy},
     install_requires=[
         'numpy',
         'pyzmq',
@@ -30,10 +46,15 @@ setup(
         'matplotlib',
         'ipython',
     ],
+    extras_require={
+        'lz4': ['lz4'],
+        'zstd': ['zstandard'],
+    },
     entry_points={
         'console_scripts': [
             'psplot = psmon.client:main',
             'psconsole = psmon.console:main',
+            'psrelay = psmon.relay:main',
         ]
     },
     classifiers=[
@@ -0,0 +1,129 @@
+import threading
+
+import pytest
+import zmq
+
+from psmon import app, config
+
+
+@pytest.fixture
+def context():
+    ctx = zmq.Context()
+    yield ctx
+    ctx.destroy(linger=0)
+
+
+def _listener(context, workers):
+    router = context.socket(zmq.ROUTER)
+    port = router.bind_to_random_port('tcp://127.0.0.1')
+    listener = app.ZMQListener(router, workers=workers)
+    listener.start()
+    dealer = context.socket(zmq.DEALER)
+    dealer.connect('tcp://127.0.0.1:%d' % port)
+    return listener, dealer
+
+
+def _request(dealer, req_id, header, body):
+    dealer.send_multipart([b'', req_id, header, body])
+    assert dealer.poll(5000), 'no reply to request %r' % req_id
+    return dealer.recv_multipart()
+
+
+@pytest.mark.parametrize('workers', [0, config.APP_COMM_WORKERS])
+def test_listener_survives_undecodable_header(context, workers):
+    _, dealer = _listener(context, workers)
+    _, req_id, _, _ = _request(dealer, b'1', b'\xff\xfe', b'body')
+    assert req_id == b'1'
+    _, req_id, header, reply = _request(dealer, b'2', config.RESYNC_REQ_HEADER.encode('utf-8'), b'topic')
+    assert req_id == b'2'
+    assert header.decode('utf-8') == config.RESYNC_REQ_HEADER
+    assert reply.decode('utf-8') == config.RESYNC_REP_STR % 'topic'
+
+
+def test_listener_survives_malformed_request(context):
+    _, dealer = _listener(context, 0)
+    dealer.send_multipart([b'only', b'garbage'])
+    _, req_id, _, reply = _request(dealer, b'3', config.RESYNC_REQ_HEADER.encode('utf-8'), b'topic')
+    assert req_id == b'3'
+    assert reply.decode('utf-8') == config.RESYNC_REP_STR % 'topic'
+
+
+def _concurrent(func, nthreads=8):
+    barrier = threading.Barrier(nthreads)
+
+    def run():
+        barrier.wait()
+        func()
+
+    threads = [threading.Thread(target=run) for _ in range(nthreads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_requester_sends_one_pending_reset_and_resync(context):
+    # nothing answers, so the first requests stay pending
+    dealer = context.socket(zmq.DEALER)
+    dealer.connect('tcp://127.0.0.1:1')
+    requester = app.ZMQRequester(dealer)
+    _concurrent(requester.send_reset_signal)
+    _concurrent(lambda: requester.send_resync_signal('topic'))
+    pending = [future.header for future, _ in requester._ZMQRequester__pending.values()]
+    assert sorted(pending) == sorted([config.RESET_REQ_HEADER, config.RESYNC_REQ_HEADER])
+
+
+def test_topic_reset_only_sets_its_topic():
+    flags = app.ResetFlags()
+    flags.set('a')
+    assert not flags.is_set()
+    assert flags.is_set('a')
+    assert not flags.is_set('b')
+    assert flags.consume('a')
+    assert not flags.consume('a')
+    assert not flags.consume('b')
+
+
+def test_global_reset_sets_every_topic_once():
+    flags = app.ResetFlags()
+    flags.set()
+    assert flags.is_set()
+    assert flags.consume('a')
+    assert not flags.consume('a')
+    # the global flag is only cleared explicitly
+    assert flags.is_set()
+    assert flags.consume('b')
+
+
+def test_clearing_global_flag_keeps_unconsumed_resets():
+    flags = app.ResetFlags()
+    flags.set('a')
+    flags.set()
+    flags.clear()
+    assert not flags.is_set()
+    assert flags.consume('a')
+    assert flags.consume('b')
+    assert not flags.consume('a')
+
+
+def test_clearing_topic_keeps_other_topics():
+    flags = app.ResetFlags()
+    flags.set()
+    flags.set('b')
+    flags.clear('a')
+    assert not flags.is_set('a')
+    assert not flags.consume('a')
+    assert flags.is_set()
+    assert flags.consume('b')
+    assert not flags.consume('b')
+
+
+def test_reset_after_consume_is_seen_again():
+    flags = app.ResetFlags()
+    flags.set()
+    assert flags.consume('a')
+    flags.set('a')
+    assert flags.consume('a')
+    flags.set()
+    assert flags.consume('a')
+    assert not flags.consume('a')
@@ -0,0 +1,54 @@
+import time
+import datetime as dt
+
+import numpy as np
+import pytest
+
+from psmon import util
+
+
+@pytest.fixture
+def pacific_time(monkeypatch):
+    if not hasattr(time, 'tzset'):
+        pytest.skip('time.tzset is not available on this platform')
+    monkeypatch.setenv('TZ', 'America/Los_Angeles')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def _timestamps():
+    # a year of data spanning the March and November 2024 changes of daylight saving time
+    utc = [
+        dt.datetime(2024, 1, 15, 12, 0, 0),
+        dt.datetime(2024, 3, 10, 9, 59, 59),
+        dt.datetime(2024, 3, 10, 10, 0, 0),
+        dt.datetime(2024, 7, 15, 12, 0, 0),
+        dt.datetime(2024, 11, 3, 8, 59, 59),
+        dt.datetime(2024, 11, 3, 9, 0, 0),
+        dt.datetime(2024, 12, 15, 12, 0, 0),
+    ]
+    epoch = dt.datetime(1970, 1, 1)
+    return np.array([(when - epoch).total_seconds() + 0.25 for when in utc])
+
+
+def test_ts_to_str_across_dst_changes(pacific_time):
+    timestamps = _timestamps()
+    expected = [dt.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') for ts in timestamps]
+    assert list(util.ts_to_str(timestamps)) == expected
+    # the summer point is on daylight saving time
+    assert expected[3] == '2024-07-15 05:00:00'
+
+
+def test_ts_to_dt64_across_dst_changes(pacific_time):
+    timestamps = _timestamps()
+    expected = np.array([dt.datetime.fromtimestamp(ts) for ts in timestamps], dtype='datetime64[us]')
+    np.testing.assert_array_equal(util.ts_to_dt64(timestamps), expected)
+
+
+def test_ts_to_dt64_non_finite(pacific_time):
+    timestamps = np.append(_timestamps(), [np.nan, np.inf])
+    dates = util.ts_to_dt64(timestamps)
+    assert np.isnat(dates[-2:]).all()
+    assert not np.isnat(dates[:-2]).any()
@@ -0,0 +1,86 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from psmon import app, worker
+
+pytestmark = pytest.mark.skipif(worker.shared_memory is None, reason='requires multiprocessing.shared_memory')
+
+
+def _write(topic, data):
+    with open(os.environ['PSMON_TEST_WORKER_OUT'], 'a') as out:
+        out.write('%s %s\n' % (topic, ' '.join('%g' % value for value in data.values)))
+
+
+def _setup():
+    # runs in the worker process
+    from psmon import plotting
+
+    gauge = plotting.Gauge('gauge', 100, publisher=_write)
+
+    def add(values, scale=1):
+        for value in values:
+            gauge.add(value * scale)
+
+    def fail():
+        raise RuntimeError('command failed')
+
+    return {'add': add, 'fail': fail}, [gauge]
+
+
+def _failing_setup():
+    raise RuntimeError('setup failed')
+
+
+@pytest.fixture
+def output(tmp_path, monkeypatch):
+    path = tmp_path / 'published'
+    monkeypatch.setenv('PSMON_TEST_WORKER_OUT', str(path))
+    return path
+
+
+def _wait_for(condition, timeout=30):
+    end = time.time() + timeout
+    while not condition():
+        assert time.time() < end, 'timed out waiting for the publish worker'
+        time.sleep(0.05)
+
+
+def test_worker_round_trip(output):
+    with worker.PublishWorker(_setup, nslots=2) as pub_worker:
+        assert pub_worker.submit('add', np.arange(3.0))
+        assert pub_worker.submit('add', np.array([5.0]), scale=2)
+    published = output.read_text().split()
+    assert published[0] == 'gauge'
+    assert [float(value) for value in published if value != 'gauge'] == [0, 1, 2, 10]
+
+
+def test_worker_reports_failed_setup(output):
+    pub_worker = worker.PublishWorker(_failing_setup, nslots=1)
+    try:
+        _wait_for(lambda: not pub_worker.alive)
+        start = time.time()
+        with pytest.raises(app.PublishError, match='setup failed'):
+            pub_worker.submit('add', np.arange(3.0))
+        assert time.time() - start < 1
+    finally:
+        pub_worker.close()
+
+
+def test_worker_stopping_while_waiting_for_slot(output):
+    pub_worker = worker.PublishWorker(_failing_setup, nslots=1)
+    try:
+        # the single slot may be taken before the worker has stopped
+        with pytest.raises(app.PublishError):
+            for _ in range(3):
+                pub_worker.submit('add', np.arange(3.0), timeout=30)
+    finally:
+        pub_worker.close()
+
+
+def test_worker_reports_failed_command(output, caplog):
+    with worker.PublishWorker(_setup, nslots=2) as pub_worker:
+        assert pub_worker.submit('fail')
+        _wait_for(lambda: pub_worker.submit('add', np.array([1.0])) and 'command failed' in caplog.text)